@@ -0,0 +1,186 @@
+import io
+import os
+import json
+import hashlib
+import numpy as np
+from PIL import Image
+
+from southParkAvatarGenerator import SouthParkAvatarGenerator, Layer, natural_key
+
+
+#--------------------------------------------------------------#
+# Asset compiler (spag-compile)                                #
+#--------------------------------------------------------------#
+# Scans an images folder once and writes its manifest (<images>/assets.json), which the
+# generator then loads instead of walking the folder:
+#
+#   {"version": 1, "canvas": [745, 811],
+#    "stages": [["hair_bg", "hair"], ["body", null], ...],
+#    "body": {"<part>": {"file", "sha256", "bbox", "tint"}},
+#    "categories": {"<category>": {"items": [{"name", "weight", "layers": [{"file", "sha256", "bbox", "role", "tint"}]}]}}}
+#
+# - the items and their layers are in natural order of their names, so an item keeps its
+#   index whatever the file system, and new items only take new indices when their names sort last
+# - the role of a layer ('bg' for the tintable background, else 'fg') is read from the file
+#   name here, once; the generator takes it from the manifest
+# - bbox is the (top, left, bottom, right) box of the visible pixels, so loading a layer
+#   doesn't scan it, sha256 lets --check find changed files
+# - the canvas is the size of body/body.png, every layer must be an RGBA png of that size and
+#   every body part must be there
+# - stages is the paint order (the stages of layer_stages, the attribute which picks the item of each)
+# - the tint of a layer is {"rule": "eq255" | "gt0", "colour": "skin" | "hair" | "beard" | "shirt" | "trouser"}
+#   or null for a layer which is never recoloured, new layers get the generator's default_tint
+# - the weights, stages and tints of a recompiled manifest are kept (by category and item name,
+#   and by file), new items weigh 1
+#
+# --pack also compiles an asset pack (the layers and their precomputed tint masks, see build_pack).
+
+def layer_entry(images_path, file, canvas, errors):
+    # the manifest entry of a png (None, and an error, when it is not a valid layer)
+    with open(os.path.join(images_path, file), 'rb') as f:
+        data = f.read()
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception as e:
+        errors.append(f'{file}: not an image ({e})')
+        return None
+    if image.mode != 'RGBA':
+        errors.append(f'{file}: mode {image.mode}, expected RGBA')
+        return None
+    if image.size != canvas:
+        errors.append(f'{file}: size {image.size}, expected {canvas}')
+        return None
+    layer = Layer.trim(np.asarray(image))
+    h, w = layer.shape
+    return {'file': file, 'sha256': hashlib.sha256(data).hexdigest(),
+            'bbox': [layer.top, layer.left, layer.top + h, layer.left + w]}
+
+
+def tint_entry(rule, colour):
+    return None if rule is None else {'rule': rule, 'colour': colour}
+
+
+def compile_manifest(images_path, previous = None):
+    # (manifest, errors) of an images folder, previous: the manifest to take the weights, stages and tints from
+    errors = []
+    previous = previous or {}
+    weights = {(category, item['name']): item.get('weight', 1.0)
+               for category, entry in previous.get('categories', {}).items() for item in entry['items']}
+    tints = {layer['file']: layer['tint'] for layer in manifest_layers(previous) if 'tint' in layer}
+
+    # the canvas is the size of the body
+    canvas = SouthParkAvatarGenerator.canvas_size
+    try:
+        with Image.open(os.path.join(images_path, 'body/body.png')) as image:
+            canvas = image.size
+    except (OSError, ValueError):
+        pass
+
+    body = {}
+    for part in SouthParkAvatarGenerator.body_part_names:
+        file = f'body/{part}.png'
+        if not os.path.exists(os.path.join(images_path, file)):
+            errors.append(f'{file}: missing body part')
+            continue
+        entry = layer_entry(images_path, file, canvas, errors)
+        if entry is not None:
+            entry['tint'] = tints.get(file, tint_entry(*SouthParkAvatarGenerator.default_tint('body', part, 0)))
+            body[part] = entry
+
+    categories = {}
+    for category in SouthParkAvatarGenerator.pack_categories:
+        folder = os.path.join(images_path, category)
+        if not os.path.isdir(folder):
+            errors.append(f'{category}: missing folder')
+            continue
+        items = []
+        for name in sorted(os.listdir(folder), key=natural_key):
+            if not os.path.isdir(os.path.join(folder, name)):
+                continue
+            layers = []
+            positions = {}
+            for file in sorted(os.listdir(os.path.join(folder, name)), key=natural_key):
+                if not file.endswith('.png'):
+                    continue
+                entry = layer_entry(images_path, f'{category}/{name}/{file}', canvas, errors)
+                if entry is not None:
+                    role = entry['role'] = 'bg' if 'bg' in file else 'fg'
+                    position = positions[role] = positions.get(role, -1) + 1
+                    entry['tint'] = tints.get(entry['file'], tint_entry(*SouthParkAvatarGenerator.default_tint(category, role, position)))
+                    layers.append(entry)
+            if not layers:
+                errors.append(f'{category}/{name}: no layers')
+            items.append({'name': name, 'weight': weights.get((category, name), 1.0), 'layers': layers})
+        if not items:
+            errors.append(f'{category}: no items')
+        categories[category] = {'items': items}
+
+    stages = previous.get('stages', [list(stage) for stage in SouthParkAvatarGenerator.layer_stages])
+    manifest = {'version': 1, 'canvas': list(canvas), 'stages': stages, 'body': body, 'categories': categories}
+    return manifest, errors
+
+
+def manifest_layers(manifest):
+    # every layer entry of a manifest, the body parts first
+    layers = list(manifest.get('body', {}).values())
+    for category in manifest.get('categories', {}).values():
+        for item in category['items']:
+            layers += item['layers']
+    return layers
+
+
+def manifest_files(manifest):
+    # {file: sha256} of every layer of a manifest
+    return {layer['file']: layer['sha256'] for layer in manifest_layers(manifest)}
+
+
+def check_manifest(manifest, current):
+    # the differences between a manifest and the current images folder (as a compiled manifest)
+    old, new = manifest_files(manifest), manifest_files(current)
+    return ([f'changed: {file}' for file in sorted(old.keys() & new.keys(), key=natural_key) if old[file] != new[file]] +
+            [f'removed: {file}' for file in sorted(old.keys() - new.keys(), key=natural_key)] +
+            [f'added: {file}' for file in sorted(new.keys() - old.keys(), key=natural_key)])
+
+
+def compile_assets(images_path, out = None, pack_path = None):
+    # compile (validate, measure and hash) an images folder into its manifest and optionally an asset pack,
+    # returns (manifest, errors); nothing is written when there are errors
+    out = out or os.path.join(images_path, 'assets.json')
+    previous = SouthParkAvatarGenerator.load_manifest(out) if os.path.exists(out) else None
+    manifest, errors = compile_manifest(images_path, previous)
+    if errors:
+        return manifest, errors
+    with open(out, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    if pack_path is not None:
+        SouthParkAvatarGenerator(images_path, manifest_path=out).build_pack(pack_path)
+    return manifest, errors
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+    parser = argparse.ArgumentParser(prog='spag-compile', description='validate an images folder and write its asset manifest')
+    parser.add_argument('images', nargs='?', default='images', help='the images folder')
+    parser.add_argument('--out', default=None, help='the manifest to write (default: <images>/assets.json)')
+    parser.add_argument('--pack', default=None, help='also compile an asset pack')
+    parser.add_argument('--check', action='store_true', help='only compare the manifest with the images folder')
+    args = parser.parse_args()
+
+    out = args.out or os.path.join(args.images, 'assets.json')
+    if args.check:
+        manifest = SouthParkAvatarGenerator.load_manifest(out)
+        current, errors = compile_manifest(args.images, manifest)
+        differences = errors + check_manifest(manifest, current)
+        print('\n'.join(differences) if differences else f'{out} is up to date')
+        sys.exit(1 if differences else 0)
+
+    manifest, errors = compile_assets(args.images, out, args.pack)
+    if errors:
+        print('\n'.join(errors))
+        sys.exit(1)
+    items = {category: len(entry['items']) for category, entry in manifest['categories'].items()}
+    print(f'{out}: {len(manifest_files(manifest))} layers, ' + ', '.join(f'{c} {n}' for c, n in items.items()))
+    if args.pack:
+        print(f'pack: {args.pack}')
@@ -0,0 +1,138 @@
+import io
+import os
+import json
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+from southParkAvatarGenerator import SouthParkAvatarGenerator, Genome
+
+
+#--------------------------------------------------------------#
+# Dataset export                                               #
+#--------------------------------------------------------------#
+# Avatar i of a dataset is the avatar of seed (seed + i), so a dataset can be
+# split over machines (by seed) and every avatar can be re-rendered from its
+# genome. The avatars are written in shards of shard_size avatars:
+#
+#   format='tar': shard-00000.tar with <key>.png and <key>.json (webdataset style)
+#   format='npy': shard-00000.npy, a (shard_size, height, width, 4) uint8 array
+#   format='png': shard-00000/<key>.png
+#
+# next to a sidecar index: index.jsonl (one line per avatar: its shard, key, packed
+# genome and attributes) and genomes.npy (an (n, 12) int16 array of the genomes).
+# The png encoding runs on a thread pool (zlib releases the GIL) while the next
+# batch is rendered, and at most max_pending avatars are waiting to be written.
+
+def encode_png(avatar, compress_level = 6):
+    buffer = io.BytesIO()
+    Image.fromarray(avatar).save(buffer, 'PNG', compress_level=compress_level)
+    return buffer.getvalue()
+
+
+def write_png(path, avatar, compress_level = 6):
+    with open(path, 'wb') as f:
+        f.write(encode_png(avatar, compress_level))
+    return path
+
+
+def export_dataset(spag, n, out_dir, shard_size = 1000, format = 'tar', seed = 0, batch_size = 32,
+                   workers = None, compress_level = 6, max_pending = None):
+    if format not in ('tar', 'npy', 'png'):
+        raise ValueError(f'unknown dataset format: {format}')
+    os.makedirs(out_dir, exist_ok=True)
+    batch_size = min(batch_size, shard_size)
+    max_pending = max_pending or min(shard_size, 2 * batch_size)
+
+    genomes = np.lib.format.open_memmap(os.path.join(out_dir, 'genomes.npy'), mode='w+', dtype=np.int16,
+                                        shape=(n, len(Genome._fields)))
+    shards = []
+    with open(os.path.join(out_dir, 'index.jsonl'), 'w') as index, ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        tar = None
+
+        def write(entry):
+            # write the oldest pending avatar (in order) and its index line
+            i, shard, key, genome, result = entry
+            if format == 'tar':
+                png = result.result()
+                for name, data in ((f'{key}.png', png), (f'{key}.json', json.dumps(genome._asdict()).encode())):
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+            elif format == 'png':
+                result.result()
+            genomes[i] = genome
+            index.write(json.dumps({'index': i, 'shard': shard, 'key': key,
+                                    'genome': SouthParkAvatarGenerator.pack_genome(genome),
+                                    'attributes': genome._asdict()}) + '\n')
+
+        for shard_start in range(0, n, shard_size):
+            shard_count = min(shard_size, n - shard_start)
+            shard = f'shard-{shard_start // shard_size:05d}' + ('.tar' if format == 'tar' else '.npy' if format == 'npy' else '')
+            shard_path = os.path.join(out_dir, shard)
+            shards.append(shard)
+            if format == 'tar':
+                tar = tarfile.open(shard_path, 'w')
+            elif format == 'npy':
+                array = np.lib.format.open_memmap(shard_path, mode='w+', dtype=np.uint8, shape=(shard_count,) + spag.canvas_shape)
+            else:
+                os.makedirs(shard_path, exist_ok=True)
+
+            for start in range(shard_start, shard_start + shard_count, batch_size):
+                count = min(batch_size, shard_start + shard_count - start)
+                seeds = range(seed + start, seed + start + count)
+                if format == 'npy':
+                    # render straight into the memory-mapped shard
+                    out = array[start - shard_start:start - shard_start + count]
+                    avatars, batch_genomes = spag.generate_batch(seeds=seeds, out=out, return_genomes=True)
+                else:
+                    avatars, batch_genomes = spag.generate_batch(seeds=seeds, return_genomes=True)
+
+                for j, genome in enumerate(batch_genomes):
+                    i = start + j
+                    key = f'{i:09d}'
+                    result = None
+                    if format == 'tar':
+                        result = pool.submit(encode_png, avatars[j], compress_level)
+                    elif format == 'png':
+                        result = pool.submit(write_png, os.path.join(shard_path, f'{key}.png'), avatars[j], compress_level)
+                    pending.append((i, shard, key, genome, result))
+                    while len(pending) > max_pending:
+                        write(pending.popleft())
+                del avatars
+
+            # finish the shard before the next one is opened
+            while pending:
+                write(pending.popleft())
+            if format == 'tar':
+                tar.close()
+            elif format == 'npy':
+                array.flush()
+                del array
+
+    genomes.flush()
+    return {'n': n, 'format': format, 'shards': shards,
+            'index': os.path.join(out_dir, 'index.jsonl'), 'genomes': os.path.join(out_dir, 'genomes.npy')}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='export a dataset of random avatars')
+    parser.add_argument('out_dir')
+    parser.add_argument('-n', type=int, default=1000, help='number of avatars')
+    parser.add_argument('--images', default='images', help='the images folder')
+    parser.add_argument('--pack', default=None, help='an asset pack (instead of the images folder)')
+    parser.add_argument('--format', default='tar', choices=['tar', 'npy', 'png'])
+    parser.add_argument('--shard-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0, help='avatar i is rendered from seed + i')
+    parser.add_argument('--workers', type=int, default=None, help='png encoding threads')
+    parser.add_argument('--compress-level', type=int, default=6)
+    args = parser.parse_args()
+
+    spag = SouthParkAvatarGenerator(args.images, pack_path=args.pack)
+    summary = export_dataset(spag, args.n, args.out_dir, shard_size=args.shard_size, format=args.format,
+                             seed=args.seed, workers=args.workers, compress_level=args.compress_level)
+    print(json.dumps(summary, indent=2))
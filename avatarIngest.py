@@ -0,0 +1,285 @@
+import io
+import os
+import re
+import json
+import base64
+import asyncio
+import hashlib
+import urllib.error
+import urllib.request
+from datetime import datetime
+from PIL import Image
+
+
+#--------------------------------------------------------------#
+# Asset ingest                                                 #
+#--------------------------------------------------------------#
+# Replaces download_southpark_items.ipynb: the images are the urls which the south park
+# avatar site requested while every item was clicked, saved as a HAR file. The HAR is
+# read entry by entry (it can be large, it may hold the response bodies), the category
+# and item of an image come from the pauses between the clicks (as in the notebook: a
+# pause of more than category_gap seconds starts the next category, one of more than
+# item_gap seconds the next item), the images are fetched concurrently (with retries)
+# and written into the layout the generator reads:
+#
+#   <out>/<category>/<item>/<n>.png (or <n>_bg.png for the tintable background layers)
+#   <out>/body/<part>.png           (when body_parts names the body images, in click order)
+#   <out>/manifest.json             (url, sha256, time ... of every image, and the failures)
+#
+# and, when pack_path is given and the body parts are there, compiled into an asset pack
+# (trimmed layers and tint masks, see SouthParkAvatarGenerator.build_pack).
+# A response is taken from the HAR itself (when it was saved with its content), from
+# cache_dir (<cache_dir>/<sha256 of the url>) or from the network; fetched responses are
+# written to cache_dir, so a second run (or offline=True) doesn't need the network.
+
+# the categories in the order in which they were clicked (the generator's folder names)
+CATEGORIES = ['body', 'eyes', 'mouth', 'hair', 'shirt', 'trousers', 'hats', 'items', 'glasses', 'beards', 'pins', 'jewellery']
+
+# the urls which are avatar layers
+URL_PATTERN = re.compile(r'(prop|image_bg)\.png')
+
+
+def iter_har_entries(path, chunk_size = 1 << 16):
+    # stream the entries of log.entries out of a HAR file, without loading the whole file
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buffer = ''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buffer += chunk
+            match = re.search(r'"entries"\s*:\s*\[', buffer)
+            if match:
+                buffer = buffer[match.end():]
+                break
+            buffer = buffer[-64:]
+
+        pos, size = 0, chunk_size
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                if pos >= len(buffer):
+                    raise json.JSONDecodeError('need more data', buffer, pos)
+                entry, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # an entry which isn't complete yet, read more (twice as much for big entries)
+                chunk = f.read(size)
+                if not chunk:
+                    if buffer[pos:].strip():
+                        raise
+                    return
+                buffer, pos, size = buffer[pos:] + chunk, 0, size * 2
+                continue
+            size = chunk_size
+            yield entry
+            if pos > chunk_size:
+                buffer, pos = buffer[pos:], 0
+
+
+def har_images(path, url_pattern = URL_PATTERN):
+    # the avatar images of a HAR, sorted by time: dicts with time, url, bg and the body (if it was saved)
+    images = []
+    for entry in iter_har_entries(path):
+        url = entry.get('request', {}).get('url')
+        if not url or not url_pattern.search(url):
+            continue
+        content = entry.get('response', {}).get('content', {})
+        body = None
+        if content.get('text') and content.get('encoding') == 'base64':
+            body = base64.b64decode(content['text'])
+        name = url.rsplit('/', 1)[-1].split('?', 1)[0]
+        images.append({'time': datetime.fromisoformat(entry['startedDateTime'].replace('Z', '+00:00')).timestamp(),
+                       'url': url, 'bg': 'bg' in name, 'body': body})
+    images.sort(key=lambda image: image['time'])
+    return images
+
+
+def assign_items(images, categories = CATEGORIES, category_gap = 15, item_gap = 0.7):
+    # the category and item of every image, from the pauses between them. The same url
+    # within an item (a double click) is only kept once
+    category, item, previous = 0, 0, None
+    seen = set()
+    assigned = []
+    for image in images:
+        if previous is not None:
+            pause = image['time'] - previous
+            if pause > category_gap:
+                category, item = category + 1, 0
+            elif pause > item_gap:
+                item += 1
+        previous = image['time']
+        if category >= len(categories):
+            raise ValueError(f'more pauses than categories ({len(categories)}), check category_gap')
+        if (category, item, image['url']) in seen:
+            continue
+        seen.add((category, item, image['url']))
+        assigned.append(dict(image, category=categories[category], item=item))
+    return assigned
+
+
+#------------------------------#
+# Fetching                     #
+#------------------------------#
+def cache_path(cache_dir, url):
+    return os.path.join(cache_dir, hashlib.sha256(url.encode()).hexdigest())
+
+
+class RetryableError(Exception):
+    pass
+
+
+async def fetch_all(urls, cache_dir = None, offline = False, concurrency = 16, retries = 3, timeout = 10):
+    # {url: bytes or the exception} for every url; from cache_dir when it is there, else fetched
+    # with aiohttp (a pooled session) when it is installed, or urllib on a thread pool
+    results = {}
+    missing = []
+    for url in urls:
+        path = cache_path(cache_dir, url) if cache_dir else None
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                results[url] = f.read()
+        elif offline:
+            results[url] = FileNotFoundError(f'{url} is not in the cache (offline)')
+        else:
+            missing.append(url)
+    if not missing:
+        return results
+
+    semaphore = asyncio.Semaphore(concurrency)
+    try:
+        import aiohttp
+    except ImportError:
+        aiohttp = None
+
+    async def get(session, url):
+        if aiohttp is not None:
+            async with session.get(url) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise RetryableError(f'{url}: {response.status}')
+                response.raise_for_status()
+                return await response.read()
+
+        def get_urllib():
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    return response.read()
+            except urllib.error.HTTPError as e:
+                if e.code == 429 or e.code >= 500:
+                    raise RetryableError(f'{url}: {e.code}') from e
+                raise
+        return await asyncio.get_running_loop().run_in_executor(None, get_urllib)
+
+    async def fetch(session, url):
+        async with semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    body = await get(session, url)
+                    break
+                except (RetryableError, OSError, asyncio.TimeoutError) as e:
+                    if isinstance(e, urllib.error.HTTPError) or attempt == retries:
+                        results[url] = e
+                        return
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+                except Exception as e:
+                    results[url] = e
+                    return
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_path(cache_dir, url), 'wb') as f:
+                f.write(body)
+        results[url] = body
+
+    if aiohttp is not None:
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            await asyncio.gather(*[fetch(session, url) for url in missing])
+    else:
+        await asyncio.gather(*[fetch(None, url) for url in missing])
+    return results
+
+
+#------------------------------#
+# Ingest                       #
+#------------------------------#
+def ingest(har_path, out_dir, pack_path = None, cache_dir = None, offline = False, categories = CATEGORIES,
+           body_parts = None, category_gap = 15, item_gap = 0.7, concurrency = 16, retries = 3):
+    # HAR -> images tree (+ manifest, + asset pack), returns a summary
+    images = assign_items(har_images(har_path), categories, category_gap, item_gap)
+    urls = [image['url'] for image in images if image['body'] is None]
+    fetched = asyncio.run(fetch_all(list(dict.fromkeys(urls)), cache_dir, offline, concurrency, retries))
+
+    manifest, failed = [], []
+    counts, hashes = {}, {}
+    body_index = 0
+    for image in images:
+        body = image['body'] if image['body'] is not None else fetched[image['url']]
+        if isinstance(body, Exception):
+            failed.append({'url': image['url'], 'error': repr(body)})
+            continue
+        try:
+            Image.open(io.BytesIO(body)).verify()
+        except Exception as e:
+            failed.append({'url': image['url'], 'error': f'not an image: {e!r}'})
+            continue
+
+        # the same picture twice in one item is only written once
+        digest = hashlib.sha256(body).hexdigest()
+        item = (image['category'], image['item'])
+        if digest in hashes.setdefault(item, set()):
+            continue
+        hashes[item].add(digest)
+
+        if image['category'] == 'body' and body_parts is not None:
+            if body_index >= len(body_parts):
+                raise ValueError(f'more body images than body_parts ({len(body_parts)})')
+            name = f'body/{body_parts[body_index]}.png'
+            body_index += 1
+        else:
+            n = counts.get(item, 0)
+            counts[item] = n + 1
+            name = f'{image["category"]}/{image["item"]}/{n}{"_bg" if image["bg"] else ""}.png'
+        os.makedirs(os.path.dirname(os.path.join(out_dir, name)), exist_ok=True)
+        with open(os.path.join(out_dir, name), 'wb') as f:
+            f.write(body)
+        manifest.append({'file': name, 'url': image['url'], 'sha256': digest, 'bytes': len(body),
+                         'category': image['category'], 'item': image['item'], 'time': image['time']})
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump({'har': os.path.basename(har_path), 'images': manifest, 'failed': failed}, f, indent=1)
+
+    summary = {'images': len(manifest), 'failed': len(failed),
+               'items': {category: len({i for c, i in counts if c == category}) for category in categories}}
+    if pack_path is not None:
+        from southParkAvatarGenerator import SouthParkAvatarGenerator
+        if body_parts is None:
+            raise ValueError('a pack needs the body parts, name them with body_parts')
+        SouthParkAvatarGenerator(out_dir).build_pack(pack_path)
+        summary['pack'] = pack_path
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='download the avatar images of a HAR file into an images folder')
+    parser.add_argument('har', help='the HAR file of the avatar site')
+    parser.add_argument('--out', default='images', help='the images folder to write')
+    parser.add_argument('--pack', default=None, help='also compile an asset pack')
+    parser.add_argument('--cache-dir', default=None, help='cached responses (read, and written when fetching)')
+    parser.add_argument('--offline', action='store_true', help='only use the HAR and the cache')
+    parser.add_argument('--body-parts', default=None,
+                        help='comma separated names of the body images in click order (body,head,chin,...)')
+    parser.add_argument('--category-gap', type=float, default=15, help='seconds between two categories')
+    parser.add_argument('--item-gap', type=float, default=0.7, help='seconds between two items')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--retries', type=int, default=3)
+    args = parser.parse_args()
+
+    body_parts = args.body_parts.split(',') if args.body_parts else None
+    summary = ingest(args.har, args.out, pack_path=args.pack, cache_dir=args.cache_dir, offline=args.offline,
+                     body_parts=body_parts, category_gap=args.category_gap, item_gap=args.item_gap,
+                     concurrency=args.concurrency, retries=args.retries)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,222 @@
+import json
+import asyncio
+from urllib.parse import urlsplit, parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+
+from southParkAvatarGenerator import SouthParkAvatarGenerator, RenderCache
+
+
+#--------------------------------------------------------------#
+# Async HTTP avatar service                                    #
+#--------------------------------------------------------------#
+#   GET /avatar/<seed>.png                 the avatar of a seed
+#   GET /avatar?skin_colour=1&hair=3&...   an avatar with these attributes (the rest is drawn,
+#                                          from seed=... when it is given)
+#   GET /stats                             queue and cache counters (json)
+#
+# both avatar endpoints take size=... (see generate(size=...)). The attributes are drawn on
+# the event loop (it is cheap and the generator's rng is not thread safe), the rendering
+# and png encoding run on a thread pool. Requests for the same genome which arrive while
+# it renders wait for that render instead of starting another one, and when max_pending
+# different avatars are already queued the server answers 503 (with Retry-After) instead
+# of queueing more. The ETag of an avatar is its packed genome (and size), so clients can
+# revalidate with If-None-Match without a render.
+
+STATUS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+          405: 'Method Not Allowed', 503: 'Service Unavailable'}
+
+# the query parameters which are passed to sample_genome (skin is short for skin_colour)
+ATTRIBUTES = ('skin_colour', 'hair_colour', 'shirt_colour', 'eyes', 'mouth', 'shirt', 'trouser',
+              'has_hair', 'hair', 'has_glasses', 'glasses', 'has_beard', 'beard')
+ALIASES = {'skin': 'skin_colour'}
+
+
+class AvatarServer:
+    def __init__(self, spag = None, images_path = 'images', pack_path = None, workers = None,
+                       max_pending = 64, cache_bytes = 64 * 2**20, compress_level = 6):
+        # the renders run on several threads, with the generator's thread-safe render()
+        self.spag = spag if spag is not None else SouthParkAvatarGenerator(images_path, pack_path=pack_path)
+        self.executor = ThreadPoolExecutor(workers)
+        self.max_pending = max_pending
+        self.compress_level = compress_level
+        self.cache = RenderCache(cache_bytes, format='png', compress_level=compress_level) if cache_bytes else None
+        self.pending = {}
+        self.counters = {'requests': 0, 'renders': 0, 'coalesced': 0, 'not_modified': 0, 'rejected': 0}
+
+    #------------------------------#
+    # Avatars                      #
+    #------------------------------#
+    def genome(self, seed, attributes):
+        # draw the genome on the event loop thread, a seeded one from its own rng
+        # (see seeded_genome), so that it doesn't change the draws of unseeded requests
+        if seed is not None:
+            return self.spag.seeded_genome(seed, **attributes)
+        return self.spag.sample_genome(**attributes)
+
+    def etag(self, genome, size):
+        return f'"{self.spag.pack_genome(genome):x}-{size or "full"}"'
+
+    def render(self, genome, size):
+        # runs on the thread pool: the png of a genome
+        key = (genome, size)
+        if size is None:
+            avatar = self.spag.render(genome)
+        else:
+            avatar = self.spag.render_scaled(genome, size)
+        # a palette png when the avatar has few enough colours (see encode)
+        png = self.spag.encode(avatar, level=self.compress_level)
+        if self.cache is not None:
+            return self.cache.put(key, png)
+        return png
+
+    async def avatar(self, genome, size):
+        # the cached png, or coalesce concurrent requests for the same avatar and push back when too many are queued
+        key = (genome, size)
+        png = self.cache.get(key) if self.cache is not None else None
+        if png is not None:
+            return png
+        future = self.pending.get(key)
+        if future is not None:
+            self.counters['coalesced'] += 1
+            return await asyncio.shield(future)
+        if len(self.pending) >= self.max_pending:
+            self.counters['rejected'] += 1
+            return None
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self.render, genome, size)
+        self.pending[key] = future
+        self.counters['renders'] += 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+    #------------------------------#
+    # HTTP                         #
+    #------------------------------#
+    def parse_query(self, path, query):
+        # (seed, attributes, size) of an avatar request, a ValueError for a bad request
+        params = dict(parse_qsl(query))
+        seed = params.pop('seed', None)
+        if path.startswith('/avatar/'):
+            name = path[len('/avatar/'):]
+            if not name.endswith('.png'):
+                raise ValueError(f'not an avatar: {path}')
+            seed = name[:-len('.png')]
+        seed = int(seed) if seed is not None else None
+        if seed is not None and seed < 0:
+            raise ValueError('the seed must not be negative')
+        size = params.pop('size', None)
+        size = int(size) if size is not None else None
+        if size is not None and not 1 <= size <= 1024:
+            raise ValueError('size must be between 1 and 1024')
+        attributes = {}
+        for name, value in params.items():
+            name = ALIASES.get(name, name)
+            if name not in ATTRIBUTES:
+                raise ValueError(f'unknown attribute: {name}')
+            attributes[name] = int(value)
+            # an out of range attribute would be drawn at random (see set_property), which is a bad request
+            values = (0, 1) if name.startswith('has_') else self.spag.attribute_values(name)
+            if attributes[name] not in values:
+                raise ValueError(f'{name} has no value {value}')
+        return seed, attributes, size
+
+    async def respond(self, method, target, headers):
+        # (status, headers, body) of a request
+        url = urlsplit(target)
+        if method not in ('GET', 'HEAD'):
+            return 405, {'Allow': 'GET, HEAD'}, b''
+        if url.path == '/stats':
+            stats = dict(self.counters, pending=len(self.pending))
+            if self.cache is not None:
+                stats['cache'] = self.cache.stats()
+            return 200, {'Content-Type': 'application/json'}, json.dumps(stats).encode()
+        if url.path != '/avatar' and not url.path.startswith('/avatar/'):
+            return 404, {}, b''
+
+        try:
+            seed, attributes, size = self.parse_query(url.path, url.query)
+        except ValueError as e:
+            return 400, {'Content-Type': 'text/plain'}, str(e).encode()
+        genome = self.genome(seed, attributes)
+        etag = self.etag(genome, size)
+        # a random avatar (no seed) must not be cached by the client
+        cache_control = 'public, max-age=86400' if seed is not None else 'no-cache'
+        if etag in (tag.strip() for tag in headers.get('if-none-match', '').split(',')):
+            self.counters['not_modified'] += 1
+            return 304, {'ETag': etag, 'Cache-Control': cache_control}, b''
+
+        png = await self.avatar(genome, size)
+        if png is None:
+            return 503, {'Retry-After': '1', 'Content-Type': 'text/plain'}, b'too many pending renders'
+        return 200, {'Content-Type': 'image/png', 'ETag': etag, 'Cache-Control': cache_control}, png
+
+    async def handle(self, reader, writer):
+        # a (keep-alive) HTTP/1.1 connection
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                self.counters['requests'] += 1
+                status, response_headers, body = await self.respond(method, target, headers)
+                keep_alive = (version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                              or headers.get('connection', '').lower() == 'keep-alive')
+                response_headers['Content-Length'] = str(len(body))
+                response_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+                head = f'HTTP/1.1 {status} {STATUS[status]}\r\n'
+                head += ''.join(f'{name}: {value}\r\n' for name, value in response_headers.items())
+                writer.write(head.encode('latin-1') + b'\r\n' + (body if method != 'HEAD' else b''))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host = '127.0.0.1', port = 8000):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='serve avatars over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--images', default='images', help='the images folder')
+    parser.add_argument('--pack', default=None, help='an asset pack (instead of the images folder)')
+    parser.add_argument('--workers', type=int, default=None, help='render threads')
+    parser.add_argument('--max-pending', type=int, default=64, help='renders in flight before answering 503')
+    parser.add_argument('--cache-mib', type=float, default=64, help='png cache size')
+    parser.add_argument('--compress-level', type=int, default=6)
+    args = parser.parse_args()
+
+    server = AvatarServer(images_path=args.images, pack_path=args.pack, workers=args.workers,
+                          max_pending=args.max_pending, cache_bytes=int(args.cache_mib * 2**20),
+                          compress_level=args.compress_level)
+    print(f'serving avatars on http://{args.host}:{args.port}')
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
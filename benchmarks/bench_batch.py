@@ -0,0 +1,40 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+from synthetic_assets import asset_tree
+
+#---------------------------------------------------#
+# generate() in a loop versus generate_batch(n)     #
+#---------------------------------------------------#
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=256, help='number of avatars')
+    parser.add_argument('--chunk-size', type=int, default=64)
+    args = parser.parse_args()
+
+    spag = SouthParkAvatarGenerator(asset_tree(args.images), seed=0)
+
+    # warm up both paths
+    spag.generate()
+    spag.generate_batch(args.chunk_size, chunk_size=args.chunk_size)
+
+    start = time.perf_counter()
+    for _ in range(args.n):
+        spag.generate()
+    loop = args.n / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    spag.generate_batch(args.n, chunk_size=args.chunk_size)
+    batch = args.n / (time.perf_counter() - start)
+
+    print(f'generate() loop      : {loop:8.1f} avatars/sec')
+    print(f'generate_batch({args.n:<5}): {batch:8.1f} avatars/sec  ({batch / loop:.1f}x)')
@@ -0,0 +1,40 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# the render cache under a skewed (zipf) request mix         #
+#------------------------------------------------------------#
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=2000, help='number of requests')
+    parser.add_argument('--users', type=int, default=500, help='number of distinct avatars')
+    parser.add_argument('--zipf', type=float, default=1.2)
+    parser.add_argument('--cache-mib', type=float, default=64)
+    parser.add_argument('--format', default='png', choices=['array', 'png'])
+    args = parser.parse_args()
+
+    images = asset_tree(args.images)
+    requests = np.random.default_rng(0).zipf(args.zipf, size=args.n) % args.users
+
+    for cache_bytes in (0, int(args.cache_mib * 2**20)):
+        spag = SouthParkAvatarGenerator(images, cache_bytes=cache_bytes, cache_format=args.format)
+        start = time.perf_counter()
+        for user in requests:
+            spag.generate(seed=int(user), format='png')
+        elapsed = time.perf_counter() - start
+        label = f'cache {args.cache_mib:g} MiB ({args.format})' if cache_bytes else 'no cache'
+        print(f'{label:24s}: {args.n / elapsed:8.1f} requests/sec')
+        if spag.cache is not None:
+            print('    ' + ', '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}' for k, v in spag.cache.stats().items()))
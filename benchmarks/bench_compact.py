@@ -0,0 +1,66 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+from southParkAvatarGenerator import SouthParkAvatarGenerator, LayerCache
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# dense RGBA layers versus compact=True (palette layers)     #
+#------------------------------------------------------------#
+# memory of the loaded layers, their tint masks and the forms derived from them for
+# generate_batch() and render() (bounded by layer_cache_bytes for compact layers),
+# load time and generate() speed
+
+COLLECTIONS = ('eyes', 'mouths', 'shirts', 'trousers', 'hairs', 'glasses', 'beards',
+               'items', 'hats', 'jewellery', 'pins')
+
+
+def layer_bytes(spag):
+    layers = list(spag.body_parts.values())
+    for collection in COLLECTIONS:
+        for item in getattr(spag, collection):
+            for role in item.values():
+                layers += role
+    return sum(layer.nbytes for layer in layers)
+
+
+def mask_bytes(spag):
+    # the flat masks kept outside the derived cache, plus the palette masks
+    flat = sum(LayerCache.size(mask) for mask in dict.values(spag.tint_masks))
+    return flat + sum(entries.nbytes + channels.nbytes for entries, channels in spag.palette_tints.values())
+
+
+def derived_bytes(spag):
+    # the batch and premultiplied forms and the flat masks made on demand (in the derived cache)
+    if spag.derived_cache is not None:
+        return spag.derived_cache.stats()['bytes']
+    return sum(LayerCache.size(value) for value in list(spag._batch_layers.values()) + list(spag._premultiplied.values()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=200)
+    parser.add_argument('--derived-mib', type=float, default=None, help='layer_cache_bytes of the compact generator')
+    args = parser.parse_args()
+
+    images = asset_tree(args.images)
+    for compact in (False, True):
+        start = time.perf_counter()
+        budget = int(args.derived_mib * 2**20) if compact and args.derived_mib is not None else None
+        spag = SouthParkAvatarGenerator(images, compact=compact, layer_cache_bytes=budget)
+        load = time.perf_counter() - start
+        start = time.perf_counter()
+        for seed in range(args.n):
+            spag.generate(seed=seed)
+        elapsed = (time.perf_counter() - start) / args.n
+        spag.generate_batch(args.n, seed=0)
+        print(f'{"compact" if compact else "dense":7s}: layers {layer_bytes(spag) / 2**20:6.1f} MiB, '
+              f'tint masks {mask_bytes(spag) / 2**20:6.1f} MiB, derived {derived_bytes(spag) / 2**20:6.1f} MiB, '
+              f'load {load:5.2f}s, {elapsed * 1000:5.2f} ms per generate()')
@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# compositor='pil' (paste per layer) versus 'premultiplied'  #
+#------------------------------------------------------------#
+# checks the premultiplied kernel against the PIL reference first: the colour of every
+# visible pixel must be within --tolerance and opaque pixels must stay opaque. The alpha
+# of edge pixels differs on purpose (paste also blends the alpha channel like a colour,
+# 'over' does not), it is only reported. Exits with 1 when the check fails.
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=200)
+    parser.add_argument('--tolerance', type=int, default=1, help='allowed colour difference')
+    args = parser.parse_args()
+
+    images = asset_tree(args.images)
+    reference = SouthParkAvatarGenerator(images, compositor='pil')
+    kernel = SouthParkAvatarGenerator(images, compositor='premultiplied')
+
+    worst_colour, worst_alpha, failed = 0, 0, 0
+    for seed in range(args.n):
+        expected = np.asarray(reference.generate(seed=seed), dtype=np.int16)
+        actual = np.asarray(kernel.generate(seed=seed), dtype=np.int16)
+        visible = (expected[:, :, 3] > 0) & (actual[:, :, 3] > 0)
+        colour = np.abs(expected[:, :, :3] - actual[:, :, :3])[visible].max(initial=0)
+        opaque = expected[:, :, 3] == 255
+        if colour > args.tolerance or (actual[:, :, 3][opaque] != 255).any() or \
+           ((expected[:, :, 3] > 0) != (actual[:, :, 3] > 0)).any():
+            failed += 1
+        worst_colour = max(worst_colour, colour)
+        worst_alpha = max(worst_alpha, np.abs(expected[:, :, 3] - actual[:, :, 3]).max())
+    print(f'pixel check  : {args.n - failed}/{args.n} avatars within tolerance '
+          f'(colour difference <= {worst_colour}, edge alpha difference <= {worst_alpha})')
+
+    for label, spag in (('pil', reference), ('premultiplied', kernel)):
+        start = time.perf_counter()
+        for seed in range(args.n):
+            spag.generate(seed=seed)
+        print(f'{label:13s}: {(time.perf_counter() - start) / args.n * 1000:6.2f} ms per generate()')
+    sys.exit(1 if failed else 0)
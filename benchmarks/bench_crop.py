@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from PIL import Image
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# full-frame layers versus layers trimmed to their bbox      #
+#------------------------------------------------------------#
+
+
+def all_layers(spag):
+    layers = list(spag.body_parts.values())
+    for collection in (spag.eyes, spag.mouths, spag.shirts, spag.trousers, spag.hairs, spag.glasses,
+                       spag.beards, spag.items, spag.hats, spag.jewellery, spag.pins):
+        for item in collection:
+            layers += item.get('fg', []) + item.get('bg', [])
+    return layers
+
+
+def time_pastes(images, repeat):
+    canvas = Image.new('RGBA', (745, 811))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for img, box in images:
+            canvas.paste(img, box, img)
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    spag = SouthParkAvatarGenerator(asset_tree(args.images))
+    layers = [l for l in all_layers(spag) if not l.empty]
+
+    full_bytes = len(layers) * 811 * 745 * 4
+    cropped_bytes = sum(l.pixels.nbytes for l in layers)
+    print(f'layers                : {len(layers)}')
+    print(f'full-frame memory     : {full_bytes / 2**20:8.1f} MiB')
+    print(f'cropped memory        : {cropped_bytes / 2**20:8.1f} MiB  ({full_bytes / cropped_bytes:.1f}x less)')
+    print(f'bbox / full area      : {cropped_bytes / full_bytes:8.3f}')
+
+    # paste every layer once, at full frame (re-padded) and as a crop at its offset
+    full = []
+    for l in layers:
+        padded = np.zeros((811, 745, 4), dtype=np.uint8)
+        padded[l.window] = l.pixels
+        full.append((Image.fromarray(padded), (0, 0)))
+    full_time = time_pastes(full, args.repeat)
+    cropped_time = time_pastes([(Image.fromarray(l.pixels), (l.left, l.top)) for l in layers], args.repeat)
+    print(f'full-frame paste      : {full_time / len(layers) * 1000:8.3f} ms/layer')
+    print(f'cropped paste         : {cropped_time / len(layers) * 1000:8.3f} ms/layer  ({full_time / cropped_time:.1f}x faster)')
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# AvatarEditor: latency of one edit vs a full generate()     #
+#------------------------------------------------------------#
+# edits one attribute at a time (-n edits per attribute, random values) and reports the
+# median latency of set() per attribute, next to the one of generate(genome=...). After
+# every edit the canvas is compared with generate() for the new genome (exits 1 on a difference).
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=30, help='edits per attribute')
+    args = parser.parse_args()
+
+    from southParkAvatarGenerator import SouthParkAvatarGenerator
+    spag = SouthParkAvatarGenerator(asset_tree(args.images), seed=0)
+    editor = spag.editor()
+    rng = np.random.default_rng(0)
+
+    full = []
+    for _ in range(args.n):
+        start = time.perf_counter()
+        spag.generate(genome=editor.genome)
+        full.append(time.perf_counter() - start)
+    print(f'{"generate()":16s} {np.median(full) * 1000:7.2f} ms')
+
+    failed = False
+    attributes = ['skin_colour', 'hair_colour', 'shirt_colour', 'eyes', 'mouth', 'shirt', 'trouser',
+                  'hair', 'glasses', 'beard', 'trouser_jitter']
+    for attribute in attributes:
+        latencies = []
+        for _ in range(args.n):
+            if attribute == 'trouser_jitter':
+                value = int(rng.integers(-50, 50))
+            else:
+                value = int(rng.choice(spag.attribute_values(attribute)))
+            start = time.perf_counter()
+            editor.set(attribute, value)
+            latencies.append(time.perf_counter() - start)
+            failed |= not np.array_equal(editor.canvas, np.asarray(spag.generate(genome=editor.genome)))
+        median = np.median(latencies)
+        print(f'{attribute:16s} {median * 1000:7.2f} ms  ({median / np.median(full) * 100:4.0f}% of generate)')
+    if failed:
+        print('an edited avatar differs from generate()')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,53 @@
+import argparse
+import io
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from PIL import Image
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# encode(): time and bytes per avatar of every preset        #
+#------------------------------------------------------------#
+# encodes -n avatars with every preset of encode_presets and the plain RGBA png which
+# generate() callers used to save (compress_level 6), reports the median encode time and
+# the mean bytes per avatar, and checks that every preset decodes to the same pixels
+# (exits 1 on a difference).
+
+def decode(data, format, shape):
+    if format == 'raw':
+        return np.frombuffer(data, dtype=np.uint8).reshape(shape)
+    return np.asarray(Image.open(io.BytesIO(data)).convert('RGBA'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=50, help='avatars')
+    args = parser.parse_args()
+
+    from southParkAvatarGenerator import SouthParkAvatarGenerator
+    spag = SouthParkAvatarGenerator(asset_tree(args.images), seed=0)
+    avatars = [spag.render(spag.sample_genome()) for _ in range(args.n)]
+
+    presets = dict(rgba_png=('png', 6, False), **spag.encode_presets)
+    failed = False
+    print(f'{"preset":12s} {"ms":>8s} {"bytes":>10s}')
+    for name, (format, level, quantize) in presets.items():
+        times, sizes = [], []
+        for avatar in avatars:
+            start = time.perf_counter()
+            data = spag.encode(avatar, format=format, level=level, quantize=quantize)
+            times.append(time.perf_counter() - start)
+            sizes.append(len(data))
+            failed |= not np.array_equal(decode(data, format, avatar.shape), avatar)
+        print(f'{name:12s} {np.median(times) * 1000:8.2f} {np.mean(sizes):10.0f}')
+    if failed:
+        print('some encodings are not lossless')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,40 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# generate() + save() per file versus export_dataset()       #
+#------------------------------------------------------------#
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=200)
+    parser.add_argument('--shard-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    spag = SouthParkAvatarGenerator(asset_tree(args.images))
+    # the exports go to a temporary folder, which is removed when the benchmark exits
+    folder = tempfile.TemporaryDirectory(prefix='spag_export_')
+    out = folder.name
+
+    start = time.perf_counter()
+    os.makedirs(f'{out}/loop')
+    for i in range(args.n):
+        spag.generate(seed=i).save(f'{out}/loop/{i}.png')
+    print(f'generate() + save()     : {args.n / (time.perf_counter() - start):8.1f} avatars/sec')
+
+    for format in ('png', 'tar', 'npy'):
+        start = time.perf_counter()
+        spag.export_dataset(args.n, f'{out}/{format}', shard_size=args.shard_size, format=format, workers=args.workers)
+        print(f'export_dataset({format + ")":5s}     : {args.n / (time.perf_counter() - start):8.1f} avatars/sec')
@@ -0,0 +1,93 @@
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+from avatarIngest import ingest, cache_path, CATEGORIES
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+from synthetic_assets import asset_tree, BODY_PARTS
+
+#------------------------------------------------------------#
+# offline ingest of a HAR made from the synthetic tree       #
+#------------------------------------------------------------#
+# every synthetic png becomes a HAR entry, with the pauses of someone clicking
+# through the site (0.1s within an item, 2s between items, 30s between categories).
+# Half of the responses are saved in the HAR, the other half in a response cache,
+# so the ingest runs without network. Checks that every image ends up where it
+# came from and times the ingest.
+
+
+def make_har(images, har_path, cache_dir):
+    clock = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+    entries, sources = [], []
+
+    def add(path, bg, pause):
+        nonlocal clock
+        clock += pause
+        url = f'https://assets.example.invalid/{len(entries)}/{"image_bg" if bg else "prop"}.png'
+        with open(path, 'rb') as f:
+            body = f.read()
+        response = {'status': 200, 'content': {'mimeType': 'image/png'}}
+        if len(entries) % 2:
+            response['content'].update(text=base64.b64encode(body).decode(), encoding='base64')
+        else:
+            with open(cache_path(cache_dir, url), 'wb') as f:
+                f.write(body)
+        entries.append({'startedDateTime': datetime.fromtimestamp(clock, timezone.utc).isoformat(),
+                        'request': {'method': 'GET', 'url': url}, 'response': response})
+        sources.append(path)
+
+    for category in CATEGORIES:
+        pause = 30 if entries else 0
+        if category == 'body':
+            for part in BODY_PARTS:
+                add(f'{images}/body/{part}.png', False, pause)
+                pause = 2
+            continue
+        for folder in sorted(os.listdir(f'{images}/{category}'), key=int):
+            for name in sorted(os.listdir(f'{images}/{category}/{folder}')):
+                add(f'{images}/{category}/{folder}/{name}', 'bg' in name, pause)
+                pause = 0.1
+            pause = 2
+    with open(har_path, 'w') as f:
+        json.dump({'log': {'version': '1.2', 'pages': [], 'entries': entries}}, f)
+    return sources
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    args = parser.parse_args()
+
+    images = asset_tree(args.images)
+    # the work folder is removed when the benchmark exits
+    folder = tempfile.TemporaryDirectory(prefix='spag_ingest_')
+    work = folder.name
+    os.makedirs(f'{work}/cache')
+    sources = make_har(images, f'{work}/items.har', f'{work}/cache')
+    print(f'HAR with {len(sources)} images: {os.path.getsize(f"{work}/items.har") / 2**20:.1f} MiB')
+
+    start = time.perf_counter()
+    summary = ingest(f'{work}/items.har', f'{work}/images', pack_path=f'{work}/assets.pack', cache_dir=f'{work}/cache',
+                     offline=True, body_parts=list(BODY_PARTS))
+    elapsed = time.perf_counter() - start
+    print(f'ingest (offline, with the pack): {elapsed:.2f}s, {summary["images"]} images, {summary["failed"]} failed')
+
+    with open(f'{work}/images/manifest.json') as f:
+        manifest = json.load(f)['images']
+    wrong = 0
+    for source, image in zip(sources, manifest):
+        with open(source, 'rb') as a, open(f'{work}/images/{image["file"]}', 'rb') as b:
+            wrong += a.read() != b.read()
+    spag = SouthParkAvatarGenerator(pack_path=f'{work}/assets.pack')
+    spag.generate(seed=0)
+    print(f'{len(manifest) - wrong}/{len(sources)} images match their source, the pack renders')
+    sys.exit(1 if wrong or summary['failed'] or len(manifest) != len(sources) else 0)
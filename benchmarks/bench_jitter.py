@@ -0,0 +1,51 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# ColourJitter: colour sampling and batch rendering cost     #
+#------------------------------------------------------------#
+# times the jitter of the skin, hair and shirt colours of -n avatars (HSV and LAB, normal and
+# uniform noise) and generate_batch() with and without jitter, so the colour variation can be
+# compared with the rendering it feeds.
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=10000, help='avatars whose colours are jittered')
+    parser.add_argument('--batch', type=int, default=256, help='avatars rendered per generate_batch run')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from southParkAvatarGenerator import SouthParkAvatarGenerator, ColourJitter
+    spag = SouthParkAvatarGenerator(asset_tree(args.images), seed=0)
+    jitters = {'hsv normal': ColourJitter('hsv', skin=(0.01, 0.05, 0.05), hair=(0.03, 0.1, 0.1), shirt=(0.05, 0.1, 0.1)),
+               'hsv uniform': ColourJitter('hsv', skin=(0.02, 0.1, 0.1), hair=(0.05, 0.2, 0.2), shirt=(0.1, 0.2, 0.2),
+                                           distribution='uniform'),
+               'lab normal': ColourJitter('lab', skin=(3, 2, 2), hair=(5, 5, 5), shirt=(8, 10, 10))}
+
+    attributes = spag.sample_batch(args.n)
+    for name, jitter in jitters.items():
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            spag.batch_colours(attributes, jitter)
+            best = min(best, time.perf_counter() - start)
+        print(f'colours of {args.n} avatars, {name:12s} {best * 1000:7.2f} ms')
+
+    out = np.empty((args.batch,) + spag.canvas_shape, dtype=np.uint8)
+    # prepare the layers once
+    spag.generate_batch(args.batch, out=out, seed=0)
+    for name, jitter in (('no jitter', None), ('hsv normal', jitters['hsv normal'])):
+        start = time.perf_counter()
+        spag.generate_batch(args.batch, out=out, seed=0, colour_jitter=jitter)
+        elapsed = time.perf_counter() - start
+        print(f'generate_batch({args.batch}), {name:12s} {args.batch / elapsed:8.1f} avatars/sec')
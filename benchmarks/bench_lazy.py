@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# eager versus lazy loading, for a short-lived process       #
+#------------------------------------------------------------#
+# every mode runs in a fresh process: construct the generator, render a few
+# avatars, and report the time to the first avatar and the peak RSS
+
+MODES = {'eager': {}, 'lazy': {'lazy': True}, 'lazy + compact': {'lazy': True, 'compact': True}}
+
+
+def run(images, mode, n):
+    from southParkAvatarGenerator import SouthParkAvatarGenerator
+    start = time.perf_counter()
+    spag = SouthParkAvatarGenerator(images, **MODES[mode])
+    construct = time.perf_counter() - start
+    spag.generate(seed=0)
+    first = time.perf_counter() - start
+    for seed in range(1, n):
+        spag.generate(seed=seed)
+    total = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # MiB (linux reports KiB)
+    return {'construct': construct, 'first': first, 'total': total, 'rss': rss}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=10, help='avatars per process')
+    parser.add_argument('--mode', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    images = asset_tree(args.images)
+    if args.mode is not None:
+        print(json.dumps(run(images, args.mode, args.n)))
+        sys.exit(0)
+
+    for mode in MODES:
+        out = subprocess.run([sys.executable, '-W', 'ignore', __file__, '--images', images, '-n', str(args.n), '--mode', mode],
+                             capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f'{mode:15s}: construct {r["construct"] * 1000:7.1f} ms, first avatar {r["first"] * 1000:7.1f} ms, '
+              f'{args.n} avatars {r["total"] * 1000:7.1f} ms, peak RSS {r["rss"]:6.1f} MiB')
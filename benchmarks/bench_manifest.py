@@ -0,0 +1,47 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# startup with and without an asset manifest                 #
+#------------------------------------------------------------#
+# compiles a copy of the images folder (assetCompiler.py) and times the construction of
+# SouthParkAvatarGenerator from the folder (walk + scan every layer) and from the manifest
+# (sorted items, roles and visible boxes read from it), eager and lazy; best of --repeat.
+
+def construct(repeat, **kwargs):
+    from southParkAvatarGenerator import SouthParkAvatarGenerator
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        SouthParkAvatarGenerator(**kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from assetCompiler import compile_assets
+    with tempfile.TemporaryDirectory() as tmp:
+        images = os.path.join(tmp, 'images')
+        shutil.copytree(asset_tree(args.images), images)
+        start = time.perf_counter()
+        manifest, errors = compile_assets(images)
+        print(f'compile {time.perf_counter() - start:8.2f} s' + (f'  ({len(errors)} errors)' if errors else ''))
+        for lazy in (False, True):
+            folder = construct(args.repeat, images_path=images, lazy=lazy, manifest_path=False)
+            listed = construct(args.repeat, images_path=images, lazy=lazy)
+            print(f'{"lazy" if lazy else "eager":5s} folder {folder * 1000:8.1f} ms   manifest {listed * 1000:8.1f} ms')
@@ -0,0 +1,59 @@
+import argparse
+import itertools
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# bulk-rendering similar avatars with and without the memo   #
+#------------------------------------------------------------#
+# the avatars share their body, trousers and shirt and only differ in
+# their face (eyes, mouth, glasses), which is painted near the end.
+# A memo of --small-mib (smaller than one avatar's stack) checks that evicting
+# under pressure keeps the avatars and the byte count right (exits 1 otherwise)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('--bases', type=int, default=4, help='number of different bodies')
+    parser.add_argument('--memo-mib', type=float, default=64)
+    parser.add_argument('--small-mib', type=float, default=1)
+    args = parser.parse_args()
+
+    images = asset_tree(args.images)
+    plain = SouthParkAvatarGenerator(images)
+    memo = SouthParkAvatarGenerator(images, memo_bytes=int(args.memo_mib * 2**20))
+
+    genomes = []
+    for seed in range(args.bases):
+        base = plain.generate(seed=seed, return_genome=True)[1]
+        for eyes, mouth, glasses in itertools.product(range(min(len(plain.eyes), 6)), range(min(len(plain.mouths), 4)), (-1, 0, 1)):
+            genomes.append(base._replace(eyes=eyes, mouth=mouth, glasses=glasses))
+    out = np.zeros((len(genomes),) + plain.canvas_shape, dtype=np.uint8)
+
+    for label, spag in (('grouped batch', plain), ('layer-stack memo', memo)):
+        spag.generate_batch(genomes=genomes[:8], out=out[:8])  # warm up
+        start = time.perf_counter()
+        spag.generate_batch(genomes=genomes, out=out)
+        elapsed = time.perf_counter() - start
+        print(f'{label:18s}: {len(genomes) / elapsed:8.1f} avatars/sec')
+    print('    ' + ', '.join(f'{k}={v}' for k, v in memo.memo.stats().items()))
+
+    # the small memo: the same pixels as without a memo, and its bytes add up
+    small = SouthParkAvatarGenerator(images, memo_bytes=int(args.small_mib * 2**20))
+    expected = plain.generate_batch(genomes=genomes)
+    failed = False
+    for _ in range(2):
+        failed |= not np.array_equal(small.generate_batch(genomes=genomes, out=out), expected)
+    stats = small.memo.stats()
+    failed |= stats['bytes'] != sum(node.nbytes for node in small.memo.nodes) or stats['bytes'] > stats['max_bytes']
+    print(f'{args.small_mib:g} MiB memo : {"ok" if not failed else "FAILED"} ({stats["evictions"]} evictions)')
+    sys.exit(1 if failed else 0)
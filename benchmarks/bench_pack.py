@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# construction from the png files versus from an asset pack  #
+#------------------------------------------------------------#
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    images = asset_tree(args.images)
+    # the pack goes to a temporary folder, which is removed when the benchmark exits
+    folder = tempfile.TemporaryDirectory(prefix='spag_pack_')
+    pack = os.path.join(folder.name, 'assets.pack')
+
+    start = time.perf_counter()
+    SouthParkAvatarGenerator(images).build_pack(pack)
+    print(f'build pack          : {time.perf_counter() - start:8.3f} s  ({os.path.getsize(pack) / 2**20:.1f} MiB)')
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        from_pngs = SouthParkAvatarGenerator(images)
+    png_time = (time.perf_counter() - start) / args.repeat
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        from_pack = SouthParkAvatarGenerator(pack_path=pack)
+    pack_time = (time.perf_counter() - start) / args.repeat
+
+    print(f'construct from pngs : {png_time * 1000:8.1f} ms')
+    print(f'construct from pack : {pack_time * 1000:8.1f} ms  ({png_time / pack_time:.0f}x faster)')
+
+    # both generators have to render exactly the same avatars
+    expected = from_pngs.generate_batch(16, seed=0)
+    assert np.array_equal(expected, from_pack.generate_batch(16, seed=0)), 'the pack renders different avatars'
+    print('pack output         : pixel-identical')
@@ -0,0 +1,43 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+from parallelAvatarRenderer import ParallelAvatarRenderer
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# throughput of the ParallelAvatarRenderer per process count #
+#------------------------------------------------------------#
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=256, help='avatars per measurement')
+    parser.add_argument('--max-processes', type=int, default=os.cpu_count())
+    parser.add_argument('--png', action='store_true', help='return png bytes instead of a shared array')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='spag_pack_') as folder:
+        pack = os.path.join(folder, 'assets.pack')
+        SouthParkAvatarGenerator(asset_tree(args.images)).build_pack(pack)
+
+        counts = sorted({1, args.max_processes} | {2 ** i for i in range(1, 8) if 2 ** i < args.max_processes})
+        print(f'cpus: {os.cpu_count()}, avatars: {args.n}, output: {"png" if args.png else "shared array"}')
+        print(' processes   avatars/sec   speed-up   efficiency')
+        single = None
+        for processes in counts:
+            with ParallelAvatarRenderer(pack_path=pack, processes=processes) as renderer:
+                render = renderer.render_pngs if args.png else renderer.render_array
+                render(range(processes * renderer.chunk_size))  # warm up every worker
+                start = time.perf_counter()
+                render(range(args.n))
+                throughput = args.n / (time.perf_counter() - start)
+            single = single or throughput
+            print(f'{processes:10d} {throughput:13.1f} {throughput / single:9.2f}x {throughput / single / processes:11.0%}')
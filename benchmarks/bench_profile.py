@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+from southParkAvatarGenerator import SouthParkAvatarGenerator, RenderProfiler
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# where generate() spends its time, and what profiling costs #
+#------------------------------------------------------------#
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=300)
+    parser.add_argument('--prometheus', action='store_true', help='print the prometheus text instead of a table')
+    args = parser.parse_args()
+
+    images = asset_tree(args.images)
+    profiler = RenderProfiler()
+    plain = SouthParkAvatarGenerator(images)
+    profiled = SouthParkAvatarGenerator(images, profiler=profiler)
+
+    timings = {}
+    for _ in range(3):  # interleaved, the best of three
+        for label, spag in (('profiler off', plain), ('profiler on', profiled)):
+            start = time.perf_counter()
+            for seed in range(args.n):
+                spag.generate(seed=seed)
+            timings[label] = min(timings.get(label, float('inf')), (time.perf_counter() - start) / args.n)
+    for label, elapsed in timings.items():
+        print(f'{label:12s}: {elapsed * 1000:6.3f} ms per generate()')
+    print()
+    print(profiler.to_prometheus() if args.prometheus else profiler.report())
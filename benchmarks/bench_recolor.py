@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# per-call mask scans versus the precomputed tint masks      #
+#------------------------------------------------------------#
+
+
+def scan_recolor(layer, rule, colour):
+    # the way generate() used to tint a layer: a boolean scan per channel
+    for c in range(3):
+        channel = layer[:, :, c]
+        channel[(channel == 255) if rule == 'eq255' else (channel > 0)] = colour[c]
+    return layer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    spag = SouthParkAvatarGenerator(asset_tree(args.images))
+    layers = [(key, layer, rule) for stage, attribute in spag.layer_stages
+              for index in ([None] if attribute is None else [0])
+              for key, layer, rule, colour in spag.stage_layers(stage, index) if rule is not None]
+
+    # the old path recoloured the cached full canvas layers in place, so it is timed on
+    # canvas copies of the layers (their pixels at their offset), without a copy per call
+    colour = (12, 34, 56)
+    scratch = []
+    for key, layer, rule in layers:
+        canvas = np.zeros(spag.canvas_shape, dtype=np.uint8)
+        canvas[layer.window] = layer.pixels
+        scratch.append(canvas)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for (key, layer, rule), copy in zip(layers, scratch):
+            scan_recolor(copy, rule, colour)
+    scan = (time.perf_counter() - start) / args.repeat
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for key, layer, rule in layers:
+            spag.recolor(key, layer, colour)
+    masked = (time.perf_counter() - start) / args.repeat
+
+    print(f'tinted layers per avatar : {len(layers)}')
+    print(f'per-call scans           : {scan * 1000:7.2f} ms/avatar')
+    print(f'precomputed masks + copy : {masked * 1000:7.2f} ms/avatar  ({scan / masked:.1f}x)')
@@ -0,0 +1,65 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# attribute sampling alone: alias tables vs rng.choice       #
+#------------------------------------------------------------#
+# draws the attributes of -n avatars (no rendering) with
+#   sample_batch      rng.choice per attribute (no rules)
+#   alias             AttributeSampler without rules
+#   alias + rules     AttributeSampler with conditional rules compiled into its tables
+#   sample_genome     one avatar at a time (timed on --genomes avatars, extrapolated)
+# and checks that the rules hold on every draw.
+
+def timed(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=1_000_000, help='draws')
+    parser.add_argument('--genomes', type=int, default=20_000, help='draws of the sample_genome loop')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from southParkAvatarGenerator import SouthParkAvatarGenerator, Rule
+    images = asset_tree(args.images)
+    rules = [Rule('beard', when={'skin_colour': 3}, exclude='item'),
+             Rule('glasses', when={'hair': [0, 2]}, exclude='item'),
+             Rule('beard', when={'hair_colour': 0}, weights={-1: 0.5, 0: 0.3, 1: 0.2})]
+    plain = SouthParkAvatarGenerator(images, seed=0)
+    alias = SouthParkAvatarGenerator(images, seed=0, rules=[])
+    constrained = SouthParkAvatarGenerator(images, seed=0, rules=rules)
+
+    results = {}
+    results['sample_batch'], _ = timed(lambda: plain.sample_batch(args.n), args.repeat)
+    results['alias'], _ = timed(lambda: alias.sample_batch(args.n), args.repeat)
+    results['alias + rules'], drawn = timed(lambda: constrained.sample_batch(args.n), args.repeat)
+
+    start = time.perf_counter()
+    for _ in range(args.genomes):
+        plain.sample_genome()
+    results['sample_genome'] = (time.perf_counter() - start) * args.n / args.genomes
+
+    for name, seconds in results.items():
+        print(f'{name:14s} {seconds * 1000:9.1f} ms  {args.n / seconds / 1e6:7.2f} M draws/sec')
+
+    violations = ((drawn['beard'][drawn['skin_colour'] == 3] >= 0).sum()
+                  + (drawn['glasses'][np.isin(drawn['hair'], [0, 2])] >= 0).sum())
+    print(f'rule violations: {violations}')
+    sys.exit(1 if violations else 0)
@@ -0,0 +1,108 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# load test of avatarServer.py on localhost                  #
+#------------------------------------------------------------#
+# starts a server on the synthetic tree (unless --port points to a running one) and
+# requests random seeds out of --seeds from --concurrency keep-alive connections, so
+# some requests coalesce or hit the cache. Reports p50/p99 latency and requests/sec.
+
+async def request(reader, writer, path):
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def client(port, paths, latencies, statuses):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for path in paths:
+        start = time.perf_counter()
+        status, body = await request(reader, writer, path)
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+    writer.close()
+
+
+async def load_test(port, n, concurrency, seeds, size):
+    rng = random.Random(0)
+    query = f'?size={size}' if size else ''
+    paths = [f'/avatar/{rng.randrange(seeds)}.png{query}' for _ in range(n)]
+    latencies, statuses = [], {}
+    start = time.perf_counter()
+    await asyncio.gather(*[client(port, paths[i::concurrency], latencies, statuses) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    stats = json.loads((await request(reader, writer, '/stats'))[1])
+    writer.close()
+    return elapsed, np.array(latencies) * 1000, statuses, stats
+
+
+def wait_for(port, timeout = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f'no server on port {port}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('--port', type=int, default=None, help='test a running server instead')
+    parser.add_argument('-n', type=int, default=500, help='number of requests')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seeds', type=int, default=200, help='the requests draw their seed from range(seeds)')
+    parser.add_argument('--size', type=int, default=None, help='request small avatars (size=...)')
+    parser.add_argument('--max-pending', type=int, default=64)
+    args = parser.parse_args()
+
+    server = None
+    port = args.port
+    if port is None:
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        server = subprocess.Popen([sys.executable, os.path.join(root, 'avatarServer.py'), '--port', str(port),
+                                   '--images', asset_tree(args.images), '--max-pending', str(args.max_pending)],
+                                  stdout=subprocess.DEVNULL)
+    try:
+        wait_for(port)
+        elapsed, latencies, statuses, stats = asyncio.run(load_test(port, args.n, args.concurrency, args.seeds, args.size))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(f'{args.n} requests, {args.concurrency} connections: {args.n / elapsed:.1f} requests/sec')
+    print(f'latency p50 {np.percentile(latencies, 50):.1f} ms, p99 {np.percentile(latencies, 99):.1f} ms')
+    print('status ' + ', '.join(f'{status}: {count}' for status, count in sorted(statuses.items())))
+    print('server ' + ', '.join(f'{k}={v}' for k, v in stats.items() if k != 'cache'))
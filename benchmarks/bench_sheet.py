@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+from PIL import Image
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# contact sheets: render_sheet vs pasting generate() outputs #
+#------------------------------------------------------------#
+# builds a --rows x --cols sheet of full size avatars (or --size tiles) with
+#   paste         generate() per avatar, pasted into one big PIL image (the old way)
+#   render_sheet  every avatar rendered straight into its tile of a preallocated array
+#   png stream    render_sheet(path='*.png'), one row of tiles in memory at a time
+# every mode runs in a fresh process, which reports its time (after a warm-up sheet)
+# and how much its peak RSS grew while building the sheet.
+
+MODES = ('paste', 'render_sheet', 'png stream')
+
+
+def paste_sheet(spag, rows, cols, size):
+    width, height = (size, size) if size else spag.canvas_size
+    sheet = Image.new('RGBA', (cols * width, rows * height))
+    for i in range(rows * cols):
+        avatar = spag.generate(seed=i, size=size)
+        avatar = avatar if isinstance(avatar, Image.Image) else Image.fromarray(avatar)
+        sheet.paste(avatar, ((i % cols) * width, (i // cols) * height))
+    return sheet
+
+
+def run_mode(mode, images, rows, cols, size, tmp):
+    from southParkAvatarGenerator import SouthParkAvatarGenerator
+    spag = SouthParkAvatarGenerator(images)
+    seeds = range(rows * cols)
+    # prepare (and scale) the layers, one avatar at a time so that no sheet is allocated yet
+    genomes, _ = spag.sheet_genomes(rows * cols, seeds=seeds)
+    for genome in genomes:
+        if size:
+            spag.render_scaled(genome, size)
+        else:
+            spag.render(genome)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == 'paste':
+        paste_sheet(spag, rows, cols, size)
+    elif mode == 'render_sheet':
+        spag.render_sheet(rows, cols, size=size, seeds=seeds)
+    else:
+        spag.render_sheet(rows, cols, size=size, seeds=seeds, path=os.path.join(tmp, 'sheet.png'))
+    elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 'rss_mib': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('--rows', type=int, default=8)
+    parser.add_argument('--cols', type=int, default=8)
+    parser.add_argument('--size', type=int, default=None, help='tile size (default: full size avatars)')
+    parser.add_argument('--mode', default=None, choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    images = asset_tree(args.images)
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.mode:
+            print(json.dumps(run_mode(args.mode, images, args.rows, args.cols, args.size, tmp)))
+            sys.exit(0)
+
+        print(f'{args.rows}x{args.cols} sheet of {"full size" if args.size is None else args.size} avatars')
+        for mode in MODES:
+            command = [sys.executable, '-W', 'ignore', os.path.abspath(__file__), '--images', images, '--mode', mode,
+                       '--rows', str(args.rows), '--cols', str(args.cols)] + (['--size', str(args.size)] if args.size else [])
+            result = json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout.splitlines()[-1])
+            print(f'{mode:14s} {result["seconds"]:7.2f} s  {args.rows * args.cols / result["seconds"]:7.1f} avatars/sec'
+                  f'  peak RSS +{result["rss_mib"]:7.1f} MiB')
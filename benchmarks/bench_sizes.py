@@ -0,0 +1,47 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from PIL import Image
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# generate(size=...) versus full resolution + crop + resize  #
+#------------------------------------------------------------#
+# also reports how far the two are apart (in premultiplied colour)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=100)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 128, 256])
+    args = parser.parse_args()
+
+    spag = SouthParkAvatarGenerator(asset_tree(args.images))
+    for size in args.sizes:
+        start = time.perf_counter()
+        spag.build_pyramid(size)
+        print(f'{size:4d}px: scaled every layer in {time.perf_counter() - start:.2f}s')
+
+        start = time.perf_counter()
+        for seed in range(args.n):
+            spag.generate(seed=seed).crop(spag.crop_box).resize((size, size), Image.BOX)
+        resized = args.n / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for seed in range(args.n):
+            spag.generate(seed=seed, size=size)
+        direct = args.n / (time.perf_counter() - start)
+
+        small = np.asarray(spag.generate(seed=1, size=size), dtype=np.float32)
+        full = np.asarray(spag.generate(seed=1).crop(spag.crop_box).resize((size, size), Image.BOX), dtype=np.float32)
+        diff = np.abs(small[:, :, :3] * small[:, :, 3:] - full[:, :, :3] * full[:, :, 3:]) / 255
+        print(f'{size:4d}px: full + resize {resized:7.1f} avatars/sec, direct {direct:7.1f} avatars/sec '
+              f'({direct / resized:.1f}x), mean difference {diff.mean():.2f}')
@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# one shared generator on a thread pool: render(genome)      #
+#------------------------------------------------------------#
+# renders -n avatars with render() from 1, 2, 4 ... --max-threads threads sharing one
+# SouthParkAvatarGenerator and reports avatars/sec and the speed-up over one thread. Every
+# threaded avatar is checked against the single threaded one (exits 1 on a difference).
+# The speed-up is bounded by the cores of the machine (os.cpu_count() is printed).
+
+def run(spag, genomes, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        avatars = list(executor.map(spag.render, genomes))
+    return time.perf_counter() - start, avatars
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=400, help='avatars per run')
+    parser.add_argument('--max-threads', type=int, default=8)
+    parser.add_argument('--compositor', default='pil', choices=['pil', 'premultiplied'])
+    args = parser.parse_args()
+
+    from southParkAvatarGenerator import SouthParkAvatarGenerator
+    spag = SouthParkAvatarGenerator(asset_tree(args.images), seed=0, compositor=args.compositor)
+    genomes = [spag.sample_genome() for _ in range(args.n)]
+    # prepare every layer once, so that the runs only measure rendering
+    run(spag, genomes, 1)
+
+    print(f'{os.cpu_count()} cpus, {args.n} avatars, {args.compositor} compositor')
+    baseline, reference = run(spag, genomes, 1)
+    threads, failed = 1, False
+    while threads <= args.max_threads:
+        elapsed, avatars = run(spag, genomes, threads) if threads > 1 else (baseline, reference)
+        same = all(np.array_equal(a, b) for a, b in zip(avatars, reference))
+        failed |= not same
+        print(f'{threads:3d} threads {args.n / elapsed:8.1f} avatars/sec  x{baseline / elapsed:5.2f}'
+              f'{"" if same else "  DIFFERENT PIXELS"}')
+        threads *= 2
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,150 @@
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore', DeprecationWarning)
+
+import numpy as np
+import PIL
+from synthetic_assets import asset_tree
+
+#------------------------------------------------------------#
+# benchmark suite with a json baseline and regression gating #
+#------------------------------------------------------------#
+# runs offline on a synthetic images/ tree (or --images) and measures:
+#   construct_ms      cold construction of SouthParkAvatarGenerator (a fresh process)
+#   peak_rss_mib      peak RSS of that process after rendering --n avatars
+#   generate_p50_ms   latency of a single generate()
+#   generate_p99_ms
+#   throughput        avatars/sec of back to back generate() calls for --seconds
+#   png_encode_ms     encoding one avatar as png (compress_level 6)
+#
+#   python benchmarks/suite.py --save baseline.json
+#   python benchmarks/suite.py --compare baseline.json --threshold 10
+#
+# compare exits with 1 when a metric is more than --threshold % worse than the baseline
+
+# the metrics and whether higher is better
+METRICS = {'construct_ms': False, 'peak_rss_mib': False, 'generate_p50_ms': False, 'generate_p99_ms': False,
+           'throughput': True, 'png_encode_ms': False}
+
+
+def cold_run(images, n):
+    # runs in a fresh process: construction time, and the peak RSS after n avatars
+    start = time.perf_counter()
+    from southParkAvatarGenerator import SouthParkAvatarGenerator
+    spag = SouthParkAvatarGenerator(images)
+    construct = time.perf_counter() - start
+    for seed in range(n):
+        spag.generate(seed=seed)
+    return {'construct_ms': construct * 1000,
+            'peak_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def warm_run(images, n, seconds):
+    from southParkAvatarGenerator import SouthParkAvatarGenerator
+    spag = SouthParkAvatarGenerator(images)
+    for seed in range(20):
+        spag.generate(seed=seed)
+
+    latencies = []
+    for seed in range(n):
+        start = time.perf_counter()
+        spag.generate(seed=seed)
+        latencies.append(time.perf_counter() - start)
+
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        spag.generate(seed=count)
+        count += 1
+    throughput = count / (time.perf_counter() - start)
+
+    encodes = []
+    for seed in range(min(n, 50)):
+        avatar = spag.generate(seed=seed)
+        start = time.perf_counter()
+        avatar.save(io.BytesIO(), 'PNG', compress_level=6)
+        encodes.append(time.perf_counter() - start)
+
+    return {'generate_p50_ms': float(np.percentile(latencies, 50)) * 1000,
+            'generate_p99_ms': float(np.percentile(latencies, 99)) * 1000,
+            'throughput': throughput,
+            'png_encode_ms': float(np.median(encodes)) * 1000}
+
+
+def run_suite(images, n, seconds, repeat):
+    # the cold metrics are the median over `repeat` fresh processes
+    colds = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-W', 'ignore', os.path.abspath(__file__), '--images', images,
+                              '-n', str(n), '--cold'], capture_output=True, text=True, check=True).stdout
+        colds.append(json.loads(out.strip().splitlines()[-1]))
+    metrics = {key: float(np.median([cold[key] for cold in colds])) for key in colds[0]}
+    metrics.update(warm_run(images, n, seconds))
+    return metrics
+
+
+def compare(metrics, baseline, threshold):
+    # a line per metric, and whether any metric regressed by more than threshold %
+    failed = False
+    lines = []
+    for key, higher_is_better in METRICS.items():
+        if key not in baseline:
+            continue
+        old, new = baseline[key], metrics[key]
+        change = (new - old) / old * 100 if old else 0.0
+        worse = -change if higher_is_better else change
+        status = 'ok'
+        if worse > threshold:
+            status, failed = 'REGRESSION', True
+        lines.append(f'{key:16s} {old:10.3f} -> {new:10.3f} ({change:+6.1f}%) {status}')
+    return failed, lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=None, help='images folder (default: a synthetic tree)')
+    parser.add_argument('-n', type=int, default=200, help='avatars for the latency percentiles')
+    parser.add_argument('--seconds', type=float, default=3, help='duration of the throughput run')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh processes for the cold metrics')
+    parser.add_argument('--save', default=None, help='write the results to this json baseline')
+    parser.add_argument('--compare', default=None, help='compare with this json baseline')
+    parser.add_argument('--threshold', type=float, default=10, help='allowed regression in %%')
+    parser.add_argument('--cold', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    images = asset_tree(args.images)
+    if args.cold:
+        print(json.dumps(cold_run(images, args.n)))
+        sys.exit(0)
+
+    metrics = run_suite(images, args.n, args.seconds, args.repeat)
+    for key, value in metrics.items():
+        print(f'{key:16s} {value:10.3f}')
+
+    if args.save:
+        result = {'metrics': metrics,
+                  'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                                  'pillow': PIL.__version__, 'machine': platform.machine(),
+                                  'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                  'config': {'images': args.images or 'synthetic', 'n': args.n, 'seconds': args.seconds,
+                             'repeat': args.repeat}}
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'saved to {args.save}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['metrics']
+        failed, lines = compare(metrics, baseline, args.threshold)
+        print(f'\ncompared with {args.compare} (threshold {args.threshold}%)')
+        print('\n'.join(lines))
+        sys.exit(1 if failed else 0)
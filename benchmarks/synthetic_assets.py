@@ -0,0 +1,107 @@
+import os
+import sys
+import numpy as np
+from PIL import Image, ImageDraw
+
+#------------------------------------------------------------#
+# Synthetic asset tree                                       #
+#------------------------------------------------------------#
+# The real images are scraped from the south park avatar site
+# (see download_southpark_items.ipynb) and are not shipped with
+# the repository. The benchmarks use a synthetic tree instead,
+# which mirrors the layout the generator expects:
+#
+#   images/body/<part>.png
+#   images/<category>/<folder>/<n>.png  (+ bg.png for tintable parts)
+#
+# Every layer is an 811x745 RGBA png with black outlines, a white
+# (255) tintable fill and anti-aliased edges, which is close enough
+# to the flat south park art style for timing purposes.
+
+CANVAS = (745, 811)  # PIL (width, height)
+
+# category -> (folders, has a tintable bg layer, region of the canvas)
+CATEGORIES = {
+    'eyes':      (20, False, (250, 180, 500, 300)),
+    'mouth':     (12, False, (300, 320, 450, 380)),
+    'shirt':     (12, True,  (170, 430, 580, 640)),
+    'trousers':  (10, True,  (200, 600, 550, 720)),
+    'hair':      (30, True,  (130, 20, 620, 300)),
+    'glasses':   (10, False, (230, 170, 520, 300)),
+    'beards':    (10, False, (240, 300, 510, 440)),
+    'items':     (5,  False, (500, 480, 700, 700)),
+    'hats':      (5,  False, (150, 0, 600, 200)),
+    'jewellery': (5,  False, (300, 420, 450, 520)),
+    'pins':      (5,  False, (400, 470, 460, 530)),
+}
+
+BODY_PARTS = {
+    'body':          (180, 420, 570, 700),
+    'head':          (120, 40, 630, 440),
+    'chin':          (250, 380, 500, 440),
+    'feet':          (200, 700, 550, 790),
+    'hands_bg':      (100, 520, 650, 620),
+    'hands_fg':      (100, 520, 650, 620),
+    'hands_item_bg': (100, 480, 650, 600),
+    'hands_item_fg': (100, 480, 650, 600),
+    'underware':     (200, 580, 550, 700),
+    'arms':          (120, 450, 630, 620),
+}
+
+
+def draw_layer(box, rng, fill=(255, 255, 255), outline=True):
+    # draw a couple of overlapping shapes inside the box, at 2x, and scale
+    # them back down to get anti-aliased edges
+    w, h = CANVAS
+    img = Image.new('RGBA', (w * 2, h * 2), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    x0, y0, x1, y1 = [2 * v for v in box]
+    for _ in range(rng.integers(1, 4)):
+        cx0 = rng.integers(x0, (x0 + x1) // 2)
+        cy0 = rng.integers(y0, (y0 + y1) // 2)
+        cx1 = rng.integers((x0 + x1) // 2 + 1, x1)
+        cy1 = rng.integers((y0 + y1) // 2 + 1, y1)
+        draw.ellipse((cx0, cy0, cx1, cy1), fill=fill + (255,),
+                     outline=(0, 0, 0, 255) if outline else None, width=6)
+    return img.resize(CANVAS, Image.BOX)
+
+
+def build_synthetic_assets(path, seed=0):
+    # create (or re-use) a synthetic images/ tree at path
+    rng = np.random.default_rng(seed)
+
+    os.makedirs(f'{path}/body', exist_ok=True)
+    for part, box in BODY_PARTS.items():
+        fill = (255, 255, 255) if part in ('body', 'head', 'hands_bg', 'hands_item_bg') else (60, 60, 60)
+        draw_layer(box, rng, fill).save(f'{path}/body/{part}.png')
+
+    for category, (folders, has_bg, box) in CATEGORIES.items():
+        for folder in range(folders):
+            os.makedirs(f'{path}/{category}/{folder}', exist_ok=True)
+            if has_bg:
+                draw_layer(box, rng).save(f'{path}/{category}/{folder}/bg.png')
+            fill = tuple(int(v) for v in rng.integers(0, 256, size=3))
+            if category in ('hair', 'beards'):
+                fill = (255, 255, 255)
+            draw_layer(box, rng, fill).save(f'{path}/{category}/{folder}/0.png')
+    return path
+
+
+# the synthetic tree of this process, built on first use and removed when the process exits
+_tree = None
+
+
+def asset_tree(images_path = None):
+    # the images folder to benchmark on: the given one, or the synthetic tree of this process
+    global _tree
+    if images_path:
+        return images_path
+    if _tree is None:
+        import tempfile
+        _tree = tempfile.TemporaryDirectory(prefix='spag_images_')
+        build_synthetic_assets(_tree.name)
+    return _tree.name
+
+
+if __name__ == '__main__':
+    build_synthetic_assets(sys.argv[1] if len(sys.argv) > 1 else 'synthetic_images')
@@ -0,0 +1,117 @@
+import io
+import os
+import tempfile
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from PIL import Image
+
+from southParkAvatarGenerator import SouthParkAvatarGenerator
+
+
+#--------------------------------------------------------------#
+# Worker side                                                  #
+#--------------------------------------------------------------#
+# every worker process attaches to the shared asset pack once and
+# keeps its own generator on top of it (the layers are views into
+# the shared memory, nothing is copied)
+_worker = {}
+
+
+def _init_worker(pack_name, pack_size):
+    # the workers share the resource tracker of the parent, which owns (and unlinks) the segments
+    shm = shared_memory.SharedMemory(name=pack_name)
+    _worker['pack'] = shm
+    _worker['spag'] = SouthParkAvatarGenerator(pack_path=np.ndarray((pack_size,), dtype=np.uint8, buffer=shm.buf))
+
+
+def _render_pngs(seeds, attributes, compress_level):
+    # render an avatar per seed (the same one as generate(seed=seed)) as png bytes
+    pngs = []
+    for avatar in _worker['spag'].generate_batch(seeds=seeds, **attributes):
+        buffer = io.BytesIO()
+        Image.fromarray(avatar).save(buffer, 'PNG', compress_level=compress_level)
+        pngs.append(buffer.getvalue())
+    return pngs
+
+
+def _render_into(output_name, shape, start, seeds, attributes):
+    # render an avatar per seed straight into the shared output array
+    shm = shared_memory.SharedMemory(name=output_name)
+    try:
+        output = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        _worker['spag'].generate_batch(seeds=seeds, out=output[start:start + len(seeds)], **attributes)
+        del output
+    finally:
+        shm.close()
+    return len(seeds)
+
+
+#--------------------------------------------------------------#
+# Parallel renderer                                            #
+#--------------------------------------------------------------#
+class ParallelAvatarRenderer:
+    # renders avatars on a pool of processes which all share one copy of the assets:
+    # the asset pack is loaded once into shared memory and every worker builds its
+    # generator on top of it. Every avatar is rendered from its own seed, so the
+    # result doesn't depend on the number of processes or on how the work is split
+    def __init__(self, images_path = 'images', pack_path = None, processes = None, chunk_size = 16):
+        if pack_path is None:
+            # the pack is only read into the shared memory, so its temporary folder goes right away
+            with tempfile.TemporaryDirectory(prefix='spag_') as folder:
+                pack_path = os.path.join(folder, 'assets.pack')
+                SouthParkAvatarGenerator(images_path).build_pack(pack_path)
+                pack = np.fromfile(pack_path, dtype=np.uint8)
+        else:
+            pack = np.fromfile(pack_path, dtype=np.uint8)
+
+        self.pack = shared_memory.SharedMemory(create=True, size=len(pack))
+        np.ndarray(pack.shape, dtype=np.uint8, buffer=self.pack.buf)[:] = pack
+        width, height = SouthParkAvatarGenerator.load_pack(pack)['canvas']
+        self.canvas_shape = (height, width, 4)
+        del pack
+
+        self.processes = processes or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.outputs = []
+        self.pool = multiprocessing.Pool(self.processes, initializer=_init_worker,
+                                         initargs=(self.pack.name, self.pack.size))
+
+    def jobs(self, seeds):
+        # split the seeds into (start, seeds) chunks
+        seeds = [int(seed) for seed in seeds]
+        return [(start, seeds[start:start + self.chunk_size]) for start in range(0, len(seeds), self.chunk_size)]
+
+    def render_pngs(self, seeds, compress_level = 6, **attributes):
+        # render an avatar per seed and return them as png bytes, in the order of the seeds
+        # (the keyword arguments fix attributes, like the ones of generate)
+        results = self.pool.starmap(_render_pngs, [(chunk, attributes, compress_level) for start, chunk in self.jobs(seeds)])
+        return [png for pngs in results for png in pngs]
+
+    def render_array(self, seeds, **attributes):
+        # render an avatar per seed into a (n, height, width, 4) array in shared memory, the workers
+        # write their avatars straight into it. The array stays valid until close()
+        shape = (len(seeds),) + self.canvas_shape
+        output = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)), 1))
+        self.outputs.append(output)
+        self.pool.starmap(_render_into, [(output.name, shape, start, chunk, attributes) for start, chunk in self.jobs(seeds)])
+        return np.ndarray(shape, dtype=np.uint8, buffer=output.buf)
+
+    def close(self):
+        # stop the workers and free the shared memory
+        self.pool.close()
+        self.pool.join()
+        for shm in self.outputs + [self.pack]:
+            try:
+                shm.close()
+            except BufferError:
+                # an array returned by render_array is still alive, the memory is freed with it
+                pass
+            shm.unlink()
+        self.outputs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
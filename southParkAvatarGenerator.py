@@ -1,11 +1,960 @@
+import io
 import os
+import re
+import math
+import functools
+import json
+import time
+import zlib
+import struct
+import threading
+from collections import OrderedDict, deque, namedtuple
 import numpy as np
 from PIL import Image
 
 
+# every choice which makes up an avatar: the colour and item indices (-1 when the avatar
+# doesn't have the optional item) and the tint jitter of the trousers and the beard
+Genome = namedtuple('Genome', ['skin_colour', 'hair_colour', 'shirt_colour', 'eyes', 'mouth', 'shirt',
+                               'trouser', 'hair', 'glasses', 'beard', 'trouser_jitter', 'beard_jitter'])
+
+
+def natural_key(name):
+    # the sort key of a file or folder name, so that '2' comes before '10'
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+class Layer:
+    # a single png of the avatar, trimmed to the box in which it is visible (alpha > 0)
+    # pixels: the (h, w, 4) read-only RGBA crop, top/left: its offset on the canvas
+    def __init__(self, pixels, top = 0, left = 0):
+        self.pixels = pixels
+        self.top = top
+        self.left = left
+
+    @classmethod
+    def trim(cls, img):
+        alpha = img[:, :, 3]
+        rows = np.flatnonzero(alpha.any(axis=1))
+        cols = np.flatnonzero(alpha.any(axis=0))
+        if len(rows) == 0:
+            pixels, top, left = img[:0, :0], 0, 0
+        else:
+            top, left = int(rows[0]), int(cols[0])
+            pixels = img[top:rows[-1] + 1, left:cols[-1] + 1]
+        pixels = np.ascontiguousarray(pixels)
+        pixels.flags.writeable = False
+        return cls(pixels, top, left)
+
+    @property
+    def shape(self):
+        return self.pixels.shape[:2]
+
+    @property
+    def nbytes(self):
+        return self.pixels.nbytes
+
+    def resolve(self):
+        # the decoded layer (see LazyLayer)
+        return self
+
+    @property
+    def window(self):
+        # the slices of the canvas which are covered by this layer
+        h, w = self.shape
+        return slice(self.top, self.top + h), slice(self.left, self.left + w)
+
+    @property
+    def empty(self):
+        return self.shape[0] * self.shape[1] == 0
+
+
+class PaletteLayer(Layer):
+    # a layer stored as a palette of its (few, flat shaded) RGBA colours and a plane of palette
+    # indices (uint8, or uint16 for layers with more than 256 colours). The RGBA pixels are only
+    # expanded when they are needed, and recolouring swaps palette entries (see expand)
+    def __init__(self, index, palette, top = 0, left = 0):
+        self.index = index
+        self.palette = palette
+        self.top = top
+        self.left = left
+
+    @classmethod
+    def from_layer(cls, layer):
+        colours, index = np.unique(layer.pixels.reshape(-1, 4).view(np.uint32)[:, 0], return_inverse=True)
+        index = index.reshape(layer.shape).astype(np.uint8 if len(colours) <= 256 else np.uint16)
+        palette = np.ascontiguousarray(colours.view(np.uint8).reshape(-1, 4))
+        index.flags.writeable = False
+        palette.flags.writeable = False
+        return cls(index, palette, layer.top, layer.left)
+
+    @classmethod
+    def trim(cls, img):
+        return cls.from_layer(Layer.trim(img))
+
+    def expand(self, palette = None):
+        # the (h, w, 4) RGBA pixels, through the layer's palette or a recoloured copy of it
+        palette = self.palette if palette is None else palette
+        return palette.view(np.uint32)[:, 0][self.index].view(np.uint8).reshape(self.shape + (4,))
+
+    @property
+    def pixels(self):
+        pixels = self.expand()
+        pixels.flags.writeable = False
+        return pixels
+
+    @property
+    def shape(self):
+        return self.index.shape
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + self.palette.nbytes
+
+
+class LazyLayer(Layer):
+    # a png which is only decoded when it is used, into a (shared, bounded) LayerCache. Every
+    # attribute goes through the cache, so an evicted layer is simply decoded again
+    def __init__(self, path, cache, decode):
+        self.path = path
+        self.cache = cache
+        self.decode = decode
+
+    def resolve(self):
+        return self.cache.get(self.path, lambda: self.decode(self.path))
+
+    def __getattr__(self, name):
+        # index, palette, expand ... of a decoded PaletteLayer
+        if name in ('path', 'cache', 'decode'):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    pixels = property(lambda self: self.resolve().pixels)
+    top = property(lambda self: self.resolve().top)
+    left = property(lambda self: self.resolve().left)
+    shape = property(lambda self: self.resolve().shape)
+    nbytes = property(lambda self: self.resolve().nbytes)
+
+
+class TintMasks(dict):
+    # the tint masks (see TintMask) of palette or lazy layers, only computed when a path which works on
+    # the RGBA pixels asks for them. With a LayerCache, the masks are kept in it (next to the
+    # decoded layers) instead of in the dict, so they are bounded by the same budget
+    def __init__(self, tint_mask, cache = None):
+        super().__init__()
+        self.tint_mask = tint_mask
+        self.cache = cache
+        self.layers = {}
+
+    def __missing__(self, key):
+        layer, rule = self.layers[key]
+        if self.cache is not None:
+            return self.cache.get(('tint_mask', key), lambda: self.tint_mask(layer.resolve(), rule))
+        self[key] = self.tint_mask(layer, rule)
+        return self[key]
+
+    def keys(self):
+        return self.layers.keys()
+
+    def items(self):
+        return [(key, self[key]) for key in self.layers]
+
+
+class RenderCache:
+    # a bounded LRU cache of rendered avatars, keyed by their genome. It keeps either the
+    # read-only RGBA array ('array') or the png bytes ('png') of an avatar, up to max_bytes
+    def __init__(self, max_bytes, format = 'array', compress_level = 6):
+        if format not in ('array', 'png'):
+            raise ValueError(f'unknown cache format: {format}')
+        self.max_bytes = max_bytes
+        self.format = format
+        self.compress_level = compress_level
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, avatar):
+        # store a rendered avatar (a PIL image, or its png bytes) and return the value as it is cached
+        if isinstance(avatar, bytes):
+            value = avatar
+            size = len(value)
+        elif self.format == 'png':
+            buffer = io.BytesIO()
+            avatar.save(buffer, 'PNG', compress_level=self.compress_level)
+            value = buffer.getvalue()
+            size = len(value)
+        else:
+            value = np.array(avatar)
+            value.flags.writeable = False
+            size = value.nbytes
+
+        with self.lock:
+            if key in self.items:
+                self.bytes -= self.size(self.items.pop(key))
+            if size <= self.max_bytes:
+                self.items[key] = value
+                self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.bytes -= self.size(self.items.popitem(last=False)[1])
+                self.evictions += 1
+        return value
+
+    @staticmethod
+    def size(value):
+        return len(value) if isinstance(value, bytes) else value.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.items), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        return len(self.items)
+
+
+# the channels of a layer which get the tint colour: the (uint32) indices of the pixels of which all
+# three colour channels are tinted, and the flat (pixel * 4 + channel) indices of the other tinted channels
+TintMask = namedtuple('TintMask', ['pixels', 'channels'])
+
+
+class LayerCache:
+    # a bounded LRU cache of decoded layers, tint masks and the forms derived from them (see
+    # SouthParkAvatarGenerator.derived) for lazy and compact layers, of at most max_bytes
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        # the cached value of key, or load() it (outside the lock, a race only decodes twice)
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+        value = load()
+        size = self.size(value)
+        with self.lock:
+            if key not in self.items:
+                self.items[key] = value
+                self.sizes[key] = size
+                self.bytes += size
+            while self.bytes > self.max_bytes and len(self.items) > 1:
+                self.bytes -= self.sizes.pop(self.items.popitem(last=False)[0])
+                self.evictions += 1
+        return value
+
+    @classmethod
+    def size(cls, value):
+        # the bytes of a cached value: a layer, an array or an image, or a tuple / dict of them
+        if isinstance(value, Image.Image):
+            return value.width * value.height * len(value.getbands())
+        if isinstance(value, dict):
+            return sum(cls.size(v) for v in value.values())
+        if isinstance(value, (tuple, list)):
+            return sum(cls.size(v) for v in value)
+        return getattr(value, 'nbytes', 0)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.items), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        return len(self.items)
+
+
+# a sampling rule: when the attributes in `when` have one of the given values ({attribute: value or
+# [values]}, -1 is 'without' for an optional item), exclude some values of `attribute` (a list, or
+# 'item' for every item of an optional attribute, which leaves only 'without') or draw it from
+# `weights` ({value: weight}) instead. The exclusions of every matching rule apply on top of the
+# weights of the last matching rule with weights
+Rule = namedtuple('Rule', ['attribute', 'when', 'exclude', 'weights'], defaults=(None, None))
+
+
+class AliasTable:
+    # Walker's alias method: one uniform column and one coin per draw, whatever the number of values.
+    # Every row of a 2d array of weights is a distribution of its own (the rows of a conditional table)
+    def __init__(self, weights):
+        weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+        rows, k = weights.shape
+        totals = weights.sum(axis=1, keepdims=True)
+        if (totals <= 0).any():
+            raise ValueError('a distribution without any weight')
+        self.k = k
+        self.prob = np.ones((rows, k))
+        self.alias = np.tile(np.arange(k), (rows, 1))
+        for row, scaled in enumerate(weights / totals * k):
+            small = [i for i in range(k) if scaled[i] < 1]
+            large = [i for i in range(k) if scaled[i] >= 1]
+            while small and large:
+                less, more = small.pop(), large.pop()
+                self.prob[row, less] = scaled[less]
+                self.alias[row, less] = more
+                scaled[more] -= 1 - scaled[less]
+                (small if scaled[more] < 1 else large).append(more)
+
+    def draw(self, rng, n, rows = 0):
+        # n draws (columns), from the distribution of row `rows` (an int or an array of n rows)
+        column = rng.integers(0, self.k, size=n)
+        keep = rng.random(n) < self.prob[rows, column]
+        return np.where(keep, column, self.alias[rows, column])
+
+
+class AttributeSampler:
+    # draws the attributes of a batch of avatars from alias tables. An attribute which has rules
+    # depending on earlier attributes (in `order`) gets a table with a row for every combination of
+    # their values, so the rules are compiled into the tables and nothing is ever rejected.
+    # The optional items have 'without' (-1) as their first value
+    order = ('skin_colour', 'hair_colour', 'shirt_colour', 'eyes', 'mouth', 'shirt', 'trouser', 'hair', 'glasses', 'beard')
+    optional = ('hair', 'glasses', 'beard')
+
+    def __init__(self, weights, rules = ()):
+        # weights: {attribute: weights of its values} (for an optional item: without, item 0, item 1 ...)
+        self.offsets = {a: 1 if a in self.optional else 0 for a in self.order}
+        self.sizes = {a: len(weights[a]) for a in self.order}
+        self.parents = {a: [] for a in self.order}
+        for rule in rules:
+            if rule.attribute not in self.parents:
+                raise ValueError(f'unknown attribute: {rule.attribute}')
+            for parent in rule.when:
+                if parent not in self.parents or self.order.index(parent) >= self.order.index(rule.attribute):
+                    raise ValueError(f'{rule.attribute} can only depend on the attributes before it in {self.order}')
+                if parent not in self.parents[rule.attribute]:
+                    self.parents[rule.attribute].append(parent)
+        for attribute in self.order:
+            self.parents[attribute].sort(key=self.order.index)
+
+        self.tables, self.present_tables = {}, {}
+        for attribute in self.order:
+            rows = self.compile(attribute, np.asarray(weights[attribute], dtype=np.float64),
+                                [rule for rule in rules if rule.attribute == attribute])
+            self.tables[attribute] = AliasTable(rows)
+            if attribute in self.optional:
+                # for has_<item>=1 without an item: the same rows without 'without' (a row in which the
+                # rules forbid every item falls back to the plain item weights, the caller asked for one)
+                present = rows.copy()
+                present[:, 0] = 0
+                present[present.sum(axis=1) == 0, 1:] = weights[attribute][1:]
+                self.present_tables[attribute] = AliasTable(present)
+
+    def shape(self, attribute):
+        return [self.sizes[parent] for parent in self.parents[attribute]]
+
+    def compile(self, attribute, weights, rules):
+        # the (rows, values) weights of an attribute, a row per combination of its parents' values
+        shape = self.shape(attribute)
+        rows = np.tile(weights, (int(np.prod(shape)), 1))
+        for row in range(len(rows)):
+            columns = np.unravel_index(row, shape) if shape else ()
+            values = {parent: int(column) - self.offsets[parent] for parent, column in zip(self.parents[attribute], columns)}
+            matching = [rule for rule in rules
+                        if all(values[parent] in np.atleast_1d(allowed) for parent, allowed in rule.when.items())]
+            # the weights of the last matching rule with weights, without the exclusions of every matching rule
+            for rule in matching:
+                if rule.weights is not None:
+                    rows[row] = 0
+                    for value, weight in rule.weights.items():
+                        rows[row, value + self.offsets[attribute]] = weight
+            for rule in matching:
+                if rule.exclude is not None:
+                    if isinstance(rule.exclude, str) and rule.exclude == 'item':
+                        rows[row, self.offsets[attribute]:] = 0
+                    else:
+                        rows[row, np.asarray(rule.exclude, dtype=np.int64) + self.offsets[attribute]] = 0
+            if rows[row].sum() <= 0:
+                raise ValueError(f'the rules leave no {attribute} for {values}')
+        return rows
+
+    @classmethod
+    def from_generator(cls, spag, rules = ()):
+        # the weights of a generator (its *_proba lists), an optional item is 'without' with the
+        # probability of has_<item> = False
+        weights = {'skin_colour': spag.skin_colours_proba, 'hair_colour': spag.hair_colours_proba,
+                   'shirt_colour': spag.shirt_colours_proba, 'eyes': spag.eyes_proba, 'mouth': spag.mouths_proba,
+                   'shirt': spag.shirts_proba, 'trouser': spag.trousers_proba}
+        for attribute, has, proba in (('hair', spag.has_hairs_proba, spag.hairs_proba),
+                                      ('glasses', spag.has_glasses_proba, spag.glasses_proba),
+                                      ('beard', spag.has_beards_proba, spag.beards_proba)):
+            weights[attribute] = np.concatenate([[has[0]], has[1] * np.asarray(proba, dtype=np.float64)])
+        return cls(weights, rules)
+
+    def sample(self, rng, n, fixed = None, present = ()):
+        # the attributes of n avatars (as sample_batch), `fixed` {attribute: value} are not drawn
+        # and the optional items in `present` are drawn without 'without'
+        fixed = fixed or {}
+        values = {}
+        for attribute in self.order:
+            if attribute in fixed:
+                values[attribute] = np.full(n, int(fixed[attribute]), dtype=np.int64)
+                continue
+            table = self.present_tables[attribute] if attribute in present else self.tables[attribute]
+            rows = 0
+            if self.parents[attribute]:
+                rows = np.ravel_multi_index([values[parent] + self.offsets[parent] for parent in self.parents[attribute]],
+                                            self.shape(attribute))
+            values[attribute] = table.draw(rng, n, rows) - self.offsets[attribute]
+
+        # the tint jitter of the trousers and the beard
+        values['trouser_jitter'] = rng.integers(-50, 50, size=n)
+        values['beard_jitter'] = np.where(values['beard'] >= 0, rng.integers(0, 50, size=n), 0)
+        return values
+
+
+class ColourJitter:
+    # continuous variation of the tint colours of a batch: the skin, hair and shirt colour of every
+    # avatar is converted to HSV or LAB, moved by its own noise and converted back, as (n, 3)
+    # arrays. The trousers and the beard follow from the jittered shirt and hair as before.
+    # The noise of a colour is a scale per channel: a standard deviation ('normal') or a half
+    # width ('uniform'); HSV channels are 0 - 1 (hue in turns), LAB is L 0 - 100 and a, b
+    spaces = ('hsv', 'lab')
+
+    def __init__(self, space = 'hsv', skin = None, hair = None, shirt = None, distribution = 'normal'):
+        if space not in self.spaces:
+            raise ValueError(f'unknown colour space: {space}')
+        if distribution not in ('normal', 'uniform'):
+            raise ValueError(f'unknown distribution: {distribution}')
+        self.space = space
+        self.distribution = distribution
+        self.scales = {colour: np.asarray(scale, dtype=np.float64) for colour, scale in
+                       (('skin', skin), ('hair', hair), ('shirt', shirt)) if scale is not None}
+
+    def __call__(self, rng, colours):
+        # the jittered copy of {colour: (n, 3) RGB array}
+        jittered = dict(colours)
+        for colour, scale in self.scales.items():
+            values = self.to_space(np.asarray(colours[colour], dtype=np.float64))
+            if self.distribution == 'normal':
+                values += rng.standard_normal(values.shape) * scale
+            else:
+                values += rng.uniform(-1, 1, values.shape) * scale
+            jittered[colour] = np.clip(np.rint(self.from_space(values)), 0, 255).astype(np.int64)
+        return jittered
+
+    def to_space(self, rgb):
+        return self.rgb_to_hsv(rgb) if self.space == 'hsv' else self.rgb_to_lab(rgb)
+
+    def from_space(self, values):
+        if self.space == 'hsv':
+            values[:, 0] %= 1
+            values[:, 1:] = np.clip(values[:, 1:], 0, 1)
+            return self.hsv_to_rgb(values)
+        return self.lab_to_rgb(values)
+
+    @staticmethod
+    def rgb_to_hsv(rgb):
+        # (n, 3) RGB 0 - 255 -> HSV 0 - 1
+        rgb = rgb / 255
+        high, low = rgb.max(axis=1), rgb.min(axis=1)
+        delta = high - low
+        safe = np.where(delta > 0, delta, 1)
+        r, g, b = rgb.T
+        hue = np.select([high == r, high == g], [(g - b) / safe, 2 + (b - r) / safe], 4 + (r - g) / safe)
+        hue = np.where(delta > 0, hue / 6 % 1, 0)
+        return np.stack([hue, np.where(high > 0, delta / np.where(high > 0, high, 1), 0), high], axis=1)
+
+    @staticmethod
+    def hsv_to_rgb(hsv):
+        # (n, 3) HSV 0 - 1 -> RGB 0 - 255
+        h, s, v = hsv.T
+        sector = np.floor(h * 6).astype(np.int64) % 6
+        f = h * 6 - np.floor(h * 6)
+        p, q, t = v * (1 - s), v * (1 - s * f), v * (1 - s * (1 - f))
+        table = np.stack([np.stack(c, axis=1) for c in ((v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q))])
+        return table[sector, np.arange(len(h))] * 255
+
+    # sRGB (D65) <-> XYZ
+    xyz_matrix = np.array([[0.4124564, 0.3575761, 0.1804375],
+                           [0.2126729, 0.7151522, 0.0721750],
+                           [0.0193339, 0.1191920, 0.9503041]])
+    white = np.array([0.95047, 1.0, 1.08883])
+
+    @classmethod
+    def rgb_to_lab(cls, rgb):
+        # (n, 3) RGB 0 - 255 -> CIE LAB
+        c = rgb / 255
+        linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+        xyz = linear @ cls.xyz_matrix.T / cls.white
+        f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+        return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+    @classmethod
+    def lab_to_rgb(cls, lab):
+        # CIE LAB -> (n, 3) RGB 0 - 255 (out of gamut colours are clipped)
+        fy = (lab[:, 0] + 16) / 116
+        f = np.stack([fy + lab[:, 1] / 500, fy, fy - lab[:, 2] / 200], axis=1)
+        xyz = np.where(f > 6 / 29, f ** 3, 3 * (6 / 29) ** 2 * (f - 4 / 29)) * cls.white
+        linear = np.clip(xyz @ np.linalg.inv(cls.xyz_matrix).T, 0, 1)
+        return np.where(linear <= 0.0031308, linear * 12.92, 1.055 * linear ** (1 / 2.4) - 0.055) * 255
+
+
+def _no_clock():
+    # the clock of an unprofiled generator
+    return 0
+
+
+class RenderProfiler:
+    # an on_stage(name, elapsed_ns) callback which aggregates the timings of every stage: the count
+    # and total of all calls, and the p50/p99 of the last `window` calls. Stages of generate():
+    #   select              drawing (or applying) the genome
+    #   paint.<stage>       a layer stage (hair_bg, body, ..., hair_fg) of the PIL compositor
+    #   recolor/convert/paste   the totals per avatar of tinting, Image.fromarray and paste
+    #   composite           all the layers, with compositor='premultiplied'
+    #   scaled              rendering at a small size
+    #   encode              turning the avatar into the requested format
+    #   generate            the whole call
+    #   load.<folder>       reading (or indexing, when lazy) the pngs of a folder
+    def __init__(self, window = 10000):
+        self.window = window
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, name, elapsed_ns):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = [0, 0, deque(maxlen=self.window)]
+            stage[0] += 1
+            stage[1] += elapsed_ns
+            stage[2].append(elapsed_ns)
+
+    def stats(self):
+        # {stage: {count, total_ms, mean_ms, p50_ms, p99_ms}}
+        with self.lock:
+            stages = {name: (count, total, np.array(samples)) for name, (count, total, samples) in self.stages.items()}
+        return {name: {'count': count, 'total_ms': total / 1e6, 'mean_ms': total / count / 1e6,
+                       'p50_ms': float(np.percentile(samples, 50)) / 1e6, 'p99_ms': float(np.percentile(samples, 99)) / 1e6}
+                for name, (count, total, samples) in stages.items()}
+
+    def to_json(self):
+        return json.dumps(self.stats(), indent=2)
+
+    def to_prometheus(self, metric = 'spag_stage_seconds'):
+        # the stats as a prometheus summary (text exposition format)
+        lines = [f'# HELP {metric} time spent per avatar generator stage', f'# TYPE {metric} summary']
+        for name, stage in sorted(self.stats().items()):
+            lines.append(f'{metric}{{stage="{name}",quantile="0.5"}} {stage["p50_ms"] / 1e3:.9f}')
+            lines.append(f'{metric}{{stage="{name}",quantile="0.99"}} {stage["p99_ms"] / 1e3:.9f}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {stage["total_ms"] / 1e3:.9f}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {stage["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        # a table of the stages, slowest (in total) first
+        rows = sorted(self.stats().items(), key=lambda item: -item[1]['total_ms'])
+        lines = [f'{"stage":18s} {"count":>8s} {"total ms":>10s} {"p50 ms":>8s} {"p99 ms":>8s}']
+        lines += [f'{name:18s} {s["count"]:8d} {s["total_ms"]:10.1f} {s["p50_ms"]:8.3f} {s["p99_ms"]:8.3f}' for name, s in rows]
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+
+
+class LayerStackMemo:
+    # a trie of partially painted avatars: the children of a node are keyed by the genome values
+    # of the next stage (see SouthParkAvatarGenerator.stage_key), so the path to a node at depth d
+    # describes the canvas after the first d stages. A stage only changes the window covered by
+    # its layers, so every node keeps just that window of the canvas (its patch): copying the
+    # patches along a path rebuilds the partial canvas, without blending anything.
+    # Nodes are evicted least recently used first once they take more than max_bytes; using a
+    # node also touches its ancestors (after it), so the victim is always a leaf
+    node_bytes = 256   # what an (empty) node costs, on top of its patch
+
+    class Node:
+        __slots__ = ('parent', 'key', 'children', 'window', 'patch')
+
+        def __init__(self, parent = None, key = None, window = None, patch = None):
+            self.parent = parent
+            self.key = key
+            self.children = {}
+            self.window = window
+            self.patch = patch
+
+        @property
+        def nbytes(self):
+            return LayerStackMemo.node_bytes + (self.patch.nbytes if self.patch is not None else 0)
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.root = self.Node()
+        self.nodes = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def deepest(self, keys):
+        # the depth and the node of the deepest stored stage along keys (0 and None: no stage)
+        with self.lock:
+            depth, node = 0, self.root
+            for key in keys:
+                child = node.children.get(key)
+                if child is None:
+                    break
+                depth, node = depth + 1, child
+            if depth == 0:
+                self.misses += 1
+                return 0, None
+            self.hits += 1
+            self.touch(node)
+            return depth, node
+
+    def restore(self, node, canvas):
+        # paint the partial canvas of a node on an empty canvas
+        path = []
+        while node is not None and node is not self.root:
+            path.append(node)
+            node = node.parent
+        for node in reversed(path):
+            if node.patch is not None:
+                canvas[node.window] = node.patch
+
+    def store(self, parent, key, window, canvas):
+        # store the window of the canvas as the child (key) of parent (None: the root). The path
+        # which is being built is never evicted for it: when only that path is left to evict, the
+        # new node goes again and None tells the caller to stop memoising this avatar
+        with self.lock:
+            parent = parent or self.root
+            if not self.attached(parent):
+                return None
+            node = parent.children.get(key)
+            if node is None:
+                patch = None
+                if window is not None:
+                    patch = canvas[window].copy()
+                    patch.flags.writeable = False
+                node = parent.children[key] = self.Node(parent, key, window, patch)
+                self.bytes += node.nbytes
+            self.touch(node)
+            path = set()
+            n = node
+            while n is not self.root:
+                path.add(n)
+                n = n.parent
+            while self.bytes > self.max_bytes and self.nodes:
+                victim = next(iter(self.nodes))
+                if victim in path:
+                    self.evict(node)
+                    return None
+                self.evict(victim)
+            return node
+
+    def attached(self, node):
+        # whether a node is still in the trie (an evicted node keeps its parent)
+        while node is not self.root:
+            if node.parent is None or node.parent.children.get(node.key) is not node:
+                return False
+            node = node.parent
+        return True
+
+    def touch(self, node):
+        if not self.attached(node):
+            return
+        while node is not None and node is not self.root:
+            self.nodes[node] = None
+            self.nodes.move_to_end(node)
+            node = node.parent
+
+    def evict(self, node):
+        # drop a node and everything below it
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            stack.extend(n.children.values())
+            self.nodes.pop(n, None)
+            self.bytes -= n.nbytes
+            self.evictions += 1
+        del node.parent.children[node.key]
+
+    def clear(self):
+        with self.lock:
+            self.root = self.Node()
+            self.nodes.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'nodes': len(self.nodes), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class AvatarCombinations:
+    # every combination of attribute values as a lazy sequence of genomes. The order is a
+    # reflected mixed-radix Gray code, so two consecutive genomes differ in one attribute only.
+    # The attributes which are painted first change the slowest, so consecutive avatars share
+    # most of their layer stack (which the layer-stack memo reuses)
+    order = ('hair', 'hair_colour', 'skin_colour', 'shirt_colour', 'trouser_jitter', 'trouser', 'shirt',
+             'beard', 'beard_jitter', 'eyes', 'mouth', 'glasses')
+
+    def __init__(self, spag, offset = 0, render = True, memo_bytes = 32 * 2**20, **constraints):
+        unknown = set(constraints) - set(Genome._fields)
+        if unknown:
+            raise TypeError(f'unknown attributes: {", ".join(sorted(unknown))}')
+        self.spag = spag
+        self.offset = offset
+        self.render = render
+        self.memo_bytes = memo_bytes
+
+        # the values of every attribute: an index, a list of indices or everything
+        self.values = []
+        for field in self.order:
+            values = constraints.get(field)
+            if values is None:
+                values = spag.attribute_values(field)
+            elif isinstance(values, (int, np.integer)):
+                values = [values]
+            self.values.append([int(v) for v in values])
+        self.radices = [len(v) for v in self.values]
+
+    def __len__(self):
+        return int(np.prod(self.radices, dtype=object))
+
+    def genome(self, i):
+        # the i-th genome: the digits of i in the mixed radix, every digit reflected
+        # whenever the digits before it make up an odd number
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        values = {}
+        for field, radix, options in reversed(list(zip(self.order, self.radices, self.values))):
+            i, digit = divmod(i, radix)
+            values[field] = (digit, radix)
+        row = 0
+        for field, radix, options in zip(self.order, self.radices, self.values):
+            digit, radix = values[field]
+            values[field] = options[radix - 1 - digit if row % 2 else digit]
+            row = row * radix + digit
+        return Genome(**values)
+
+    def __getitem__(self, i):
+        return self.genome(i if i >= 0 else len(self) + i)
+
+    def __iter__(self):
+        # yield the genomes (or (genome, avatar) pairs) from the offset on
+        memo = LayerStackMemo(self.memo_bytes) if self.render and self.spag.memo is None else None
+        for i in range(self.offset, len(self)):
+            genome = self.genome(i)
+            if self.render:
+                yield genome, self.spag.render_genome(genome, memo=memo)
+            else:
+                yield genome
+
+
+class AvatarEditor:
+    # an avatar which is edited one attribute at a time. Every stage keeps its patch: the
+    # canvas after that stage, over the window of its layers (as in the layer-stack memo), so
+    # the canvas below any stage is rebuilt by copying patches. An edit changes the stages whose
+    # stage_key changes; only their old and new windows (the dirty box) are recomposited: the
+    # stages below the first changed one are copied from their patches, that one and the ones
+    # above it are pasted again, clipped to the box. PIL's paste isn't associative, so the stages
+    # above are pasted again (from cached, already tinted layer images) rather than blended as
+    # one upper composite; the avatar stays the same as generate() for its genome
+    def __init__(self, spag, genome = None):
+        self.spag = spag
+        self.genome = spag.sample_genome() if genome is None else spag.as_genome(genome)
+        self.canvas = np.zeros(spag.canvas_shape, dtype=np.uint8)
+        self.windows = [None] * len(spag.layer_stages)
+        self.patches = [None] * len(spag.layer_stages)
+        self.images = {}
+        self.recomposite(0, (0, 0) + spag.canvas_shape[:2])
+
+    @property
+    def avatar(self):
+        # the avatar as a PIL image
+        return Image.fromarray(self.canvas, 'RGBA')
+
+    def set(self, attribute, value):
+        # change one genome field (-1 removes an optional item), returns the dirty box
+        # (top, left, bottom, right) of the canvas, None when nothing changed
+        return self.update(**{attribute: value})
+
+    def update(self, **attributes):
+        for attribute in attributes:
+            if attribute not in Genome._fields:
+                raise ValueError(f'unknown attribute: {attribute}')
+        # checked (the jitters too) before anything changes, a ValueError leaves the editor as it was
+        genome = self.spag.as_genome(self.genome._replace(**attributes))
+
+        # the stages which change, and the box covered by their old and new layers
+        first, box = None, None
+        for d, (stage, attribute) in enumerate(self.spag.layer_stages):
+            if self.spag.stage_key(stage, genome) == self.spag.stage_key(stage, self.genome):
+                continue
+            first = d if first is None else first
+            for window in (self.windows[d], self.stage_window(stage, attribute, genome)):
+                if window is not None:
+                    w = (window[0].start, window[1].start, window[0].stop, window[1].stop)
+                    box = w if box is None else (min(box[0], w[0]), min(box[1], w[1]), max(box[2], w[2]), max(box[3], w[3]))
+        self.genome = genome
+        if box is None:
+            return None
+        self.recomposite(first, box)
+        return box
+
+    def stage_window(self, stage, attribute, genome):
+        index = getattr(genome, attribute) if attribute is not None else None
+        if index is not None and index < 0:
+            return None
+        return self.spag.stage_window(stage, index)
+
+    def layer_image(self, key, layer, rule, colour):
+        # the PIL image of a (tinted) layer, kept until its colour changes (in the generator's
+        # bounded derived_cache for lazy and compact layers)
+        colour = tuple(int(c) for c in colour) if rule is not None else None
+
+        def build():
+            return Image.fromarray(self.spag.recolor(key, layer, colour) if rule is not None else layer.pixels, 'RGBA')
+
+        if self.spag.derived_cache is not None:
+            return self.spag.derived_cache.get(('editor', key, colour), build)
+        cached = self.images.get(key)
+        if cached is None or cached[0] != colour:
+            cached = self.images[key] = (colour, build())
+        return cached[1]
+
+    def recomposite(self, first, box):
+        # paint the stages from first on within box: the canvas below first comes from the patches
+        top, left, bottom, right = box
+        region = np.zeros((bottom - top, right - left, 4), dtype=np.uint8)
+        for window, patch in zip(self.windows[:first], self.patches[:first]):
+            if window is None:
+                continue
+            y0, y1 = max(window[0].start, top), min(window[0].stop, bottom)
+            x0, x1 = max(window[1].start, left), min(window[1].stop, right)
+            if y1 > y0 and x1 > x0:
+                region[y0 - top:y1 - top, x0 - left:x1 - left] = \
+                    patch[y0 - window[0].start:y1 - window[0].start, x0 - window[1].start:x1 - window[1].start]
+
+        image = Image.fromarray(region, 'RGBA')
+        colours = self.spag.genome_colours(self.genome)
+        for d in range(first, len(self.spag.layer_stages)):
+            stage, attribute = self.spag.layer_stages[d]
+            window = self.stage_window(stage, attribute, self.genome)
+            if window is not None:
+                index = getattr(self.genome, attribute) if attribute is not None else None
+                for key, layer, rule, colour in self.spag.stage_layers(stage, index):
+                    if layer.empty:
+                        continue
+                    pixels = self.layer_image(key, layer, rule, colours[colour] if rule is not None else None)
+                    image.paste(pixels, (layer.left - left, layer.top - top), pixels)
+
+            # the stage's patch: the box part of it is new (the stage which changed lies within the box)
+            if window is not None:
+                patch = self.patches[d] if self.windows[d] == window else np.zeros((window[0].stop - window[0].start, window[1].stop - window[1].start, 4), dtype=np.uint8)
+                y0, y1 = max(window[0].start, top), min(window[0].stop, bottom)
+                x0, x1 = max(window[1].start, left), min(window[1].stop, right)
+                if y1 > y0 and x1 > x0:
+                    patch[y0 - window[0].start:y1 - window[0].start, x0 - window[1].start:x1 - window[1].start] = \
+                        np.asarray(image)[y0 - top:y1 - top, x0 - left:x1 - left]
+                self.patches[d] = patch
+            else:
+                self.patches[d] = None
+            self.windows[d] = window
+        self.canvas[top:bottom, left:right] = np.asarray(image)
+
+
 class SouthParkAvatarGenerator:
-    def __init__(self, images_path = 'images'):
+    def __init__(self, images_path = 'images', pack_path = None, seed = None, cache_bytes = 0, cache_format = 'array',
+                 memo_bytes = 0, compositor = 'pil', compact = False, lazy = False, layer_cache_bytes = None,
+                 profiler = None, rules = None, manifest_path = None):
         self.images_path = images_path
+
+        # an optional on_stage(name, elapsed_ns) callback (e.g. a RenderProfiler) which gets the time
+        # of every stage of generate() and of the asset loading; without it nothing is timed
+        self.on_stage = profiler
+        self.clock = time.perf_counter_ns if profiler is not None else _no_clock
+
+        # compact: keep the png layers as PaletteLayers (palette + index plane) instead of RGBA
+        self.compact = compact
+
+        # lazy: only index the png files, and decode a layer when it is first used into an LRU
+        # cache of at most layer_cache_bytes (256 MiB by default, see preload to decode some categories up front)
+        self.layer_cache = None
+        if lazy and pack_path is None:
+            self.layer_cache = LayerCache(256 * 2**20 if layer_cache_bytes is None else layer_cache_bytes)
+
+        # the forms which are derived from the layers on first use (see derived) are kept in the layer
+        # cache for lazy layers, and for compact ones in a cache of layer_cache_bytes (16 MiB by default),
+        # so they don't undo the memory which lazy or compact layers save
+        self.derived_cache = self.layer_cache
+        if self.derived_cache is None and compact and pack_path is None:
+            self.derived_cache = LayerCache(16 * 2**20 if layer_cache_bytes is None else layer_cache_bytes)
+
+        # how generate() composites the layers: 'pil' (PIL's paste, the reference which every other
+        # path matches) or 'premultiplied' (the 'over' operator on a reused uint16 canvas, see composite_over)
+        if compositor not in ('pil', 'premultiplied'):
+            raise ValueError(f'unknown compositor: {compositor}')
+        self.compositor = compositor
+
+        # an optional LRU cache of rendered avatars (keyed by genome) of at most cache_bytes
+        self.cache = RenderCache(cache_bytes, cache_format) if cache_bytes else None
+
+        # an optional memo of partially painted canvases (see LayerStackMemo) of at most memo_bytes
+        self.memo = LayerStackMemo(memo_bytes) if memo_bytes else None
+
+        # every generator has its own random generator, generate(seed=...) reseeds it
+        self.rng = np.random.default_rng(seed)
+
+        # a compiled asset pack (see build_pack) replaces the png files,
+        # pack_path is the pack file or a uint8 array which holds one
+        self.pack = self.load_pack(pack_path) if pack_path is not None else None
+
+        # an asset manifest (see assetCompiler.py) lists the items in a stable order with the role,
+        # visible box and hash of every layer and the weight of every item, so nothing has to be
+        # derived from the images folder. <images_path>/assets.json (or .toml) is used when it is
+        # there, manifest_path points to another one and manifest_path=False ignores it. A pack
+        # carries the manifest it was built with (for the weights, stages and tints)
+        self.manifest = self.find_manifest(manifest_path) if self.pack is None else self.pack['manifest']
+
+        # the canvas, the paint order (layer_stages) and the tint of every layer (default_tint)
+        # are taken from the manifest when it has them
+        manifest = self.manifest or {}
+        self.canvas_size = tuple(manifest.get('canvas', self.pack['canvas'] if self.pack else self.canvas_size))
+        self.canvas_shape = (self.canvas_size[1], self.canvas_size[0], 4)
+        if 'crop_box' in manifest:
+            self.crop_box = tuple(manifest['crop_box'])
+        elif self.canvas_size != SouthParkAvatarGenerator.canvas_size:
+            # the largest centred square
+            side = min(self.canvas_size)
+            left, top = (self.canvas_size[0] - side) // 2, (self.canvas_size[1] - side) // 2
+            self.crop_box = (left, top, left + side, top + side)
+        self.layer_stages = tuple(tuple(stage) for stage in manifest.get('stages', self.layer_stages))
+        self.tints = self.manifest_tints(manifest)
         
         #-------------------#
         # Init the colours  #
@@ -38,22 +987,22 @@ class SouthParkAvatarGenerator:
 
         # eyes
         self.eyes = self.read_single_pngs('eyes')
-        self.eyes_proba = np.ones(len(self.eyes))/len(self.eyes) # an equal chance for everyone
+        self.eyes_proba = self.item_proba('eyes', self.eyes)
         self.eye = None
         
         # mouth
         self.mouths = self.read_single_pngs('mouth')
-        self.mouths_proba = np.ones(len(self.mouths))/len(self.mouths) # an equal chance for everyone
+        self.mouths_proba = self.item_proba('mouth', self.mouths)
         self.mouth = None
         
         # shirt
         self.shirts = self.read_single_pngs('shirt')
-        self.shirts_proba = np.ones(len(self.shirts))/len(self.shirts) # an equal chance for everyone
+        self.shirts_proba = self.item_proba('shirt', self.shirts)
         self.shirt = None
         
         # trousers
         self.trousers = self.read_single_pngs('trousers')
-        self.trousers_proba = np.ones(len(self.trousers))/len(self.trousers) # an equal chance for everyone
+        self.trousers_proba = self.item_proba('trousers', self.trousers)
         self.trouser = None
         
         
@@ -102,40 +1051,59 @@ class SouthParkAvatarGenerator:
         #----------------#
         # hair
         self.hairs = self.read_single_pngs('hair')
-        self.hairs_proba = np.ones(len(self.hairs))/len(self.hairs) # an equal chance for everyone
+        self.hairs_proba = self.item_proba('hair', self.hairs)
         self.hair = None
         
         # glasses
         self.glasses = self.read_single_pngs('glasses')
-        self.glasses_proba = np.ones(len(self.glasses))/len(self.glasses) # an equal chance for everyone
+        self.glasses_proba = self.item_proba('glasses', self.glasses)
         self.glass = None
         
         
         # beards
         self.beards = self.read_single_pngs('beards')
-        self.beards_proba = np.ones(len(self.beards))/len(self.beards) # an equal chance for everyone
+        self.beards_proba = self.item_proba('beards', self.beards)
         self.beard = None
         
         
         # items
         self.items = self.read_single_pngs('items')
-        self.items_proba = np.ones(len(self.items))/len(self.items) # an equal chance for everyone
+        self.items_proba = self.item_proba('items', self.items)
         self.item = None
                 
         # hats
         self.hats = self.read_single_pngs('hats')
-        self.hats_proba = np.ones(len(self.hats))/len(self.hats) # an equal chance for everyone
+        self.hats_proba = self.item_proba('hats', self.hats)
         self.hat = None
                 
         # jewelry
         self.jewellery = self.read_single_pngs('jewellery')
-        self.jewellery_proba = np.ones(len(self.jewellery))/len(self.jewellery) # an equal chance for everyone
+        self.jewellery_proba = self.item_proba('jewellery', self.jewellery)
         self.jewel = None
         
         # pins
         self.pins = self.read_single_pngs('pins')
-        self.pins_proba = np.ones(len(self.pins))/len(self.pins) # an equal chance for everyone
+        self.pins_proba = self.item_proba('pins', self.pins)
         self.pin = None
+
+        #-------------#
+        # Tint masks  #
+        #-------------#
+        self.palette_tints = {}
+        self.tint_masks = self.pack['tint_masks'] if self.pack else self.build_tint_masks()
+        self.stage_fields = self.build_stage_fields()
+
+        #-------------#
+        # Sampler     #
+        #-------------#
+        # with rules (a list of Rule, may be empty) the attributes are drawn from alias tables
+        # (see AttributeSampler), otherwise with rng.choice per attribute as before
+        self.sampler = AttributeSampler.from_generator(self, rules) if rules is not None else None
+        self._batch_layers = {}
+        self._premultiplied = {}
+        # the premultiplied canvas of every thread (see composite_over)
+        self._local = threading.local()
+        self.pyramids = {}
              
             
             
@@ -146,28 +1114,135 @@ class SouthParkAvatarGenerator:
         prop_value = getattr(self, property_value)
         prop_proba = getattr(self, property_proba)
         
-        if type(index) == int and index >= 0 and index < len(prop_proba):
-            prop_value = prop_values[index]
-        else:
-            prop_value = prop_values[np.random.choice(len(prop_proba), 1, p=prop_proba)[0]]
+        # numpy integers (e.g. from a genome array) are indices too, a bool is not
+        if not isinstance(index, (int, np.integer)) or isinstance(index, bool) or index < 0 or index >= len(prop_proba):
+            index = self.rng.choice(len(prop_proba), p=prop_proba)
+        prop_value = prop_values[index]
             
         setattr(self, property_value, prop_value)
+        setattr(self, f'{property_value}_index', int(index))
         return prop_value
     
     def read_single_pngs(self, obj):
         # temporary
+        if self.pack:
+            return self.pack['categories'][obj]
+        start = self.clock()
         imgs = []
-        for folder in os.listdir(f'{self.images_path}/{obj}'):
+        if self.manifest is not None:
+            for item in self.manifest['categories'][obj]['items']:
+                img_dict = {'fg': []}
+                for layer in item['layers']:
+                    img_dict.setdefault(layer['role'], []).append(
+                        self.read_layer(f'{self.images_path}/{layer["file"]}', layer.get('bbox')))
+                imgs.append(img_dict)
+            if self.on_stage is not None:
+                self.on_stage(f'load.{obj}', self.clock() - start)
+            return imgs
+
+        # the folders and files in natural order, so that the indices don't depend on the file system
+        for folder in sorted(os.listdir(f'{self.images_path}/{obj}'), key=natural_key):
             img_dict = {'fg':[]}
-            for img in os.listdir(f'{self.images_path}/{obj}/{folder}'):
+            for img in sorted(os.listdir(f'{self.images_path}/{obj}/{folder}'), key=natural_key):
                 if 'bg' in img:
                     if 'bg' not in img_dict:
                         img_dict['bg'] = []
-                    img_dict['bg'].append( np.array(Image.open(f'{self.images_path}/{obj}/{folder}/{img}')) )
+                    img_dict['bg'].append( self.read_layer(f'{self.images_path}/{obj}/{folder}/{img}') )
                 else:
-                    img_dict['fg'].append( np.array(Image.open(f'{self.images_path}/{obj}/{folder}/{img}')) )
+                    img_dict['fg'].append( self.read_layer(f'{self.images_path}/{obj}/{folder}/{img}') )
             imgs.append(img_dict)
+        if self.on_stage is not None:
+            self.on_stage(f'load.{obj}', self.clock() - start)
         return imgs
+
+    def read_layer(self, path, bbox = None):
+        # the cached layers are trimmed and read-only, recolouring always works on a copy
+        if self.layer_cache is not None:
+            return LazyLayer(path, self.layer_cache, functools.partial(self.decode_layer, bbox=bbox))
+        return self.decode_layer(path, bbox)
+
+    def decode_layer(self, path, bbox = None):
+        # bbox: the (top, left, bottom, right) box of the visible pixels (from the manifest), which saves the scan
+        if bbox is None:
+            return (PaletteLayer if self.compact else Layer).trim(np.array(Image.open(path)))
+        top, left, bottom, right = bbox
+        pixels = np.ascontiguousarray(np.asarray(Image.open(path))[top:bottom, left:right])
+        pixels.flags.writeable = False
+        layer = Layer(pixels, top, left)
+        return PaletteLayer.from_layer(layer) if self.compact else layer
+
+    #------------------------------#
+    # Asset manifest               #
+    #------------------------------#
+    # the size of every layer (PIL's (width, height), a manifest can set another one), the body
+    # parts and the names of a manifest
+    canvas_size = (745, 811)
+    body_part_names = ('body', 'head', 'chin', 'feet', 'hands_bg', 'hands_fg', 'hands_item_bg', 'hands_item_fg',
+                       'underware', 'arms')
+    manifest_names = ('assets.json', 'assets.toml')
+
+    def find_manifest(self, manifest_path = None):
+        if manifest_path is False:
+            return None
+        if manifest_path is None:
+            for name in self.manifest_names:
+                if os.path.exists(os.path.join(self.images_path, name)):
+                    manifest_path = os.path.join(self.images_path, name)
+                    break
+            else:
+                return None
+        return self.load_manifest(manifest_path)
+
+    @classmethod
+    def load_manifest(cls, path):
+        # read a json or toml manifest (toml needs python 3.11 or the tomli package)
+        if path.endswith('.toml'):
+            try:
+                import tomllib
+            except ImportError:
+                import tomli as tomllib
+            with open(path, 'rb') as f:
+                manifest = tomllib.load(f)
+        else:
+            with open(path) as f:
+                manifest = json.load(f)
+        if manifest.get('version') != 1:
+            raise ValueError(f'{path}: unknown manifest version {manifest.get("version")}')
+        # the stages are the ones of layer_stages, in any order
+        stages = [tuple(stage) for stage in manifest.get('stages', cls.layer_stages)]
+        if len(stages) != len(cls.layer_stages) or set(stages) != set(cls.layer_stages):
+            raise ValueError(f'{path}: the stages must be an order of {[list(stage) for stage in cls.layer_stages]}')
+        entries = list(manifest['body'].values()) + [layer for category in manifest['categories'].values()
+                                                     for item in category['items'] for layer in item['layers']]
+        for entry in entries:
+            tint = entry.get('tint')
+            if tint is not None and (tint.get('rule') not in cls.tint_rules or tint.get('colour') not in cls.colour_fields):
+                raise ValueError(f'{path}: {entry["file"]} has an unknown tint {tint}')
+        return manifest
+
+    def item_proba(self, obj, items):
+        # the chance of every item of an image folder: the weights of the manifest, or an equal chance for everyone
+        if self.manifest is None or not items:
+            return np.ones(len(items))/len(items)
+        weights = np.array([item.get('weight', 1.0) for item in self.manifest['categories'][obj]['items']], dtype=np.float64)
+        return weights / weights.sum()
+
+    def preload(self, categories = None):
+        # decode the layers of some image folders ('body', 'eyes', 'hair' ... all of them by default)
+        # so that the first avatars don't pay for it, returns the number of layers
+        if categories is None:
+            categories = ['body'] + list(self.pack_categories)
+        layers = []
+        for category in categories:
+            if category == 'body':
+                layers += self.body_parts.values()
+            else:
+                for item in getattr(self, self.pack_categories[category]):
+                    for role in item.values():
+                        layers += role
+        for layer in layers:
+            layer.resolve()
+        return len(layers)
       
     def generate(self, skin_colour = None, 
                        hair_colour = None, 
@@ -183,43 +1258,58 @@ class SouthParkAvatarGenerator:
                        has_hat = None, hat = None,
                        has_jewellery = None, jewellery = None,
                        has_item = None, item = None,
-                       has_pin = None, pin = None):
+                       has_pin = None, pin = None,
+                       seed = None, genome = None, return_genome = False, format = None,
+                       size = None, box = None):
         
         #--------------------------------------#
         # Combina all the images into 1 avatar #
         #--------------------------------------#
         
-        # generate the attributes
-        self.set_skin_colour(skin_colour)
-        self.set_hair_colour(hair_colour)
-        #self.set_beard_colour(beard_colour)
-        self.set_shirt_colour(shirt_colour)
-        self.set_eyes(eyes)
-        self.set_mouth(mouth)
-        self.set_trouser(trouser)
-        self.set_shirt(shirt)
-        self.set_has_hair(has_hair) 
-        self.set_hair(hair)
-        self.set_has_glasses(has_glasses)
-        self.set_glasses(glasses)
-        self.set_has_beard(has_beard) 
-        self.set_beard(beard)
-        # self.set_has_hat(has_hat)
-        # self.set_hat(hat)
-        # self.set_has_jewellery(has_jewellery)
-        # self.set_jewellery(jewellery)
-        # self.set_has_item(has_item)
-        # self.set_item(item)
-        # self.set_has_pin(has_pin) 
-        # self.set_pin(pin)
+        # generate the attributes, or take them from the genome
+        clock, on_stage = self.clock, self.on_stage
+        start = clock()
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        if genome is None:
+            genome = self.sample_genome(skin_colour, hair_colour, shirt_colour, eyes, mouth, shirt, trouser,
+                                        has_hair, hair, has_glasses, glasses, has_beard, beard)
+        else:
+            genome = self.apply_genome(genome)
+        if on_stage is not None:
+            on_stage('select', clock() - start)
+
+        # the rendered avatar, from the cache when it has seen this genome (at this size) before
+        key = genome if size is None else (genome, self.target_size(size), box or self.crop_box)
+        cached = self.cache.get(key) if self.cache is not None else None
+        avatar = None
+        if cached is None:
+            if size is None:
+                avatar = self.paint(genome)
+            else:
+                t = clock()
+                avatar = Image.fromarray(self.render_scaled(genome, size, box))
+                if on_stage is not None:
+                    on_stage('scaled', clock() - t)
+            if self.cache is not None:
+                cached = self.cache.put(key, avatar)
 
+        self.genome = genome
+        t = clock()
+        avatar = self.avatar_as(format, avatar, cached)
+        if on_stage is not None:
+            on_stage('encode', clock() - t)
+            on_stage('generate', clock() - start)
+        if return_genome:
+            return avatar, genome
+        return avatar
+
+    def paint(self, genome):
+        # paint the avatar of the current attributes (see sample_genome / apply_genome)
         #-------------------#
         # generate the body #
         #-------------------#
         
-        avatar = Image.fromarray(np.zeros((811, 745, 4)), 'RGBA') 
-                
-        
 
         # add underware
         #underware = Image.fromarray(self.body_parts['underware'], 'RGBA')
@@ -235,146 +1325,61 @@ class SouthParkAvatarGenerator:
         #avatar.paste(shirt, (0, 0), shirt)
         
         
-        # add background hair
-        if self.has_hair:
-            hair = self.get_hair()
-            for e, bg_hair in enumerate(hair.get('bg', [])):
-                if e == 0:
-                    bg_hair[:,:,0][bg_hair[:,:,0] == 255] = self.hair_colour[0]
-                    bg_hair[:,:,1][bg_hair[:,:,1] == 255] = self.hair_colour[1]
-                    bg_hair[:,:,2][bg_hair[:,:,2] == 255] = self.hair_colour[2]
-                bg_hair = Image.fromarray(bg_hair, 'RGBA') 
-                avatar.paste(bg_hair, (0, 0), bg_hair)
-
-        # grep the body
-        body = self.body_parts['body']
-        body[:,:,0][body[:,:,0] > 0] = self.skin_colour[0]
-        body[:,:,1][body[:,:,1] > 0] = self.skin_colour[1]
-        body[:,:,2][body[:,:,2] > 0] = self.skin_colour[2]
-        avatar = Image.fromarray(body, 'RGBA') 
-    
-        # add arms
-        arms = Image.fromarray(self.body_parts['arms'], 'RGBA')
-        avatar.paste(arms, (0, 0), arms)
-    
-        # add the trousers
-        trouser = self.get_trouser()
-        trouser_col = np.random.randint(-50,50, size=1)[0]
-        
-        for e, bg_trouser in enumerate(trouser.get('bg', [])):
-            
-            bg_trouser[:,:,0][bg_trouser[:,:,0] == 255] = max(min(self.shirt_colour[0] + trouser_col, 250),10)
-            bg_trouser[:,:,1][bg_trouser[:,:,1] == 255] = max(min(self.shirt_colour[1] + trouser_col, 250),10)
-            bg_trouser[:,:,2][bg_trouser[:,:,2] == 255] = max(min(self.shirt_colour[2] + trouser_col, 250),10)
-            bg_trouser = Image.fromarray(bg_trouser, 'RGBA') 
-            avatar.paste(bg_trouser, (0, 0), bg_trouser)
-            
-        for e, fg_trouser in enumerate(trouser.get('fg', [])):
-            fg_trouser = Image.fromarray(fg_trouser, 'RGBA') 
-            avatar.paste(fg_trouser, (0, 0), fg_trouser)
-            
-            
-        # add the t-shirt
-        shirt = self.get_shirt()
-        for e, bg_shirt in enumerate(shirt.get('bg', [])):
-            
-            bg_shirt[:,:,0][bg_shirt[:,:,0] == 255] = self.shirt_colour[0]
-            bg_shirt[:,:,1][bg_shirt[:,:,1] == 255] = self.shirt_colour[1]
-            bg_shirt[:,:,2][bg_shirt[:,:,2] == 255] = self.shirt_colour[2]
-            bg_shirt = Image.fromarray(bg_shirt, 'RGBA') 
-            avatar.paste(bg_shirt, (0, 0), bg_shirt)
-            
-        for e, fg_shirt in enumerate(shirt.get('fg', [])):
-            fg_shirt = Image.fromarray(fg_shirt, 'RGBA') 
-            avatar.paste(fg_shirt, (0, 0), fg_shirt)
+        # the tint colours, the trousers and the beard get a bit of jitter
+        trouser_col = genome.trouser_jitter
+        beard_col = genome.beard_jitter
+        colours = {'skin': self.skin_colour,
+                   'hair': self.hair_colour,
+                   'shirt': self.shirt_colour,
+                   'trouser': [max(min(c + trouser_col, 250), 10) for c in self.shirt_colour],
+                   'beard': [np.min([c + beard_col, 254]) for c in self.hair_colour]}
 
+        # the chosen item of every stage (-1 when the avatar doesn't have it)
+        indices = {'hair': self.hair_index if self.has_hair else -1,
+                   'trouser': self.trouser_index,
+                   'shirt': self.shirt_index,
+                   'beard': self.beard_index if self.has_beard else -1,
+                   'hands': 1 if self.has_item else None,
+                   'eyes': self.eye_index,
+                   'mouth': self.mouth_index,
+                   'glasses': self.glass_index if self.has_glasses else -1}
 
-        # add the head
-        head = self.body_parts['head']
-        head[:,:,0][head[:,:,0] > 0]  = self.skin_colour[0]
-        head[:,:,1][head[:,:,1] > 0] = self.skin_colour[1]
-        head[:,:,2][head[:,:,2] > 0] = self.skin_colour[2]
-        head = Image.fromarray(head, 'RGBA') 
-        avatar.paste(head, (0, 0), head)
+        # paint the layers: bg hair, body, arms, trousers, shirt, head, chin,
+        # beard, feet, hands, eyes, mouth, glasses and fg hair
+        stages = []
+        for stage, attribute in self.layer_stages:
+            index = indices.get(attribute or stage)
+            if index is not None and index < 0:
+                continue
+            stages.append((stage, [layer for layer in self.stage_layers(stage, index) if not layer[1].empty]))
 
-        
-
-        
-        # add chin
-        chin = Image.fromarray(self.body_parts['chin'], 'RGBA')
-        avatar.paste(chin, (0, 0), chin)
-        
-        
-                
-        # add beard
-        if self.has_beard:
-            beard = self.get_beard()
-            beard_col = np.random.randint(0,50, size=1)[0]
-            for e, beard_fg in enumerate(beard.get('fg', [])):
-                if e == 0:
-                    beard_fg[:,:,0][beard_fg[:,:,0] == 255] = np.min([self.hair_colour[0] + beard_col,  254])
-                    beard_fg[:,:,1][beard_fg[:,:,1] == 255] = np.min([self.hair_colour[1] + beard_col,  254])
-                    beard_fg[:,:,2][beard_fg[:,:,2] == 255] = np.min([self.hair_colour[2] + beard_col,  254])
-                beard_fg = Image.fromarray(beard_fg, 'RGBA') 
-                avatar.paste(beard_fg, (0, 0), beard_fg)
-                
-                
-        # add feet
-        feet = Image.fromarray(self.body_parts['feet'], 'RGBA')
-        avatar.paste(feet, (0, 0), feet)
-        
-        # add hands
-        if self.has_item:
-            # background
-            hands_bg = self.body_parts['hands_item_bg']
-            hands_bg[:,:,0][hands_bg[:,:,0] == 255]  = self.skin_colour[0]
-            hands_bg[:,:,1][hands_bg[:,:,1] == 255] = self.skin_colour[1]
-            hands_bg[:,:,2][hands_bg[:,:,2] == 255] = self.skin_colour[2]
-            hands_bg = Image.fromarray(hands_bg, 'RGBA') 
-            avatar.paste(hands_bg, (0, 0), hands_bg)
-            
-            # foreground
-            hands_fg = Image.fromarray(self.body_parts['hands_item_fg'], 'RGBA')
-            avatar.paste(hands_fg, (0, 0), hands_fg)
+        clock, on_stage = self.clock, self.on_stage
+        if self.compositor == 'premultiplied':
+            start = clock()
+            avatar = Image.fromarray(self.composite_over([l for stage, layers in stages for l in layers], colours), 'RGBA')
+            if on_stage is not None:
+                on_stage('composite', clock() - start)
         else:
-            # background
-            hands_bg = self.body_parts['hands_bg']
-            hands_bg[:,:,0][hands_bg[:,:,0] > 0]  = self.skin_colour[0]
-            hands_bg[:,:,1][hands_bg[:,:,1] > 0] = self.skin_colour[1]
-            hands_bg[:,:,2][hands_bg[:,:,2] > 0] = self.skin_colour[2]
-            hands_bg = Image.fromarray(hands_bg, 'RGBA') 
-            avatar.paste(hands_bg, (0, 0), hands_bg)
-            
-            # foreground
-            hands_fg = Image.fromarray(self.body_parts['hands_fg'], 'RGBA')
-            avatar.paste(hands_fg, (0, 0), hands_fg)
-            
-        # add eyes
-        eyes = Image.fromarray(self.get_eyes().get('fg')[0], 'RGBA')
-        avatar.paste(eyes, (0, 0), eyes)
-
-        
-        # add mouth
-        mouth = Image.fromarray(self.get_mouth().get('fg')[0], 'RGBA')
-        avatar.paste(mouth, (0, 0), mouth)
-
-        if self.has_glasses:
-            glasses = Image.fromarray(self.get_glasses().get('fg')[0], 'RGBA')
-            avatar.paste(glasses, (0, 0), glasses)
-        
-        
-        # foreground hair
-        if self.has_hair: 
-            for e, fg_hair in enumerate(hair.get('fg',[])):
-                if e == 0:
-                    fg_hair[:,:,0][fg_hair[:,:,0] == 255] = self.hair_colour[0]
-                    fg_hair[:,:,1][fg_hair[:,:,1] == 255] = self.hair_colour[1]
-                    fg_hair[:,:,2][fg_hair[:,:,2] == 255] = self.hair_colour[2]
-                fg_hair = Image.fromarray(fg_hair, 'RGBA') 
-                avatar.paste(fg_hair, (0, 0), fg_hair)
-            
+            avatar = Image.fromarray(np.zeros(self.canvas_shape, dtype=np.uint8), 'RGBA')
+            recolor = convert = paste = 0
+            for stage, layers in stages:
+                start = clock()
+                for key, layer, rule, colour in layers:
+                    t0 = clock()
+                    pixels = self.recolor(key, layer, colours[colour]) if rule is not None else layer.pixels
+                    t1 = clock()
+                    pixels = Image.fromarray(pixels, 'RGBA')
+                    t2 = clock()
+                    avatar.paste(pixels, (layer.left, layer.top), pixels)
+                    t3 = clock()
+                    recolor, convert, paste = recolor + t1 - t0, convert + t2 - t1, paste + t3 - t2
+                if on_stage is not None:
+                    on_stage(f'paint.{stage}', clock() - start)
+            if on_stage is not None:
+                on_stage('recolor', recolor)
+                on_stage('convert', convert)
+                on_stage('paste', paste)
 
- 
         if self.has_hat:
             hat = Image.fromarray(self.get_hat()[0], 'RGBA')
             avatar.paste(hat, (0, 0), hat)
@@ -395,6 +1400,1148 @@ class SouthParkAvatarGenerator:
         #avatar = avatar.crop((70,80,582,592))
         return avatar
 
+    def avatar_as(self, format, avatar = None, cached = None):
+        # the avatar as a PIL image (format None), a read-only RGBA array ('array') or png bytes ('png'),
+        # either from the painted image or from the cached version of it
+        if format == 'png':
+            if isinstance(cached, bytes):
+                return cached
+            buffer = io.BytesIO()
+            (avatar if avatar is not None else Image.fromarray(cached)).save(buffer, 'PNG')
+            return buffer.getvalue()
+        if avatar is None:
+            avatar = Image.open(io.BytesIO(cached)) if isinstance(cached, bytes) else Image.fromarray(cached)
+            avatar.load()
+        if format == 'array':
+            if isinstance(cached, np.ndarray):
+                return cached
+            array = np.asarray(avatar)
+            array.flags.writeable = False
+            return array
+        return avatar
+
+    #------------------------------#
+    # Encoding                     #
+    #------------------------------#
+    # the presets of encode(): (format, level, quantize), from the fastest to the smallest
+    encode_presets = {'raw': ('raw', None, False),
+                      'fast': ('png', 1, True),
+                      'balanced': ('png', 6, True),
+                      'small': ('png', 9, True),
+                      'webp-fast': ('webp', 0, False),
+                      'webp': ('webp', 4, False),
+                      'webp-small': ('webp', 6, False)}
+
+    def flat_colours(self):
+        # the flat colours (RGBA as uint32) of the art: transparent, the black and white lines and the colour tables
+        colours = [(0, 0, 0, 0), (0, 0, 0, 255), (255, 255, 255, 255)]
+        colours += [tuple(c) + (255,) for c in self.skin_colours + self.hair_colours + self.shirt_colours]
+        return np.unique(np.array(colours, dtype=np.uint8).view(np.uint32)[:, 0])
+
+    def encode(self, avatar, format = 'png', level = None, quantize = True, preset = None):
+        # the bytes of an avatar (a PIL image or an (811, 745, 4) array), lossless in every format:
+        # - 'png': level is the zlib level (6). With quantize, an avatar of at most 256 colours (the
+        #   flat art usually is) becomes a palette png, its colours of the colour tables first and the
+        #   others by frequency, with the alpha of every entry in tRNS; more colours stay RGBA
+        # - 'webp': lossless WebP, level is the effort (method 0 - 6, 4)
+        # - 'raw': the RGBA bytes
+        # a preset (see encode_presets) sets format, level and quantize
+        if preset is not None:
+            format, level, quantize = self.encode_presets[preset]
+        start = self.clock()
+        image = avatar if isinstance(avatar, Image.Image) else Image.fromarray(np.ascontiguousarray(avatar))
+        buffer = io.BytesIO()
+        if format == 'raw':
+            data = image.tobytes()
+        elif format == 'webp':
+            image.save(buffer, 'WEBP', lossless=True, exact=True, method=4 if level is None else level)
+            data = buffer.getvalue()
+        elif format == 'png':
+            level = 6 if level is None else level
+            colours = image.getcolors(256) if quantize else None
+            if colours is None:
+                image.save(buffer, 'PNG', compress_level=level)
+            else:
+                counts = np.array([count for count, colour in colours])
+                values = np.array([colour for count, colour in colours], dtype=np.uint8).view(np.uint32)[:, 0]
+                palette = values[np.lexsort((-counts, ~np.isin(values, self.flat_colours())))]
+                sorter = np.argsort(palette)
+                pixels = np.asarray(image).view(np.uint32)[:, :, 0]
+                index = sorter[np.searchsorted(palette, pixels, sorter=sorter)].astype(np.uint8)
+                entries = palette.view(np.uint8).reshape(-1, 4)
+                indexed = Image.frombytes('P', image.size, index.tobytes())
+                indexed.putpalette(entries[:, :3].tobytes())
+                indexed.save(buffer, 'PNG', compress_level=level, transparency=entries[:, 3].tobytes())
+            data = buffer.getvalue()
+        else:
+            raise ValueError(f'unknown encoding: {format}')
+        if self.on_stage is not None:
+            self.on_stage(f'encode.{format}', self.clock() - start)
+        return data
+
+    #------------------------------#
+    # Genome                       #
+    #------------------------------#
+    # a genome packs into an integer of (at most) 16 bytes: 10 bits per field
+    genome_bits = 10
+
+    def sample_genome(self, skin_colour = None,
+                            hair_colour = None,
+                            shirt_colour = None,
+                            eyes = None,
+                            mouth = None,
+                            shirt = None,
+                            trouser = None,
+                            has_hair = None, hair = None,
+                            has_glasses = None, glasses = None,
+                            has_beard = None, beard = None):
+        # set (or draw) every attribute of an avatar and return them as a genome
+        # (-1 for an optional item: the avatar doesn't have it, and gets no beard jitter)
+        has_hair, has_glasses, has_beard = self.without_items(has_hair, hair, has_glasses, glasses, has_beard, beard)
+        if self.sampler is not None:
+            attributes = self.sample_batch(1, skin_colour, hair_colour, shirt_colour, eyes, mouth, shirt, trouser,
+                                           has_hair, hair, has_glasses, glasses, has_beard, beard)
+            return self.apply_genome(Genome(*[int(attributes[field][0]) for field in Genome._fields]))
+        self.set_skin_colour(skin_colour)
+        self.set_hair_colour(hair_colour)
+        #self.set_beard_colour(beard_colour)
+        self.set_shirt_colour(shirt_colour)
+        self.set_eyes(eyes)
+        self.set_mouth(mouth)
+        self.set_trouser(trouser)
+        self.set_shirt(shirt)
+        self.set_has_hair(has_hair) 
+        self.set_hair(hair)
+        self.set_has_glasses(has_glasses)
+        self.set_glasses(glasses)
+        self.set_has_beard(has_beard) 
+        self.set_beard(beard)
+        # self.set_has_hat(has_hat)
+        # self.set_hat(hat)
+        # self.set_has_jewellery(has_jewellery)
+        # self.set_jewellery(jewellery)
+        # self.set_has_item(has_item)
+        # self.set_item(item)
+        # self.set_has_pin(has_pin) 
+        # self.set_pin(pin)
+
+        return Genome(skin_colour=self.skin_colour_index,
+                      hair_colour=self.hair_colour_index,
+                      shirt_colour=self.shirt_colour_index,
+                      eyes=self.eye_index,
+                      mouth=self.mouth_index,
+                      shirt=self.shirt_index,
+                      trouser=self.trouser_index,
+                      hair=self.hair_index if self.has_hair else -1,
+                      glasses=self.glass_index if self.has_glasses else -1,
+                      beard=self.beard_index if self.has_beard else -1,
+                      trouser_jitter=int(self.rng.integers(-50, 50)),
+                      beard_jitter=int(self.rng.integers(0, 50)) if self.has_beard else 0)
+
+    def seeded_genome(self, seed, **attributes):
+        # the genome of generate(seed=seed), drawn from a random generator of its own:
+        # the generator's rng is left as it was
+        rng, self.rng = self.rng, np.random.default_rng(seed)
+        try:
+            return self.sample_genome(**attributes)
+        finally:
+            self.rng = rng
+
+    @staticmethod
+    def without_items(has_hair, hair, has_glasses, glasses, has_beard, beard):
+        # the has_ flags of the optional items, an item given as -1 means without it
+        return tuple(0 if index is not None and index == -1 else has
+                     for has, index in ((has_hair, hair), (has_glasses, glasses), (has_beard, beard)))
+
+    def apply_genome(self, genome):
+        # set the attributes of a genome (a tuple or a packed genome)
+        genome = self.as_genome(genome)
+
+        self.set_skin_colour(genome.skin_colour)
+        self.set_hair_colour(genome.hair_colour)
+        self.set_shirt_colour(genome.shirt_colour)
+        self.set_eyes(genome.eyes)
+        self.set_mouth(genome.mouth)
+        self.set_trouser(genome.trouser)
+        self.set_shirt(genome.shirt)
+        self.set_has_hair(int(genome.hair >= 0))
+        self.set_hair(genome.hair)
+        self.set_has_glasses(int(genome.glasses >= 0))
+        self.set_glasses(genome.glasses)
+        self.set_has_beard(int(genome.beard >= 0))
+        self.set_beard(genome.beard)
+        return genome
+
+    def get_genome(self):
+        return self.genome
+
+    # the range of the jitters, as sample_genome draws them
+    jitter_ranges = {'trouser_jitter': (-50, 50), 'beard_jitter': (0, 50)}
+
+    def as_genome(self, spec):
+        # the Genome of a spec (a Genome, a tuple of its values or a packed genome), checked
+        # against the items of this generator: a ValueError for a value out of range
+        genome = self.unpack_genome(spec) if isinstance(spec, (int, np.integer, bytes)) else Genome(*[int(v) for v in spec])
+        for field, value in zip(Genome._fields, genome):
+            if field in self.jitter_ranges:
+                low, high = self.jitter_ranges[field]
+            else:
+                low = -1 if field in ('hair', 'glasses', 'beard') else 0
+                high = len(getattr(self, field + 's' if field.endswith('_colour') else self.stage_collections[field]))
+            if not low <= value < high:
+                raise ValueError(f'{field} = {value} is out of range [{low}, {high})')
+        return genome
+
+    @classmethod
+    def genome_offsets(cls):
+        # the values are stored unsigned: optional items are shifted by one, the trouser jitter by 50
+        return [1 if field in ('hair', 'glasses', 'beard') else 50 if field == 'trouser_jitter' else 0
+                for field in Genome._fields]
+
+    @classmethod
+    def pack_genome(cls, genome):
+        # pack a genome into one integer (use .to_bytes(16, 'little') for a 16 byte key)
+        key = 0
+        for i, (value, offset) in enumerate(zip(genome, cls.genome_offsets())):
+            value = int(value) + offset
+            if not 0 <= value < 2 ** cls.genome_bits:
+                raise ValueError(f'{Genome._fields[i]} = {value - offset} does not fit in a packed genome')
+            key |= value << (i * cls.genome_bits)
+        return key
+
+    @classmethod
+    def unpack_genome(cls, key):
+        # the Genome of a packed genome (see as_genome to check it against the items of a generator)
+        if isinstance(key, bytes):
+            key = int.from_bytes(key, 'little')
+        key = int(key)
+        if not 0 <= key < 2 ** (cls.genome_bits * len(Genome._fields)):
+            raise ValueError(f'{key} is not a packed genome')
+        mask = 2 ** cls.genome_bits - 1
+        return Genome(*[((key >> (i * cls.genome_bits)) & mask) - offset for i, offset in enumerate(cls.genome_offsets())])
+
+    #------------------------------#
+    # Layer stack                  #
+    #------------------------------#
+    # the paint order of an avatar, together with the attribute that selects
+    # the layer(s) of each stage (None: the stage is the same for everyone)
+    layer_stages = (('hair_bg', 'hair'), ('body', None), ('arms', None), ('trouser', 'trouser'),
+                    ('shirt', 'shirt'), ('head', None), ('chin', None), ('beard', 'beard'),
+                    ('feet', None), ('hands', None), ('eyes', 'eyes'), ('mouth', 'mouth'),
+                    ('glasses', 'glasses'), ('hair_fg', 'hair'))
+
+    # the attribute of a stage and the items it chooses from
+    stage_collections = {'hair': 'hairs', 'trouser': 'trousers', 'shirt': 'shirts', 'beard': 'beards',
+                         'eyes': 'eyes', 'mouth': 'mouths', 'glasses': 'glasses'}
+
+    def sample_batch(self, n, skin_colour = None,
+                              hair_colour = None,
+                              shirt_colour = None,
+                              eyes = None,
+                              mouth = None,
+                              shirt = None,
+                              trouser = None,
+                              has_hair = None, hair = None,
+                              has_glasses = None, glasses = None,
+                              has_beard = None, beard = None):
+        # draw the attributes of n avatars at once,
+        # an optional item (hair, glasses, beard) is -1 when the avatar doesn't have it
+        has_hair, has_glasses, has_beard = self.without_items(has_hair, hair, has_glasses, glasses, has_beard, beard)
+
+        def valid(index, proba):
+            return isinstance(index, (int, np.integer)) and 0 <= index < len(proba)
+
+        def draw(index, proba):
+            if valid(index, proba):
+                return np.full(n, int(index), dtype=np.int64)
+            return self.rng.choice(len(proba), n, p=proba)
+
+        if self.sampler is not None:
+            # (with the sampler, an item index implies that the avatar has the item)
+            fixed, present = {}, []
+            for name, index, proba in (('skin_colour', skin_colour, self.skin_colours_proba),
+                                       ('hair_colour', hair_colour, self.hair_colours_proba),
+                                       ('shirt_colour', shirt_colour, self.shirt_colours_proba),
+                                       ('eyes', eyes, self.eyes_proba), ('mouth', mouth, self.mouths_proba),
+                                       ('shirt', shirt, self.shirts_proba), ('trouser', trouser, self.trousers_proba)):
+                if valid(index, proba):
+                    fixed[name] = index
+            for name, has, index, proba in (('hair', has_hair, hair, self.hairs_proba),
+                                            ('glasses', has_glasses, glasses, self.glasses_proba),
+                                            ('beard', has_beard, beard, self.beards_proba)):
+                if valid(has, [0, 1]) and not has:
+                    fixed[name] = -1
+                elif valid(index, proba):
+                    fixed[name] = index
+                elif valid(has, [0, 1]):
+                    present.append(name)
+            return self.sampler.sample(self.rng, n, fixed, present)
+
+        attributes = {'skin_colour': draw(skin_colour, self.skin_colours_proba),
+                      'hair_colour': draw(hair_colour, self.hair_colours_proba),
+                      'shirt_colour': draw(shirt_colour, self.shirt_colours_proba),
+                      'eyes': draw(eyes, self.eyes_proba),
+                      'mouth': draw(mouth, self.mouths_proba),
+                      'trouser': draw(trouser, self.trousers_proba),
+                      'shirt': draw(shirt, self.shirts_proba)}
+
+        for name, has, index, has_proba, proba in (('hair', has_hair, hair, self.has_hairs_proba, self.hairs_proba),
+                                                   ('glasses', has_glasses, glasses, self.has_glasses_proba, self.glasses_proba),
+                                                   ('beard', has_beard, beard, self.has_beards_proba, self.beards_proba)):
+            present = draw(has, has_proba).astype(bool)
+            attributes[name] = np.where(present, draw(index, proba), -1)
+
+        # the tint jitter of the trousers and the beard
+        attributes['trouser_jitter'] = self.rng.integers(-50, 50, size=n)
+        attributes['beard_jitter'] = np.where(attributes['beard'] >= 0, self.rng.integers(0, 50, size=n), 0)
+        return attributes
+
+    def batch_colours(self, attributes, colour_jitter = None):
+        # the tint colours of every avatar, as (n, 3) arrays (moved by a ColourJitter, drawn from the rng)
+        skin = np.array(self.skin_colours)[attributes['skin_colour']]
+        hair = np.array(self.hair_colours)[attributes['hair_colour']]
+        shirt = np.array(self.shirt_colours)[attributes['shirt_colour']]
+        if colour_jitter is not None:
+            jittered = colour_jitter(self.rng, {'skin': skin, 'hair': hair, 'shirt': shirt})
+            skin, hair, shirt = jittered['skin'], jittered['hair'], jittered['shirt']
+        return {'skin': skin,
+                'hair': hair,
+                'shirt': shirt,
+                'trouser': np.clip(shirt + attributes['trouser_jitter'][:, None], 10, 250),
+                'beard': np.minimum(hair + attributes['beard_jitter'][:, None], 254)}
+
+    def stage_layers(self, stage, index = None):
+        # the layers of a stage as (key, layer, tint rule, tint colour) in paint order,
+        # 'eq255' tints the channels which are 255, 'gt0' the channels which are > 0 (see layer_tint)
+        body, tint = self.body_parts, self.layer_tint
+        if stage in ('hair_bg', 'hair_fg'):
+            role = stage[5:]
+            return [((stage, index, e), l, *tint('hair', index, role, e)) for e, l in enumerate(self.hairs[index].get(role, []))]
+        if stage == 'beard':
+            return [((stage, index, e), l, *tint('beards', index, 'fg', e)) for e, l in enumerate(self.beards[index].get('fg', []))]
+        if stage in ('trouser', 'shirt'):
+            category = 'trousers' if stage == 'trouser' else 'shirt'
+            item = self.trousers[index] if stage == 'trouser' else self.shirts[index]
+            return [((stage, index, role, e), l, *tint(category, index, role, e))
+                    for role in ('bg', 'fg') for e, l in enumerate(item.get(role, []))]
+        if stage in ('eyes', 'mouth', 'glasses'):
+            items = {'eyes': self.eyes, 'mouth': self.mouths, 'glasses': self.glasses}[stage]
+            return [((stage, index), items[index].get('fg')[0], *tint(stage, index, 'fg', 0))]
+        if stage == 'hands':
+            # the hands which hold an item, or the open hands
+            parts = ('hands_item_bg', 'hands_item_fg') if index else ('hands_bg', 'hands_fg')
+            return [((part,), body[part], *tint('body', None, part, 0)) for part in parts]
+        return [((stage,), body[stage], *tint('body', None, stage, 0))]
+
+    # the tint rules, the genome fields which each tint colour depends on and the tinted body parts
+    tint_rules = ('eq255', 'gt0')
+    colour_fields = {'skin': ('skin_colour',), 'hair': ('hair_colour',), 'beard': ('hair_colour', 'beard_jitter'),
+                     'shirt': ('shirt_colour',), 'trouser': ('shirt_colour', 'trouser_jitter')}
+    body_tints = {'body': ('gt0', 'skin'), 'head': ('gt0', 'skin'), 'hands_bg': ('gt0', 'skin'), 'hands_item_bg': ('eq255', 'skin')}
+
+    @classmethod
+    def default_tint(cls, category, role, position):
+        # the (rule, colour) of a layer by its image folder ('body' for the body parts, whose role
+        # is the part), role and position: the first layer of the hair and the beards, the
+        # backgrounds of the shirts and trousers and the skin of the body, head and hands
+        if category in ('hair', 'beards'):
+            return ('eq255', 'hair' if category == 'hair' else 'beard') if position == 0 else (None, None)
+        if category in ('shirt', 'trousers'):
+            return ('eq255', 'shirt' if category == 'shirt' else 'trouser') if role == 'bg' else (None, None)
+        if category == 'body':
+            return cls.body_tints.get(role, (None, None))
+        return (None, None)
+
+    def layer_tint(self, category, index, role, position):
+        # the (rule, colour) of a layer: the tint of the manifest, else default_tint
+        tint = self.tints.get((category, index, role, position))
+        return tint if tint is not None else self.default_tint(category, role, position)
+
+    @classmethod
+    def manifest_tints(cls, manifest):
+        # the (rule, colour) of every layer which has a tint entry in a manifest ((None, None) for
+        # an untinted layer), by (category, item index, role, position in its role)
+        tints = {}
+        for part, entry in manifest.get('body', {}).items():
+            if 'tint' in entry:
+                tints['body', None, part, 0] = cls.tint_of(entry)
+        for category, entry in manifest.get('categories', {}).items():
+            for index, item in enumerate(entry['items']):
+                positions = {}
+                for layer in item['layers']:
+                    position = positions[layer['role']] = positions.get(layer['role'], -1) + 1
+                    if 'tint' in layer:
+                        tints[category, index, layer['role'], position] = cls.tint_of(layer)
+        return tints
+
+    @staticmethod
+    def tint_of(entry):
+        tint = entry['tint']
+        return (None, None) if tint is None else (tint['rule'], tint['colour'])
+
+    def build_stage_fields(self):
+        # the genome fields which the layers of every stage depend on: the attribute of the
+        # stage (its item) and the fields of the tint colours of its layers (see stage_key)
+        order = list(self.colour_fields)
+        stage_fields = {}
+        for stage, attribute in self.layer_stages:
+            if attribute is None:
+                indices = [None, 1] if stage == 'hands' else [None]
+            else:
+                indices = range(len(getattr(self, self.stage_collections[attribute])))
+            colours = {colour for index in indices for key, layer, rule, colour in self.stage_layers(stage, index)
+                       if rule is not None}
+            fields = [attribute] if attribute is not None else []
+            for colour in sorted(colours, key=order.index):
+                fields += [field for field in self.colour_fields[colour] if field not in fields]
+            stage_fields[stage] = (attribute, tuple(fields))
+        return stage_fields
+
+    #------------------------------#
+    # Recolouring                  #
+    #------------------------------#
+    @staticmethod
+    def tint_mask(layer, rule):
+        # the TintMask, within the trimmed layer, of the channels which get the tint colour,
+        # 'eq255' selects the channels which are 255, 'gt0' the ones which are > 0 (transparent
+        # pixels are left out, they don't show up anyway). Most tinted pixels have all three
+        # channels tinted, so they are kept as one index per pixel
+        pixels = layer.pixels
+        selected = (pixels[:, :, :3] == 255) if rule == 'eq255' else (pixels[:, :, :3] > 0)
+        selected &= (pixels[:, :, 3:] > 0)
+        full = selected.all(axis=2)
+        y, x, c = np.nonzero(selected & ~full[:, :, None])
+        return TintMask(np.flatnonzero(full).astype(np.uint32), ((y * pixels.shape[1] + x) * 4 + c).astype(np.uint32))
+
+    @staticmethod
+    def tint_flat(mask):
+        # the flat (pixel * 4 + channel) indices of every tinted channel of a TintMask
+        full = (mask.pixels.astype(np.int64)[:, None] * 4 + np.arange(3)).reshape(-1)
+        return np.concatenate([full, mask.channels.astype(np.int64)])
+
+    @staticmethod
+    def palette_tint(layer, rule):
+        # the tint mask of a palette layer: the (palette entry, channel) pairs which get the tint colour
+        palette = layer.palette
+        selected = (palette[:, :3] == 255) if rule == 'eq255' else (palette[:, :3] > 0)
+        selected &= (palette[:, 3:] > 0)
+        return np.nonzero(selected)
+
+    def build_tint_masks(self):
+        # compute the tint mask of every tintable layer once, so that rendering never has to scan.
+        # Palette layers get a mask of their palette, their flat masks are only made on demand
+        if self.derived_cache is not None:
+            masks = TintMasks(self.tint_mask, self.derived_cache)
+        else:
+            masks = TintMasks(self.tint_mask) if self.compact else {}
+        self.palette_tints = {}
+        for stage, attribute in self.layer_stages:
+            if attribute is None:
+                indices = [None, 1] if stage == 'hands' else [None]
+            else:
+                indices = range(len(getattr(self, self.stage_collections[attribute])))
+            for index in indices:
+                for key, layer, rule, colour in self.stage_layers(stage, index):
+                    if rule is None:
+                        continue
+                    if isinstance(layer, LazyLayer):
+                        masks.layers[key] = (layer, rule)
+                    elif isinstance(layer, PaletteLayer):
+                        masks.layers[key] = (layer, rule)
+                        self.palette_tints[key] = self.palette_tint(layer, rule)
+                    else:
+                        masks[key] = self.tint_mask(layer, rule)
+        return masks
+
+    def recolor(self, key, layer, colour):
+        # a tinted copy of a layer, the cached layer itself is never touched
+        # (a palette layer only swaps the colours of its palette and expands that)
+        layer = layer.resolve()
+        if isinstance(layer, PaletteLayer):
+            if key not in self.palette_tints:
+                self.palette_tints[key] = self.palette_tint(layer, self.tint_masks.layers[key][1])
+            entries, channels = self.palette_tints[key]
+            palette = layer.palette.copy()
+            palette[entries, channels] = np.asarray(colour, dtype=np.uint8)[channels]
+            return layer.expand(palette)
+        mask = self.tint_masks[key]
+        tinted = layer.pixels.copy()
+        # the fully tinted pixels as uint32 words: keep their alpha byte, set the three colour bytes
+        words = tinted.view(np.uint32).reshape(-1)
+        alpha, rgb = np.array([[0, 0, 0, 255], list(colour) + [0]], dtype=np.uint8).view(np.uint32)[:, 0]
+        words[mask.pixels] = (words[mask.pixels] & alpha) | rgb
+        if len(mask.channels):
+            tinted.reshape(-1)[mask.channels] = np.asarray(colour, dtype=np.uint8)[mask.channels & 3]
+        return tinted
+
+    def derived(self, store, kind, key, build, store_key = None):
+        # a form of a layer which is made on first use (premultiplied, batch, scaled ...): in the
+        # bounded derived_cache for lazy and compact layers, else kept in store (under store_key)
+        # next to the layers, which are all in memory anyway
+        if self.derived_cache is not None:
+            return self.derived_cache.get((kind, key), build)
+        store_key = key if store_key is None else store_key
+        if store_key not in store:
+            store[store_key] = build()
+        return store[store_key]
+
+    #------------------------------#
+    # Premultiplied compositing    #
+    #------------------------------#
+    def premultiplied_layer(self, key, layer, rule):
+        # a layer with premultiplied alpha (rounded, in uint16), made the first time it is used. Over an
+        # opaque pixel simply replaces the canvas, so those are copied (4 x uint16 = one uint64); the
+        # semi-transparent (edge) pixels are kept apart, with 255 - alpha. The tinted channels are
+        # left at 0 and tinted per avatar: set on opaque pixels, colour * alpha / 255 on edge pixels
+        return self.derived(self._premultiplied, 'premultiplied', key, lambda: self.prepare_premultiplied(key, layer, rule))
+
+    def prepare_premultiplied(self, key, layer, rule):
+        pixels = layer.pixels.astype(np.uint16)
+        alpha = pixels[:, :, 3:]
+        premultiplied = pixels * alpha
+        premultiplied += 128
+        premultiplied += premultiplied >> 8
+        premultiplied >>= 8
+        premultiplied[:, :, 3:] = alpha
+        tint = None
+        if rule is not None:
+            tint = self.tint_flat(self.tint_masks[key])
+            premultiplied.reshape(-1)[tint] = 0
+        opaque = alpha[:, :, 0] == 255
+        py, px = np.nonzero((alpha[:, :, 0] > 0) & ~opaque)
+        partial = (py, px, premultiplied[py, px], 255 - alpha[py, px])
+
+        tinted = None
+        if tint is not None:
+            y, x, channel = np.unravel_index(tint, pixels.shape)
+            solid = opaque[y, x]
+            # opaque pixels with all three channels tinted get the whole colour (one uint64), the other
+            # tinted channels of opaque pixels are set one by one (as offsets in the (height, width, 4) canvas)
+            count = np.zeros(pixels.shape[:2], dtype=np.uint8)
+            np.add.at(count, (y[solid], x[solid]), 1)
+            full = count == 3
+            single = solid & ~full[y, x]
+            offsets = (y[single] * self.canvas_size[0] + x[single]) * 4 + channel[single]
+            # the edge pixel (row of partial) of every tinted channel which is not opaque
+            rows = np.full(pixels.shape[:2], -1, dtype=np.int64)
+            rows[py, px] = np.arange(len(py))
+            edge = ~solid
+            tinted = (full, (offsets, channel[single]),
+                      (rows[y[edge], x[edge]], channel[edge], alpha[y[edge], x[edge], 0]))
+        return premultiplied.view(np.uint64)[:, :, 0], opaque, partial, tinted
+
+    def composite_over(self, stack, colours):
+        # composite (key, layer, rule, colour) layers with the 'over' operator on a premultiplied uint16
+        # canvas which is kept between calls (one per thread): dst = src + dst * (255 - alpha) / 255, rounded exactly
+        # ((t + (t >> 8)) >> 8 with t = x + 128 is x / 255 rounded, for x <= 255 * 255).
+        # Only the windows of the layers are touched, and the result is a (height, width, 4) straight alpha array
+        canvas = getattr(self._local, 'canvas', None)
+        if canvas is None:
+            canvas = self._local.canvas = np.zeros(self.canvas_shape, dtype=np.uint16)
+        canvas64 = canvas.view(np.uint64)[:, :, 0]
+        width = self.canvas_size[0]
+        top, left, bottom, right = self.canvas_size[1], width, 0, 0
+
+        for key, layer, rule, colour in stack:
+            src, opaque, (py, px, partial_src, inverse), tinted = self.premultiplied_layer(key, layer, rule)
+            h, w = src.shape
+            region = canvas[layer.top:layer.top + h, layer.left:layer.left + w]
+            region64 = canvas64[layer.top:layer.top + h, layer.left:layer.left + w]
+            np.copyto(region64, src, where=opaque)
+            if tinted is not None:
+                colour = np.asarray(colours[colour], dtype=np.uint16)
+                full, (offsets, channel), (rows, edge_channel, edge_alpha) = tinted
+                np.copyto(region64, np.append(colour, 255).astype(np.uint16).view(np.uint64), where=full)
+                canvas.reshape(-1)[offsets + (layer.top * width + layer.left) * 4] = colour[channel]
+            if len(py):
+                dst = region[py, px]
+                dst *= inverse
+                dst += 128
+                dst += dst >> 8
+                dst >>= 8
+                dst += partial_src
+                if tinted is not None and len(rows):
+                    values = colour[edge_channel] * edge_alpha + 128
+                    dst[rows, edge_channel] += (values + (values >> 8)) >> 8
+                region[py, px] = dst
+            top, left = min(top, layer.top), min(left, layer.left)
+            bottom, right = max(bottom, layer.top + h), max(right, layer.left + w)
+
+        # back to straight alpha, and clear the canvas for the next call
+        # (opaque and transparent pixels are the same either way, only the edge pixels are divided)
+        avatar = np.zeros(self.canvas_shape, dtype=np.uint8)
+        if bottom > top and right > left:
+            region = canvas[top:bottom, left:right]
+            window = avatar[top:bottom, left:right]
+            np.copyto(window, region, casting='unsafe')
+            py, px = np.nonzero(window[:, :, 3] - np.uint8(1) < 254)
+            edge = region[py, px].astype(np.float32)
+            edge[:, :3] *= 255 / edge[:, 3:]
+            window[py, px] = np.minimum(edge + 0.5, 255)
+            region[...] = 0
+        return avatar
+
+    #------------------------------#
+    # Asset pack                   #
+    #------------------------------#
+    # a pack is one file: the magic, the length of a json header, the json header and
+    # (64 byte aligned) the raw pixels of every layer and the tint masks
+    pack_magic = b'SPAGPACK'
+    pack_version = 2
+    pack_alignment = 64
+
+    # the image folders and the attribute they are loaded into
+    pack_categories = {'eyes': 'eyes', 'mouth': 'mouths', 'shirt': 'shirts', 'trousers': 'trousers',
+                       'hair': 'hairs', 'glasses': 'glasses', 'beards': 'beards', 'items': 'items',
+                       'hats': 'hats', 'jewellery': 'jewellery', 'pins': 'pins'}
+
+    def build_pack(self, path):
+        # write the loaded layers (trimmed, with their offset and fg/bg role), their tint masks
+        # and the manifest (if any) to a pack, which SouthParkAvatarGenerator(pack_path=path) memory-maps
+        blobs = []
+        size = 0
+
+        def add(array):
+            nonlocal size
+            blobs.append((size, array))
+            offset = size
+            size += -(-array.nbytes // self.pack_alignment) * self.pack_alignment
+            return offset
+
+        def add_layer(layer):
+            return {'offset': add(layer.pixels), 'shape': list(layer.pixels.shape), 'top': layer.top, 'left': layer.left}
+
+        header = {'version': self.pack_version,
+                  'canvas': list(self.canvas_size),
+                  'manifest': self.manifest,
+                  'categories': {obj: [{role: [add_layer(l) for l in layers] for role, layers in item.items()}
+                                       for item in getattr(self, attribute)]
+                                 for obj, attribute in self.pack_categories.items()},
+                  'body': {part: add_layer(layer) for part, layer in self.body_parts.items()},
+                  'tint_masks': [[list(key), add(mask.pixels), len(mask.pixels), add(mask.channels), len(mask.channels)]
+                                 for key, mask in self.tint_masks.items()]}
+
+        header = json.dumps(header).encode()
+        start = self.pack_data_start(len(header))
+        with open(path, 'wb') as f:
+            f.write(self.pack_magic + len(header).to_bytes(8, 'little') + header)
+            for offset, array in blobs:
+                f.seek(start + offset)
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(start + size)
+        return path
+
+    @classmethod
+    def pack_data_start(cls, header_length):
+        return -(-(len(cls.pack_magic) + 8 + header_length) // cls.pack_alignment) * cls.pack_alignment
+
+    @classmethod
+    def load_pack(cls, path):
+        # memory-map a pack, the layers and the tint masks are read-only views into the file
+        # (or into the given buffer), so they cost (almost) nothing to load and their pages
+        # are shared between processes
+        if isinstance(path, np.ndarray):
+            data = path.view()
+            data.flags.writeable = False
+        else:
+            data = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(data[:len(cls.pack_magic)]) != cls.pack_magic:
+            raise ValueError(f'{path} is not an avatar asset pack')
+        length = int.from_bytes(bytes(data[len(cls.pack_magic):len(cls.pack_magic) + 8]), 'little')
+        header = json.loads(bytes(data[len(cls.pack_magic) + 8:len(cls.pack_magic) + 8 + length]))
+        if header.get('version') != cls.pack_version:
+            raise ValueError(f'{path}: pack version {header.get("version")}, expected {cls.pack_version} (build the pack again)')
+        start = cls.pack_data_start(length)
+
+        def indices(offset, count):
+            return data[start + offset:start + offset + 4 * count].view(np.uint32)
+
+        def layer(entry):
+            shape = tuple(entry['shape'])
+            offset = start + entry['offset']
+            pixels = data[offset:offset + int(np.prod(shape))].reshape(shape)
+            return Layer(pixels, entry['top'], entry['left'])
+
+        return {'canvas': tuple(header.get('canvas', cls.canvas_size)),
+                'manifest': header.get('manifest'),
+                'categories': {obj: [{role: [layer(l) for l in layers] for role, layers in item.items()}
+                                     for item in items]
+                               for obj, items in header['categories'].items()},
+                'body': {part: layer(entry) for part, entry in header['body'].items()},
+                'tint_masks': {tuple(key): TintMask(indices(pixels, pixel_count), indices(channels, channel_count))
+                               for key, pixels, pixel_count, channels, channel_count in header['tint_masks']}}
+
+    #------------------------------#
+    # Batch rendering              #
+    #------------------------------#
+
+    def batch_layer(self, key, layer, rule):
+        # split a layer into its opaque pixels, which are simply copied, and its
+        # semi-transparent (anti-aliased) pixels, which are blended; the tinted
+        # channels are split the same way. The result is kept for the next batches
+        return self.derived(self._batch_layers, 'batch', key, lambda: self.prepare_batch_layer(key, layer, rule))
+
+    def prepare_batch_layer(self, key, layer, rule):
+        pixels = layer.pixels
+        alpha = pixels[:, :, 3]
+        opaque = alpha == 255
+        py, px = np.nonzero((alpha > 0) & (alpha < 255))
+        partial_alpha = alpha[py, px].astype(np.uint16)[:, None]
+        partial = {'y': py + layer.top, 'x': px + layer.left,
+                   'premultiplied': pixels[py, px].astype(np.uint16) * partial_alpha + 128,
+                   'inverse_alpha': 255 - partial_alpha}
+
+        # opaque pixels of which all three channels are tinted simply become the
+        # tint colour, the other tinted channels are set one by one
+        tint = None
+        if rule is not None:
+            mask = self.tint_flat(self.tint_masks[key])
+            y, x, c = (mask >> 2) // pixels.shape[1], (mask >> 2) % pixels.shape[1], mask & 3
+            channels = np.zeros(alpha.shape, dtype=np.uint8)
+            np.add.at(channels, (y, x), 1)
+            filled = opaque & (channels == 3)
+            single = opaque[y, x] & ~filled[y, x]
+            on_partial = ~opaque[y, x]
+            partial_index = np.full(alpha.shape, -1, dtype=np.int64)
+            partial_index[py, px] = np.arange(len(py))
+            tint = {'filled': filled,
+                    'y': y[single] + layer.top, 'x': x[single] + layer.left, 'c': c[single],
+                    'partial': partial_index[y[on_partial], x[on_partial]], 'partial_c': c[on_partial]}
+            opaque = opaque & ~filled
+
+        return layer.window, pixels.view(np.uint32)[:, :, 0], opaque, partial, tint
+
+    def generate_batch(self, n = None, chunk_size = 64, out = None, seed = None, seeds = None, genomes = None,
+                       return_genomes = False, colour_jitter = None, **attributes):
+        # render n avatars at once into a (n, 811, 745, 4) uint8 array, or into out
+        # (the keyword arguments are the same as the ones of sample_batch)
+        # - seeds: one avatar per seed, the same one as generate(seed=seed)
+        # - genomes: one avatar per genome
+        # - colour_jitter: a ColourJitter which varies the tint colours of every avatar (the genomes
+        #   then no longer hold the exact colours, the avatars are reproduced with the same seed)
+        given = sum(arg is not None for arg in (n, seeds, genomes))
+        if given == 0:
+            raise ValueError('generate_batch needs n, seeds or genomes')
+        if given > 1:
+            raise ValueError('generate_batch takes only one of n, seeds and genomes')
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        if seeds is not None:
+            genomes = [self.seeded_genome(s, **attributes) for s in seeds]
+        if genomes is not None:
+            genomes = [self.as_genome(g) for g in genomes]
+            n = len(genomes)
+            attributes = dict(zip(Genome._fields, np.array(genomes, dtype=np.int64).reshape(n, len(Genome._fields)).T))
+        else:
+            attributes = self.sample_batch(n, **attributes)
+        colours = self.batch_colours(attributes, colour_jitter)
+        if out is None:
+            avatars = np.zeros((n,) + self.canvas_shape, dtype=np.uint8)
+        else:
+            avatars = out
+            avatars[...] = 0
+
+        if self.memo is not None and colour_jitter is None:
+            # one by one, every avatar starts from the deepest canvas it shares with the ones before it
+            for i in range(n):
+                self.render_genome(Genome(*[int(attributes[f][i]) for f in Genome._fields]), out=avatars[i])
+        else:
+            for start in range(0, n, chunk_size):
+                chunk = np.arange(start, min(start + chunk_size, n))
+                for stage, attribute in self.layer_stages:
+                    # group the avatars which share the same layer(s)
+                    if attribute is None:
+                        groups = [(None, chunk)]
+                    else:
+                        indices = attributes[attribute][chunk]
+                        groups = [(i, chunk[indices == i]) for i in np.unique(indices) if i >= 0]
+                    for index, members in groups:
+                        self.paint_stage(avatars, members, stage, index, colours)
+        if return_genomes:
+            return avatars, [Genome(*[int(v) for v in values]) for values in zip(*[attributes[f] for f in Genome._fields])]
+        return avatars
+
+    def paint_stage(self, avatars, members, stage, index, colours):
+        # paint the layers of a stage on a group of avatars which share the same item
+        for key, layer, rule, colour in self.stage_layers(stage, index):
+            if layer.empty:
+                continue
+            tint = colours[colour][members] if rule is not None else None
+            self.composite_batch(avatars, members, self.batch_layer(key, layer, rule), tint)
+
+    @staticmethod
+    def composite_batch(avatars, members, prepared, colours = None):
+        # paste a layer on a group of avatars, this is the same blend as PIL's paste:
+        # out = (dst * (255 - alpha) + src * alpha) / 255, rounded the same way,
+        # which comes down to a copy for the opaque pixels
+        window, src, opaque, partial, tint = prepared
+        for member in members:
+            np.copyto(avatars[member, window[0], window[1]].view(np.uint32)[:, :, 0], src, where=opaque)
+
+        premultiplied = partial['premultiplied']
+        if tint is not None:
+            # recolour the tinted pixels of every avatar with its own colour
+            colours = colours.astype(np.uint16)
+            fill = np.concatenate([colours.astype(np.uint8), np.full((len(members), 1), 255, dtype=np.uint8)], axis=1)
+            for member, value in zip(members, fill.view(np.uint32)[:, 0]):
+                np.copyto(avatars[member, window[0], window[1]].view(np.uint32)[:, :, 0], value, where=tint['filled'])
+            avatars[members[:, None], tint['y'], tint['x'], tint['c']] = colours[:, tint['c']]
+
+            premultiplied = np.broadcast_to(premultiplied, (len(members),) + premultiplied.shape).copy()
+            partial_alpha = 255 - partial['inverse_alpha'][tint['partial'], 0]
+            premultiplied[:, tint['partial'], tint['partial_c']] = colours[:, tint['partial_c']] * partial_alpha + 128
+
+        out = avatars[members[:, None], partial['y'], partial['x']].astype(np.uint16)
+        out *= partial['inverse_alpha']
+        out += premultiplied
+        out += out >> 8
+        out >>= 8
+        avatars[members[:, None], partial['y'], partial['x']] = out
+
+
+    #------------------------------#
+    # Multi-resolution rendering   #
+    #------------------------------#
+    # the square part of the canvas which holds the avatar, the same as the (commented out)
+    # thumbnail((646, 702)) + crop((70, 80, 582, 592)) at the end of paint()
+    crop_box = (81, 92, 672, 683)
+
+    @staticmethod
+    def target_size(size):
+        return (size, size) if isinstance(size, (int, np.integer)) else tuple(size)
+
+    def scaled_layer(self, key, layer, rule, size, box):
+        # a layer downscaled to the target size (box of the canvas -> size) once and cached, as
+        # (top, left, premultiplied RGBA, 1 - alpha, tint coverage) float32 planes. A tintable layer is split
+        # into the layer without its tinted channels and the (premultiplied) coverage of those
+        # channels: the tinted layer is base + colour * coverage / 255, as scaling is linear
+        return self.derived(self.pyramids.setdefault((size, box), {}), 'scaled', (size, box, key),
+                            lambda: self.prepare_scaled_layer(key, layer, rule, size, box), key)
+
+    def prepare_scaled_layer(self, key, layer, rule, size, box):
+        sx, sy = size[0] / (box[2] - box[0]), size[1] / (box[3] - box[1])
+        h, w = layer.pixels.shape[:2]
+        x0 = max(0, math.floor((layer.left - box[0]) * sx))
+        y0 = max(0, math.floor((layer.top - box[1]) * sy))
+        x1 = min(size[0], math.ceil((layer.left + w - box[0]) * sx))
+        y1 = min(size[1], math.ceil((layer.top + h - box[1]) * sy))
+        if layer.empty or x1 <= x0 or y1 <= y0:
+            return None
+
+        # the part of the layer which ends up in target pixels x0:x1, y0:y1 (padded with transparent pixels)
+        source = (box[0] + x0 / sx - layer.left, box[1] + y0 / sy - layer.top,
+                  box[0] + x1 / sx - layer.left, box[1] + y1 / sy - layer.top)
+        px0, py0 = math.floor(source[0]), math.floor(source[1])
+        px1, py1 = math.ceil(source[2]), math.ceil(source[3])
+        iy0, iy1, ix0, ix1 = max(0, py0), min(h, py1), max(0, px0), min(w, px1)
+        inside = (slice(iy0 - py0, iy1 - py0), slice(ix0 - px0, ix1 - px0))
+        padded = np.zeros((py1 - py0, px1 - px0, 4), dtype=np.float32)
+        padded[inside] = layer.pixels[iy0:iy1, ix0:ix1]
+
+        alpha = padded[:, :, 3:] / 255
+        planes = [padded[:, :, c] * alpha[:, :, 0] for c in range(3)] + [padded[:, :, 3]]
+        if rule is not None:
+            tinted = np.zeros(layer.pixels.shape[:2] + (3,), dtype=bool)
+            mask = self.tint_flat(self.tint_masks[key])
+            tinted.reshape(-1)[(mask >> 2) * 3 + (mask & 3)] = True
+            coverage = np.zeros(padded.shape[:2] + (3,), dtype=np.float32)
+            coverage[inside] = tinted[iy0:iy1, ix0:ix1]
+            for c in range(3):
+                planes[c] = planes[c] * (1 - coverage[:, :, c])
+            planes += [coverage[:, :, c] * padded[:, :, 3] for c in range(3)]
+
+        resize_box = (source[0] - px0, source[1] - py0, source[2] - px0, source[3] - py0)
+        scaled = np.stack([np.asarray(Image.fromarray(plane).resize((x1 - x0, y1 - y0), Image.BOX, box=resize_box))
+                           for plane in planes], axis=-1)
+        keep = 1 - scaled[:, :, 3:4] / 255
+        return y0, x0, scaled[:, :, :4].copy(), keep, scaled[:, :, 4:].copy() if rule is not None else None
+
+    def build_pyramid(self, size, box = None):
+        # scale every layer to the target size up front (render_scaled scales them on first use),
+        # returns the number of layers
+        size, box = self.target_size(size), tuple(box or self.crop_box)
+        count = 0
+        for stage, attribute in self.layer_stages:
+            for index in self.attribute_values(attribute) if attribute is not None else [None]:
+                if index is None or index >= 0:
+                    for key, layer, rule, colour in self.stage_layers(stage, index):
+                        self.scaled_layer(key, layer, rule, size, box)
+                        count += 1
+        return count
+
+    def render_scaled(self, genome, size, box = None):
+        # render an avatar straight at the target size: the box of the canvas (crop_box by default)
+        # is scaled to size (an int for a square, or (width, height)), using pre-scaled layers.
+        # The layers are composited with the (premultiplied) 'over' operator, so the result is close
+        # to, but not exactly the same as, a full resolution avatar which is cropped and resized
+        # afterwards: paint() blends like PIL's paste, which treats the alpha channel as a colour
+        size = self.target_size(size)
+        box = tuple(box or self.crop_box)
+        genome = self.as_genome(genome)
+        colours = self.batch_colours({f: np.array([v]) for f, v in zip(Genome._fields, genome)})
+        canvas = np.zeros((size[1], size[0], 4), dtype=np.float32)
+
+        for stage, attribute in self.layer_stages:
+            index = getattr(genome, attribute) if attribute is not None else None
+            if index is not None and index < 0:
+                continue
+            for key, layer, rule, colour in self.stage_layers(stage, index):
+                scaled = self.scaled_layer(key, layer, rule, size, box)
+                if scaled is None:
+                    continue
+                top, left, src, keep, coverage = scaled
+                region = canvas[top:top + src.shape[0], left:left + src.shape[1]]
+                region *= keep
+                region += src
+                if coverage is not None:
+                    tint = np.multiply(coverage, (colours[colour][0] / 255).astype(np.float32))
+                    region[:, :, :3] += tint
+
+        # back to straight (not premultiplied) alpha
+        alpha = canvas[:, :, 3:]
+        canvas[:, :, :3] *= np.divide(255, alpha, out=np.zeros_like(alpha), where=alpha > 0)
+        np.clip(canvas, 0, 255, out=canvas)
+        canvas += 0.5
+        return canvas.astype(np.uint8)
+
+    #------------------------------#
+    # Sprite sheets                #
+    #------------------------------#
+    def sheet_genomes(self, count, seeds = None, genomes = None):
+        # the genomes (and seeds) of the tiles of a sheet: one per seed (the avatar of
+        # generate(seed=seed)), the given genomes or count new ones
+        if seeds is not None:
+            seeds = [int(seed) for seed in seeds]
+            genomes = [self.seeded_genome(seed) for seed in seeds]
+        elif genomes is not None:
+            genomes = [self.as_genome(g) for g in genomes]
+        else:
+            genomes = [self.sample_genome() for _ in range(count)]
+        if len(genomes) > count:
+            raise ValueError(f'{len(genomes)} avatars do not fit in {count} tiles')
+        return genomes, seeds
+
+    def render_tile(self, genome, tile, size, box):
+        # render an avatar straight into its tile (a view of the sheet)
+        if size is None:
+            self.render(genome, out=tile)
+        else:
+            tile[...] = self.render_scaled(genome, size, box)
+
+    def iter_sheet(self, rows, cols, genomes, size = None, box = None, band = None):
+        # yield every row of tiles of a sheet as a (tile height, cols * tile width, 4) band, the
+        # same buffer (band) is painted again for every row
+        width, height = self.target_size(size) if size is not None else self.canvas_size
+        band = np.zeros((height, cols * width, 4), dtype=np.uint8) if band is None else band
+        for row in range(rows):
+            for col in range(cols):
+                i = row * cols + col
+                tile = band[:, col * width:(col + 1) * width]
+                if i < len(genomes):
+                    self.render_tile(genomes[i], tile, size, box)
+                else:
+                    tile[...] = 0
+            yield row, band
+
+    def sheet_manifest(self, rows, cols, genomes, seeds, size, box):
+        # which genome (and seed) is in which tile, as the json manifest of a sheet
+        width, height = self.target_size(size) if size is not None else self.canvas_size
+        tiles = []
+        for i, genome in enumerate(genomes):
+            row, col = divmod(i, cols)
+            tile = {'row': row, 'col': col, 'x': col * width, 'y': row * height,
+                    'genome': genome._asdict(), 'key': f'{self.pack_genome(genome):x}'}
+            if seeds is not None:
+                tile['seed'] = seeds[i]
+            tiles.append(tile)
+        return {'rows': rows, 'cols': cols, 'tile_width': width, 'tile_height': height,
+                'box': list(box or self.crop_box) if size is not None else None, 'tiles': tiles}
+
+    @staticmethod
+    def png_chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    def render_sheet(self, rows, cols, size = None, seeds = None, genomes = None, box = None, out = None,
+                     path = None, manifest_path = None, compress_level = 6):
+        # a contact sheet of rows x cols avatars (full size, or size as in generate(size=...)), every avatar
+        # rendered straight into its tile, and its manifest (see sheet_manifest). The sheet goes to:
+        # - path '*.png': a png streamed row of tiles by row of tiles, only one row is ever in memory
+        #   (the sheet returned is None)
+        # - path '*.npy': a memory mapped .npy sheet
+        # - out, or a new array
+        # the manifest is also written to manifest_path (default: path + '.json' when path is given)
+        width, height = self.target_size(size) if size is not None else self.canvas_size
+        genomes, seeds = self.sheet_genomes(rows * cols, seeds, genomes)
+        manifest = self.sheet_manifest(rows, cols, genomes, seeds, size, box)
+        if manifest_path is None and path is not None:
+            manifest_path = path + '.json'
+
+        sheet = None
+        if path is not None and path.endswith('.png'):
+            # 8 bit RGBA, every scanline with the Sub filter (flat colours turn into runs of zeros)
+            compressor = zlib.compressobj(compress_level)
+            with open(path, 'wb') as f:
+                f.write(b'\x89PNG\r\n\x1a\n')
+                f.write(self.png_chunk(b'IHDR', struct.pack('>IIBBBBB', cols * width, rows * height, 8, 6, 0, 0, 0)))
+                for row, band in self.iter_sheet(rows, cols, genomes, size, box):
+                    lines = band.reshape(height, -1)
+                    filtered = np.empty((height, lines.shape[1] + 1), dtype=np.uint8)
+                    filtered[:, 0] = 1
+                    filtered[:, 1:5] = lines[:, :4]
+                    np.subtract(lines[:, 4:], lines[:, :-4], out=filtered[:, 5:])
+                    data = compressor.compress(filtered)
+                    if data:
+                        f.write(self.png_chunk(b'IDAT', data))
+                f.write(self.png_chunk(b'IDAT', compressor.flush()))
+                f.write(self.png_chunk(b'IEND', b''))
+        else:
+            shape = (rows * height, cols * width, 4)
+            if path is not None:
+                sheet = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+            else:
+                sheet = np.zeros(shape, dtype=np.uint8) if out is None else out
+            for i in range(rows * cols):
+                row, col = divmod(i, cols)
+                tile = sheet[row * height:(row + 1) * height, col * width:(col + 1) * width]
+                if i < len(genomes):
+                    self.render_tile(genomes[i], tile, size, box)
+                else:
+                    tile[...] = 0
+            if isinstance(sheet, np.memmap):
+                sheet.flush()
+
+        if manifest_path is not None:
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f, indent=1)
+        return sheet, manifest
+
+    #------------------------------#
+    # Enumeration                  #
+    #------------------------------#
+    def attribute_values(self, field):
+        # every value a genome field can take
+        if field in ('hair', 'glasses', 'beard'):
+            return [-1] + list(range(len(getattr(self, self.stage_collections[field]))))
+        if field in ('trouser_jitter', 'beard_jitter'):
+            return [0]
+        if field.endswith('_colour'):
+            return list(range(len(getattr(self, field + 's'))))
+        return list(range(len(getattr(self, self.stage_collections[field]))))
+
+    def iter_combinations(self, offset = 0, render = True, **constraints):
+        # stream every combination of attributes (see AvatarCombinations), a constraint is an
+        # index or a list of indices (-1: without the optional item), the jitters default to 0
+        return AvatarCombinations(self, offset, render, **constraints)
+
+    def editor(self, genome = None):
+        # an AvatarEditor of a genome (default: a new one), which recomposites only what an edit changes
+        return AvatarEditor(self, genome)
+
+    #------------------------------#
+    # Dataset export               #
+    #------------------------------#
+    def export_dataset(self, n, out_dir, shard_size = 1000, format = 'tar', **kwargs):
+        # write n avatars to sharded tar / npy / png files with a sidecar index (see avatarDataset.py)
+        from avatarDataset import export_dataset
+        return export_dataset(self, n, out_dir, shard_size=shard_size, format=format, **kwargs)
+
+    #------------------------------#
+    # Layer-stack memo             #
+    #------------------------------#
+    def stage_key(self, stage, genome):
+        # the genome values a stage depends on (its item, tint colours and jitters, see build_stage_fields)
+        attribute, fields = self.stage_fields[stage]
+        if attribute is not None and getattr(genome, attribute) < 0:
+            return (-1,)
+        return tuple(getattr(genome, field) for field in fields)
+
+    def stage_window(self, stage, index):
+        # the window of the canvas which is covered by the layers of a stage (None: nothing)
+        windows = [layer.window for key, layer, rule, colour in self.stage_layers(stage, index) if not layer.empty]
+        if not windows:
+            return None
+        return (slice(min(w[0].start for w in windows), max(w[0].stop for w in windows)),
+                slice(min(w[1].start for w in windows), max(w[1].stop for w in windows)))
+
+    def render_genome(self, genome, out = None, memo = None):
+        # render a single avatar into a (811, 745, 4) array, starting from the deepest partial
+        # canvas in the memo (the generator's one by default) which has the same layers so far
+        memo = memo if memo is not None else self.memo
+        genome = Genome(*[int(v) for v in genome])
+        avatar = np.zeros(self.canvas_shape, dtype=np.uint8) if out is None else out
+        attributes = {f: np.array([v]) for f, v in zip(Genome._fields, genome)}
+        colours = self.batch_colours(attributes)
+        members = np.zeros(1, dtype=np.int64)
+
+        keys = [self.stage_key(stage, genome) for stage, attribute in self.layer_stages]
+        depth, node = 0, None
+        if memo is not None:
+            depth, node = memo.deepest(keys)
+        avatar[...] = 0
+        if node is not None:
+            memo.restore(node, avatar)
+
+        for d in range(depth, len(self.layer_stages)):
+            stage, attribute = self.layer_stages[d]
+            index = int(attributes[attribute][0]) if attribute is not None else None
+            window = None
+            if index is None or index >= 0:
+                self.paint_stage(avatar[None], members, stage, index, colours)
+                window = self.stage_window(stage, index)
+            # keep the stage (the complete avatar is left to the render cache)
+            if memo is not None and d < len(self.layer_stages) - 1:
+                node = memo.store(node, keys[d], window, avatar)
+                if node is None:
+                    memo = None
+        return avatar
+
+    #------------------------------#
+    # Thread-safe rendering        #
+    #------------------------------#
+    # render() only reads the generator: the attributes come from the spec (not from the
+    # instance attributes which generate() sets), the avatar is composited into a buffer of its
+    # own (or out) and the premultiplied compositor uses a canvas per thread. The layers which
+    # are prepared on first use (see derived, and the lazy tint masks) may be prepared
+    # twice by two threads, never half. So one generator can serve a thread pool; the
+    # compositing is numpy copies and fancy indexing on large arrays, which run without the GIL
+    def genome_colours(self, genome):
+        # the tint colours of a genome, as (3,) arrays
+        attributes = {f: np.array([v]) for f, v in zip(Genome._fields, genome)}
+        return {colour: values[0] for colour, values in self.batch_colours(attributes).items()}
+
+    def genome_layers(self, genome):
+        # the (key, layer, rule, colour) layers of a genome in paint order
+        layers = []
+        for stage, attribute in self.layer_stages:
+            index = getattr(genome, attribute) if attribute is not None else None
+            if index is not None and index < 0:
+                continue
+            layers += [layer for layer in self.stage_layers(stage, index) if not layer[1].empty]
+        return layers
+
+    def render(self, spec, out = None):
+        # the (811, 745, 4) uint8 avatar of a spec (a Genome, a tuple of its values or a packed
+        # genome), the same pixels as generate() for that genome
+        start = self.clock()
+        genome = self.as_genome(spec)
+        if self.compositor == 'premultiplied':
+            avatar = self.composite_over(self.genome_layers(genome), self.genome_colours(genome))
+            if out is not None:
+                out[...] = avatar
+                avatar = out
+        else:
+            avatar = np.zeros(self.canvas_shape, dtype=np.uint8) if out is None else out
+            avatar[...] = 0
+            colours = {colour: values[None] for colour, values in self.genome_colours(genome).items()}
+            members = np.zeros(1, dtype=np.int64)
+            for stage, attribute in self.layer_stages:
+                index = getattr(genome, attribute) if attribute is not None else None
+                if index is None or index >= 0:
+                    self.paint_stage(avatar[None], members, stage, index, colours)
+        if self.on_stage is not None:
+            self.on_stage('render', self.clock() - start)
+        return avatar
+
     
     #------------------------------#
     # Get and setters              #
@@ -403,18 +2550,18 @@ class SouthParkAvatarGenerator:
     # body parts #
     #------------#
     def get_body_parts(self):
+        if self.pack:
+            return self.pack['body']
+        start = self.clock()
         body_parts = {}
-        body_parts['body'] =  np.array(Image.open(f'{self.images_path}/body/body.png'))
-        body_parts['head'] =  np.array(Image.open(f'{self.images_path}/body/head.png'))
-        body_parts['chin'] =  np.array(Image.open(f'{self.images_path}/body/chin.png'))
-        body_parts['feet'] =  np.array(Image.open(f'{self.images_path}/body/feet.png'))
-        body_parts['hands_bg'] =  np.array(Image.open(f'{self.images_path}/body/hands_bg.png'))
-        body_parts['hands_fg'] =  np.array(Image.open(f'{self.images_path}/body/hands_fg.png'))
-        body_parts['hands_item_bg'] =  np.array(Image.open(f'{self.images_path}/body/hands_item_bg.png'))
-        body_parts['hands_item_fg'] =  np.array(Image.open(f'{self.images_path}/body/hands_item_fg.png'))
-        body_parts['underware'] =  np.array(Image.open(f'{self.images_path}/body/underware.png'))
-        body_parts['arms'] =  np.array(Image.open(f'{self.images_path}/body/arms.png'))
-        
+        for part in self.body_part_names:
+            if self.manifest is not None:
+                entry = self.manifest['body'][part]
+                body_parts[part] = self.read_layer(f'{self.images_path}/{entry["file"]}', entry.get('bbox'))
+            else:
+                body_parts[part] = self.read_layer(f'{self.images_path}/body/{part}.png')
+        if self.on_stage is not None:
+            self.on_stage('load.body', self.clock() - start)
         return body_parts
     
     #-------------#
@@ -625,4 +2772,13 @@ class SouthParkAvatarGenerator:
             return self.set_property('pins', 'pins_proba', 'pin', index)
   
     def get_pin(self):
-        return self.pin
\ No newline at end of file
+        return self.pin
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='compile the images folder into an asset pack')
+    parser.add_argument('pack', help='the pack file to write')
+    parser.add_argument('--images', default='images', help='the images folder')
+    args = parser.parse_args()
+    SouthParkAvatarGenerator(args.images).build_pack(args.pack)